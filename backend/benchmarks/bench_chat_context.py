@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Karion chat context truncation benchmark
+Grows a conversation turn by turn (same fold/budget logic as /api/ai/chat) and
+reports prompt size and build time: prompt tokens must stay flat as turns grow.
+
+    python benchmarks/bench_chat_context.py [--turns 2000]
+"""
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+os.environ.setdefault("LLM_CACHE_PATH", "")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import server  # noqa: E402
+
+USER_TEXT = "Oggi ho aperto due trade fuori piano su NAS100 dopo una perdita, come evito il revenge trading?"
+ASSISTANT_TEXT = ("Capisco. Dopo una perdita fermati 15 minuti, rileggi il piano e accetta solo setup A+. "
+                  "Scrivi nel journal cosa hai provato prima di rientrare. ") * 3
+
+
+def run(total_turns: int, checkpoints):
+    summary, turns = "", []
+    rows = []
+    for i in range(1, total_turns + 1):
+        start = time.perf_counter()
+        prompt, stats = server.build_chat_prompt(summary, turns, f"{USER_TEXT} (#{i})")
+        build_us = (time.perf_counter() - start) * 1e6
+
+        # Same bookkeeping as append_conversation_turns
+        turns = turns + [{"role": "user", "content": USER_TEXT}, {"role": "assistant", "content": ASSISTANT_TEXT}]
+        if len(turns) > server.CHAT_MAX_STORED_TURNS:
+            summary = server.fold_into_summary(summary, turns[:-server.CHAT_MAX_STORED_TURNS])
+            turns = turns[-server.CHAT_MAX_STORED_TURNS:]
+
+        naive_tokens = server.estimate_tokens((USER_TEXT + ASSISTANT_TEXT) * (i - 1) + USER_TEXT)
+        if i in checkpoints:
+            rows.append((i, naive_tokens, stats["prompt_tokens"], stats["turns_included"], build_us))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=2000)
+    args = parser.parse_args()
+
+    checkpoints = {1, 5, 10, 25, 50, 100, 250, 500, 1000, 2000, args.turns}
+    rows = run(args.turns, {c for c in checkpoints if c <= args.turns})
+
+    print(f"budget={server.CHAT_CONTEXT_TOKEN_BUDGET} tokens, stored turns<={server.CHAT_MAX_STORED_TURNS}")
+    print(f"{'exchange':>8} {'full-history tok':>17} {'prompt tok':>11} {'turns used':>11} {'build us':>9}")
+    for i, naive, prompt_tokens, included, build_us in rows:
+        print(f"{i:>8} {naive:>17} {prompt_tokens:>11} {included:>11} {build_us:>9.1f}")
+
+    sizes = [r[2] for r in rows]
+    assert max(sizes) <= server.CHAT_CONTEXT_TOKEN_BUDGET + server.CHAT_SUMMARY_TOKEN_BUDGET, "prompt exceeded budget"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Response format benchmark
+Encodes a Monte Carlo result (raw and LTTB-downsampled) and a trade list as JSON,
+MessagePack and Arrow IPC, reporting encode time and bytes on the wire. Binary
+formats whose library is not installed are reported as skipped.
+
+    python benchmarks/bench_formats.py [--trades 5000] [--mc-trades 2000] [--repeat 5]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+from fastapi.encoders import jsonable_encoder
+
+os.environ.setdefault("LLM_CACHE_PATH", "")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import server  # noqa: E402
+
+
+def synthetic_trades(n: int) -> list:
+    """Trade documents as stored by create_trade"""
+    return [
+        server.TradeRecord(
+            user_id="bench", symbol=("EURUSD", "XAUUSD", "NAS100")[i % 3],
+            entry_price=1.08 + i * 1e-5, exit_price=1.081 + i * 1e-5,
+            profit_loss=(i % 7 - 3) * 12.5, profit_loss_r=(i % 7 - 3) / 2,
+            date=f"2026-{i % 12 + 1:02d}-{i % 28 + 1:02d}", rules_followed=["stop"]
+        ).model_dump()
+        for i in range(n)
+    ]
+
+
+def encode_json(payload) -> bytes:
+    """What the JSON path does: plain types, jsonable_encoder, stdlib json"""
+    return json.dumps(jsonable_encoder(server.to_builtin(payload))).encode()
+
+
+def best_of(repeat: int, fn):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = fn()
+        times.append(time.perf_counter() - start)
+    return min(times), body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--trades", type=int, default=5000)
+    parser.add_argument("--mc-trades", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    params = dict(win_rate=0.5, avg_win=1.5, avg_loss=1.0, num_trades=args.mc_trades)
+    payloads = {
+        "montecarlo raw": server.run_monte_carlo(server.MonteCarloParams(**params)),
+        "montecarlo max_points=300": server.run_monte_carlo(server.MonteCarloParams(**params, max_points=300)),
+        f"trades x{args.trades:,}": synthetic_trades(args.trades),
+    }
+
+    print(f"{'payload':28} {'format':8} {'encode ms':>10} {'bytes':>12}")
+    for name, payload in payloads.items():
+        for fmt in ("json", *server.BINARY_FORMATS):
+            if fmt != "json" and server.optional_module(server.BINARY_FORMATS[fmt][0]) is None:
+                print(f"{name:28} {fmt:8} {'skipped (not installed)':>23}")
+                continue
+            if fmt == "json":
+                seconds, body = best_of(args.repeat, lambda: encode_json(payload))
+            else:
+                seconds, body = best_of(args.repeat, lambda: server.encode_response(payload, fmt).body)
+            print(f"{name:28} {fmt:8} {seconds * 1000:10.2f} {len(body):12,}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Metrics middleware overhead benchmark
+Drives a minimal ASGI app directly (no server, no network) with and without
+MetricsMiddleware, plus a bare timed() block, and reports the added cost per call.
+
+    python benchmarks/bench_metrics.py [--requests 200000]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+os.environ.setdefault("LLM_CACHE_PATH", "")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import server  # noqa: E402
+
+
+class FakeRoute:
+    path = "/api/bench/{item_id}"
+
+
+async def inner_app(scope, receive, send):
+    scope["route"] = FakeRoute
+    await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/json")]})
+    await send({"type": "http.response.body", "body": b"{}"})
+
+
+async def drive(app, n: int) -> float:
+    scope = {"type": "http", "method": "GET", "path": "/api/bench/1", "headers": []}
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        pass
+
+    start = time.perf_counter()
+    for _ in range(n):
+        await app(dict(scope), receive, send)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200_000)
+    args = parser.parse_args()
+
+    bare = asyncio.run(drive(inner_app, args.requests))
+    wrapped = asyncio.run(drive(server.MetricsMiddleware(inner_app), args.requests))
+
+    start = time.perf_counter()
+    for _ in range(args.requests):
+        with server.timed("bench"):
+            pass
+    timed_s = time.perf_counter() - start
+
+    per_request = lambda s: s / args.requests * 1e6
+    print(f"requests:            {args.requests:,}")
+    print(f"bare app:            {per_request(bare):6.2f} us/request")
+    print(f"with middleware:     {per_request(wrapped):6.2f} us/request")
+    print(f"middleware overhead: {per_request(wrapped - bare):6.2f} us/request")
+    print(f"timed() block:       {per_request(timed_s):6.2f} us/call")
+
+
+if __name__ == "__main__":
+    main()
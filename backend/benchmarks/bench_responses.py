@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+List endpoint serialization benchmark
+CPU time per request to turn stored documents into a response body, comparing the
+response_model path (Pydantic validation + stdlib JSON) with trusted_response
+(model_projection documents straight to orjson).
+
+    python benchmarks/bench_responses.py [--rows 500 5000] [--repeat 5]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+from typing import List
+
+from fastapi._compat import ModelField
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from pydantic.fields import FieldInfo
+
+os.environ.setdefault("LLM_CACHE_PATH", "")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import server  # noqa: E402
+
+
+def documents(model: type, n: int) -> list:
+    """n stored documents as the create endpoints write them"""
+    samples = {
+        server.TradeRecord: lambda i: server.TradeRecord(
+            user_id="bench", symbol="EURUSD", entry_price=1.08, exit_price=1.081 + i * 1e-5,
+            profit_loss=(i % 7 - 3) * 12.5, profit_loss_r=(i % 7 - 3) / 2, date="2026-10-01",
+            rules_followed=["stop", "size"]),
+        server.PsychologyCheckin: lambda i: server.PsychologyCheckin(
+            user_id="bench", date="2026-10-01", confidence=7, discipline=i % 10, emotional_state="calmo",
+            sleep_hours=7.5, sleep_quality=6, notes="ok"),
+        server.JournalEntry: lambda i: server.JournalEntry(
+            user_id="bench", date="2026-10-01", plan_respected=True, emotions="calmo", lucid_state=True,
+            optimization_notes="Entrare solo su A+", errors_today="Nessuno", lessons_learned="Pazienza " * 5),
+        server.CommunityPost: lambda i: server.CommunityPost(
+            user_id="bench", user_name="Trader", caption="BTC long dal supporto weekly", profit=10.0 * i,
+            comment_count=2, latest_comments=[{"id": "c", "user_name": "A", "text": "Grande!"}]),
+    }
+    return [samples[model](i).model_dump() for i in range(n)]
+
+
+def cpu_per_request(repeat: int, fn) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.process_time()
+        fn()
+        times.append(time.process_time() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[500, 5000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'model':18} {'rows':>6} {'response_model ms':>18} {'trusted ms':>11} {'speedup':>8}")
+    for model in (server.TradeRecord, server.PsychologyCheckin, server.JournalEntry, server.CommunityPost):
+        field = ModelField(name="Response", field_info=FieldInfo(annotation=List[model]), mode="serialization")
+        for rows in args.rows:
+            docs = documents(model, rows)
+
+            def before():
+                content = asyncio.run(serialize_response(field=field, response_content=docs, is_coroutine=True))
+                return JSONResponse(content).body
+
+            def after():
+                return server.trusted_response(model, docs).body
+
+            slow = cpu_per_request(args.repeat, before)
+            fast = cpu_per_request(args.repeat, after)
+            print(f"{model.__name__:18} {rows:6,} {slow * 1000:18.2f} {fast * 1000:11.2f} {slow / fast:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
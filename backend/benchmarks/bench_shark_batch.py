@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Shark Mind batch scoring benchmark
+Scores N synthetic EOD rows with score_eod_batch and compares against the scalar
+engine (calculate_shark_scores + detect_patterns + generate_tomorrow_protocol)
+timed on a sample and extrapolated.
+
+    python benchmarks/bench_shark_batch.py [--rows 1000000] [--scalar-sample 20000]
+"""
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+os.environ.setdefault("LLM_CACHE_PATH", "")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import server  # noqa: E402
+
+
+def synthetic_columns(n: int, seed: int = 1) -> dict:
+    """Random EOD columns in the same layout eod_requests_to_columns produces"""
+    rules = server.get_shark_rules()
+    rng = np.random.default_rng(seed)
+    has_telemetry = rng.random(n) < 0.7
+    columns = {
+        "stress": rng.integers(1, 11, n),
+        "focus": rng.integers(1, 11, n),
+        "energy": rng.integers(1, 11, n),
+        "tension": rng.integers(1, 11, n),
+        "urge": rng.integers(0, 11, n),
+        "unplanned": np.where(has_telemetry, rng.integers(0, 6, n), 0),
+        "phase": rng.integers(0, len(server.SHARK_PHASES), n),
+        "limits_respected": rng.random(n) < 0.7,
+        "shutdown_done": rng.random(n) < 0.4,
+        "breaks_taken": rng.random(n) < 0.5,
+        "has_telemetry": has_telemetry,
+        "overtrading_flag": has_telemetry & (rng.random(n) < 0.2),
+        "state_calm": rng.random(n) < 0.3,
+        # Each declared trigger selected with p=0.2
+        "trigger_mask": sum(np.where(rng.random(n) < 0.2, bit, 0) for bit in rules.trigger_bits.values()),
+    }
+    columns["fomo"] = (columns["trigger_mask"] & rules.trigger_mask(["FOMO"])) != 0
+    columns["revenge"] = (columns["trigger_mask"] & rules.trigger_mask(["REVENGE", "CHASING"])) != 0
+    return columns
+
+
+def columns_to_requests(c: dict, rows) -> list:
+    """Rebuild SharkMindRequest objects for the scalar path"""
+    rules = server.get_shark_rules()
+    requests = []
+    for i in rows:
+        eod = server.EODPsychInput(
+            date="2025-01-01",
+            stress_1_10=int(c["stress"][i]), focus_1_10=int(c["focus"][i]), energy_1_10=int(c["energy"][i]),
+            physical_tension_1_10=int(c["tension"][i]), urge_to_trade_0_10=int(c["urge"][i]),
+            dominant_state_one_word="calm" if c["state_calm"][i] else "teso",
+            behaviors={"limits_respected": bool(c["limits_respected"][i]),
+                       "shutdown_ritual_done": bool(c["shutdown_done"][i]),
+                       "breaks_taken": bool(c["breaks_taken"][i])},
+            triggers_selected=[t for t, bit in rules.trigger_bits.items() if c["trigger_mask"][i] & bit],
+        )
+        telemetry = None
+        if c["has_telemetry"][i]:
+            telemetry = server.JournalTelemetryInput(
+                unplanned_trades_count=int(c["unplanned"][i]),
+                overtrading_detected=bool(c["overtrading_flag"][i]),
+            )
+        requests.append((eod, telemetry, server.SHARK_PHASES[c["phase"][i]]))
+    return requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--scalar-sample", type=int, default=20_000)
+    args = parser.parse_args()
+
+    columns = synthetic_columns(args.rows)
+
+    start = time.perf_counter()
+    batch = server.score_eod_batch(columns)
+    summary = server.summarize_eod_batch(batch)
+    batch_s = time.perf_counter() - start
+
+    sample = range(min(args.scalar_sample, args.rows))
+    requests = columns_to_requests(columns, sample)
+    start = time.perf_counter()
+    mismatches = 0
+    for i, (eod, telemetry, phase) in zip(sample, requests):
+        scores = server.calculate_shark_scores(eod, telemetry, phase)
+        patterns = server.detect_patterns(eod, telemetry)
+        mode = server.generate_tomorrow_protocol(scores, patterns, eod, telemetry)["mode"]
+        if (scores["shark_score_0_100"] != batch["shark_score_0_100"][i]
+                or mode != batch["mode_names"][batch["mode"][i]]):
+            mismatches += 1
+    scalar_s = (time.perf_counter() - start) * args.rows / len(sample)
+
+    print(f"rows:              {args.rows:,}")
+    print(f"batch:             {batch_s:8.3f}s  ({args.rows / batch_s:,.0f} rows/s)")
+    print(f"scalar (extrap.):  {scalar_s:8.3f}s  ({args.rows / scalar_s:,.0f} rows/s, sample {len(sample):,})")
+    print(f"speedup:           {scalar_s / batch_s:8.1f}x")
+    print(f"mismatches:        {mismatches}")
+    print(f"mode counts:       {summary['mode_counts']}")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
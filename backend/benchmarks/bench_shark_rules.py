@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Shark Mind rule engine micro-benchmark
+Evaluations per second of the compiled rules from shark_rules.json: feature
+extraction + day patterns + protocol decision table (the analyze_eod path),
+rule evaluation alone on prepared features, and the vectorized batch path.
+
+    python benchmarks/bench_shark_rules.py [--evals 200000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+os.environ.setdefault("LLM_CACHE_PATH", "")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import server  # noqa: E402
+
+STATES = ["bene", "ok", "teso", "calm", "", "frustrato"]
+
+
+def random_eod(rng: random.Random, triggers: list):
+    eod = server.EODPsychInput(
+        date="2025-01-01",
+        stress_1_10=rng.randint(1, 10), focus_1_10=rng.randint(1, 10), energy_1_10=rng.randint(1, 10),
+        physical_tension_1_10=rng.randint(1, 10), urge_to_trade_0_10=rng.randint(0, 10),
+        dominant_state_one_word=rng.choice(STATES),
+        behaviors={"limits_respected": rng.random() < 0.7, "shutdown_ritual_done": rng.random() < 0.4},
+        triggers_selected=rng.sample(triggers, rng.randint(0, 3)),
+    )
+    telemetry = None
+    if rng.random() < 0.7:
+        telemetry = server.JournalTelemetryInput(unplanned_trades_count=rng.randint(0, 5),
+                                                 overtrading_detected=rng.random() < 0.2)
+    return eod, telemetry
+
+
+def rate(n: int, seconds: float) -> str:
+    return f"{n / seconds:>12,.0f} evals/s  ({seconds / n * 1e6:6.2f} us/eval)"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--evals", type=int, default=200_000)
+    args = parser.parse_args()
+
+    rules = server.get_shark_rules()
+    rng = random.Random(1)
+    inputs = [random_eod(rng, rules.triggers + ["NEWS"]) for _ in range(min(args.evals, 20_000))]
+    inputs = [(eod, tel, server.calculate_shark_scores(eod, tel, "ACQUISITION")) for eod, tel in inputs]
+    rounds = max(1, args.evals // len(inputs))
+    n = rounds * len(inputs)
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for eod, telemetry, scores in inputs:
+            features = rules.eod_features(eod, telemetry, scores)
+            patterns = rules.match_patterns(features)
+            features.update(rules.pattern_features(patterns))
+            rules.protocol(features)
+    full_s = time.perf_counter() - start
+
+    prepared = [rules.eod_features(eod, tel, scores) for eod, tel, scores in inputs]
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for features in prepared:
+            rules._match_stage["day"](features)
+            rules._choose_mode(features)
+    rules_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(n):
+        server.get_shark_rules()
+    reload_check_s = time.perf_counter() - start
+
+    requests = [{"eod_psych": eod.model_dump(), "journal_telemetry": tel.model_dump() if tel else None}
+                for eod, tel, _ in inputs]
+    columns = server.eod_requests_to_columns(requests)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        server.score_eod_batch(columns)
+    batch_s = time.perf_counter() - start
+
+    print(f"rules version {rules.version}: {len(rules.patterns)} patterns, {len(rules.modes)} modes, {len(rules.triggers)} trigger bits")
+    print(f"analyze_eod path (features + patterns + protocol): {rate(n, full_s)}")
+    print(f"compiled rules only (patterns + mode table):       {rate(n, rules_s)}")
+    print(f"hot-reload check (get_shark_rules):                {rate(n, reload_check_s)}")
+    print(f"batch (scores + patterns + mode, numpy):           {rate(n, batch_s)}")
+    print(f"hits: {server._shark_rules.stats()['hits']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+In-process load test
+Boots the app on an ASGI transport with a fake market-data provider, a fake LLM
+and an in-memory Mongo (mongomock-motor), then runs concurrent virtual users over
+a mixed workload: dashboard polling, trade writes, EOD submissions, Monte Carlo
+and AI chat. Reports throughput and p50/p95/p99 per route; --output saves the
+report as JSON and --compare prints the change against a saved report. Event loop
+lag and blocks are measured after the warmup, like the route latencies; a run whose
+lag p99 exceeds --max-loop-lag-ms is flagged in the report: its route latencies
+include loop stalls (e.g. CPU-bound handlers) and make a poor baseline.
+
+    python benchmarks/load_test.py [--users 32] [--duration 20] [--output load.json] [--compare base.json]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import httpx
+import numpy as np
+import pandas as pd
+
+os.environ.setdefault("LLM_CACHE_PATH", "")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import server  # noqa: E402
+
+BASE_PRICES = {"GC=F": 2650, "NQ=F": 21450, "ES=F": 6050, "EURUSD=X": 1.085, "YM=F": 44200, "^VIX": 16.5}
+SYMBOLS = ["XAUUSD", "NAS100", "SP500", "EURUSD", "DOW"]
+STATES = ["calm", "ok", "agitato", "stanco", "euforico"]
+TRIGGERS = ["FOMO", "REVENGE", "CHASING", "AVOIDANCE", "FEAR"]
+LLM_REPLY = "Respira, rivedi il piano e opera solo setup A+."
+
+
+class FakeMarketData:
+    """Stands in for get_yf_ticker_safe: deterministic OHLC frames after a blocking delay, like yfinance"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+
+    def __call__(self, symbol: str, period: str = "5d", interval: str = "1d"):
+        self.calls += 1
+        time.sleep(self.latency)
+        base = BASE_PRICES.get(symbol, 100.0)
+        close = base * (1 + 0.004 * np.sin(np.arange(5) + len(symbol)))
+        index = pd.date_range(end=datetime.now(timezone.utc).date(), periods=5, freq="D")
+        return pd.DataFrame({"Open": close, "High": close * 1.003, "Low": close * 0.997, "Close": close}, index=index)
+
+
+class FakeLLM:
+    """Stands in for llm_complete: a fixed reply after an async delay, like a remote completion"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+
+    async def __call__(self, system_message: str, text: str, session_id: str, use_cache: bool = True) -> str:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return LLM_REPLY
+
+
+def install_fakes(market_latency: float, llm_latency: float) -> tuple:
+    """Point the app at the fakes and a fresh in-memory database"""
+    try:
+        from mongomock_motor import AsyncMongoMockClient
+    except ImportError:
+        sys.exit("load_test.py needs mongomock-motor for the in-memory store: pip install mongomock-motor")
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    market, llm = FakeMarketData(market_latency), FakeLLM(llm_latency)
+    server.client = AsyncMongoMockClient()
+    server.db = server.client["karion_load_test"]
+    server.DEMO_MODE = False
+    server.EMERGENT_LLM_KEY = server.EMERGENT_LLM_KEY or "load-test"
+    server.get_yf_ticker_safe = market
+    server.llm_complete = llm
+    return market, llm
+
+
+class Recorder:
+    """Client-side latency samples and status codes per route"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.measuring = False
+
+    async def request(self, http: httpx.AsyncClient, route: str, method: str, url: str, **kwargs) -> httpx.Response:
+        start = time.perf_counter()
+        response = await http.request(method, url, **kwargs)
+        elapsed = time.perf_counter() - start
+        if self.measuring:
+            self.latencies[route].append(elapsed)
+            self.statuses[route][response.status_code] += 1
+        return response
+
+
+def random_trade(rng: random.Random) -> dict:
+    entry = round(rng.uniform(1.05, 1.12), 5)
+    r = round(rng.gauss(0.3, 1.5), 2)
+    return {
+        "symbol": rng.choice(SYMBOLS), "entry_price": entry, "exit_price": round(entry * (1 + r / 500), 5),
+        "profit_loss": round(r * 50, 2), "profit_loss_r": r,
+        "date": (datetime.now(timezone.utc) - timedelta(days=rng.randint(0, 90))).date().isoformat(),
+        "rules_followed": ["stop"] if rng.random() < 0.8 else [],
+    }
+
+
+def random_eod(rng: random.Random) -> dict:
+    return {
+        "eod_psych": {
+            "date": (datetime.now(timezone.utc) - timedelta(days=rng.randint(0, 30))).date().isoformat(),
+            "stress_1_10": rng.randint(1, 10), "focus_1_10": rng.randint(1, 10),
+            "energy_1_10": rng.randint(1, 10), "physical_tension_1_10": rng.randint(1, 10),
+            "urge_to_trade_0_10": rng.randint(0, 10), "dominant_state_one_word": rng.choice(STATES),
+            "behaviors": {"limits_respected": rng.random() < 0.7, "breaks_taken": rng.random() < 0.5},
+            "triggers_selected": rng.sample(TRIGGERS, rng.randint(0, 2)),
+        },
+        "journal_telemetry": {"trades_count": rng.randint(0, 6), "unplanned_trades_count": rng.randint(0, 3)},
+    }
+
+
+async def dashboard_poll(rec: Recorder, http: httpx.AsyncClient, rng: random.Random, headers: dict):
+    """What the dashboard fetches on each refresh"""
+    await asyncio.gather(
+        rec.request(http, "GET /market/prices", "GET", "/api/market/prices"),
+        rec.request(http, "GET /market/vix", "GET", "/api/market/vix"),
+        rec.request(http, "GET /risk/analysis", "GET", "/api/risk/analysis"),
+        rec.request(http, "GET /analysis/multi-source", "GET", "/api/analysis/multi-source"),
+        rec.request(http, "GET /cot/data", "GET", "/api/cot/data"),
+    )
+
+
+async def trade_write(rec: Recorder, http: httpx.AsyncClient, rng: random.Random, headers: dict):
+    await rec.request(http, "POST /trades", "POST", "/api/trades", json=random_trade(rng), headers=headers)
+    await rec.request(http, "GET /trades", "GET", "/api/trades", headers=headers)
+
+
+async def eod_submission(rec: Recorder, http: httpx.AsyncClient, rng: random.Random, headers: dict):
+    await rec.request(http, "POST /psychology/eod", "POST", "/api/psychology/eod", json=random_eod(rng), headers=headers)
+
+
+async def monte_carlo(rec: Recorder, http: httpx.AsyncClient, rng: random.Random, headers: dict):
+    params = {"win_rate": rng.uniform(0.4, 0.6), "avg_win": 1.5, "avg_loss": 1.0,
+              "num_trades": 1000, "risk_per_trade": 0.01, "max_points": 300}
+    await rec.request(http, "POST /montecarlo/simulate", "POST", "/api/montecarlo/simulate", json=params, headers=headers)
+
+
+async def ai_chat(rec: Recorder, http: httpx.AsyncClient, rng: random.Random, headers: dict):
+    body = {"messages": [{"role": "user", "content": "Ho chiuso in perdita, cosa rivedo domani?"}]}
+    await rec.request(http, "POST /ai/chat", "POST", "/api/ai/chat", json=body, headers=headers)
+
+
+# (scenario, relative weight): mostly polling, a steady trickle of writes
+SCENARIOS = [
+    (dashboard_poll, 50),
+    (trade_write, 20),
+    (eod_submission, 15),
+    (monte_carlo, 10),
+    (ai_chat, 5),
+]
+
+
+async def virtual_user(rec: Recorder, http: httpx.AsyncClient, index: int, seed: int, think: float, deadline: float):
+    rng = random.Random(seed * 1000 + index)
+    response = await http.post("/api/auth/register", json={
+        "email": f"load{index}@karion.app", "password": "load-test", "name": f"Load {index}"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    scenarios, weights = zip(*SCENARIOS)
+    while time.perf_counter() < deadline:
+        scenario = rng.choices(scenarios, weights)[0]
+        await scenario(rec, http, rng, headers)
+        if think:
+            await asyncio.sleep(rng.uniform(0, 2 * think))
+
+
+def summarize(rec: Recorder, elapsed: float, blocks_before: int = 0) -> dict:
+    routes = {}
+    for route in sorted(rec.latencies):
+        samples = np.asarray(rec.latencies[route]) * 1000
+        p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+        statuses = rec.statuses[route]
+        routes[route] = {
+            "requests": len(samples),
+            "errors": sum(n for status, n in statuses.items() if status >= 400),
+            "rps": round(len(samples) / elapsed, 2),
+            "mean_ms": round(float(samples.mean()), 2),
+            "p50_ms": round(float(p50), 2),
+            "p95_ms": round(float(p95), 2),
+            "p99_ms": round(float(p99), 2),
+            "max_ms": round(float(samples.max()), 2),
+            "statuses": {str(status): n for status, n in sorted(statuses.items())},
+        }
+    total = sum(r["requests"] for r in routes.values())
+    return {
+        "total": {
+            "requests": total,
+            "errors": sum(r["errors"] for r in routes.values()),
+            "rps": round(total / elapsed, 2),
+            "seconds": round(elapsed, 2),
+        },
+        "routes": routes,
+        "loop_lag_ms": {f"p{round(float(q) * 100)}": round(v * 1000, 2) for q, v in server.loop_monitor.percentiles().items()},
+        "loop_blocks": server.loop_monitor.block_count - blocks_before,
+    }
+
+
+def loop_lag_warnings(report: dict, max_lag_ms: float) -> list:
+    lag = report["loop_lag_ms"]
+    if lag and lag["p99"] > max_lag_ms:
+        return [f"event loop lag p99 {lag['p99']:.0f} ms exceeds {max_lag_ms:.0f} ms: every route's latency "
+                f"includes loop stalls, so this run is not a clean baseline"]
+    return []
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).resolve().parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def run(args) -> dict:
+    market, llm = install_fakes(args.market_latency / 1000, args.llm_latency / 1000)
+    rec = Recorder()
+    transport = httpx.ASGITransport(app=server.app)
+    async with server.app.router.lifespan_context(server.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://karion.test", timeout=None) as http:
+            start = time.perf_counter()
+            deadline = start + args.warmup + args.duration
+            users = [asyncio.create_task(virtual_user(rec, http, i, args.seed, args.think_ms / 1000, deadline))
+                     for i in range(args.users)]
+            await asyncio.sleep(max(0.0, start + args.warmup - time.perf_counter()))
+            rec.measuring = True
+            # Registration (bcrypt) stalls the loop during warmup; keep lag to the measured window
+            server.loop_monitor.samples.clear()
+            blocks_before = server.loop_monitor.block_count
+            measured_from = time.perf_counter()
+            await asyncio.gather(*users)
+            elapsed = time.perf_counter() - measured_from
+    report = summarize(rec, elapsed, blocks_before)
+    report["warnings"] = loop_lag_warnings(report, args.max_loop_lag_ms)
+    report["fakes"] = {"market_calls": market.calls, "llm_calls": llm.calls}
+    report["meta"] = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "users": args.users, "duration": args.duration, "warmup": args.warmup, "seed": args.seed,
+        "think_ms": args.think_ms, "market_latency_ms": args.market_latency, "llm_latency_ms": args.llm_latency,
+    }
+    return report
+
+
+def print_report(report: dict):
+    print(f"{'route':<28} {'reqs':>7} {'err':>5} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for route, r in report["routes"].items():
+        print(f"{route:<28} {r['requests']:>7} {r['errors']:>5} {r['rps']:>8.1f} "
+              f"{r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f}")
+    total = report["total"]
+    print(f"{'total':<28} {total['requests']:>7} {total['errors']:>5} {total['rps']:>8.1f}")
+    lag = report["loop_lag_ms"]
+    if lag:
+        print(f"event loop lag: p50 {lag['p50']:.1f} ms, p99 {lag['p99']:.1f} ms, "
+              f"{report['loop_blocks']} blocking callbacks")
+    for warning in report["warnings"]:
+        print(f"warning: {warning}")
+
+
+def print_comparison(report: dict, baseline: dict):
+    """Relative change per route; positive latency deltas are regressions"""
+    print(f"\nvs {baseline['meta']['commit']} ({baseline['meta']['timestamp'][:19]})")
+    skip = {"commit", "timestamp"}
+    changed = [k for k in report["meta"] if k not in skip and report["meta"][k] != baseline["meta"].get(k)]
+    if changed:
+        print(f"warning: runs differ in {', '.join(changed)}; deltas are not like for like")
+    if baseline.get("warnings"):
+        print("warning: the baseline was flagged for event loop lag; its latencies include loop stalls")
+    print(f"{'route':<28} {'rps':>9} {'p50':>9} {'p95':>9} {'p99':>9}")
+    delta = lambda new, old: f"{(new - old) / old * 100:+8.1f}%" if old else f"{'n/a':>9}"
+    for route, r in report["routes"].items():
+        old = baseline["routes"].get(route)
+        if old is None:
+            print(f"{route:<28} {'new':>9}")
+            continue
+        print(f"{route:<28} {delta(r['rps'], old['rps'])} {delta(r['p50_ms'], old['p50_ms'])} "
+              f"{delta(r['p95_ms'], old['p95_ms'])} {delta(r['p99_ms'], old['p99_ms'])}")
+    print(f"{'total':<28} {delta(report['total']['rps'], baseline['total']['rps'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=32, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=20, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=3, help="unmeasured seconds before measuring")
+    parser.add_argument("--think-ms", type=float, default=50, help="mean pause between a user's scenarios")
+    parser.add_argument("--market-latency", type=float, default=80, help="fake market-data fetch, ms (blocking)")
+    parser.add_argument("--llm-latency", type=float, default=400, help="fake LLM completion, ms")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--max-loop-lag-ms", type=float, default=100,
+                        help="flag the run when event loop lag p99 is above this")
+    parser.add_argument("--output", type=Path, help="write the report as JSON")
+    parser.add_argument("--compare", type=Path, help="JSON report to compare against")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.compare:
+        print_comparison(report, json.loads(args.compare.read_text()))
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+        print(f"\nreport written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
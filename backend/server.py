@@ -1,24 +1,56 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, UploadFile, File, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, UploadFile, File, Request, Query, status
+from fastapi.routing import APIRoute
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import StreamingResponse, FileResponse, Response, ORJSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne
+from pymongo import monitoring
+from pymongo.errors import DuplicateKeyError
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional, Dict, Any
+from pydantic import BaseModel, Field, ConfigDict, EmailStr, ValidationError, field_validator
+from typing import List, Optional, Dict, Any, Tuple
 import uuid
 from datetime import datetime, timezone, timedelta
 import jwt
 import bcrypt
 from PyPDF2 import PdfReader
-import io
+from PIL import Image, ImageOps
 import random
 import math
+import base64
+import numpy as np
 import yfinance as yf
+import httpx
 from functools import lru_cache
 import asyncio
+import csv
+import codecs
+import re
+import json
+import hashlib
+import hmac
+import gzip
+import orjson
+from email.utils import format_datetime, parsedate_to_datetime
+import importlib
+import mmap
+import tempfile
+import shutil
+import sqlite3
+import time
+import threading
+import sys
+import traceback
+import tracemalloc
+import contextvars
+from bisect import bisect_left
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from html.parser import HTMLParser
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -35,12 +67,297 @@ demo_data = {
     "community_posts": []
 }
 
+# ==================== METRICS ====================
+# Per-route latency histograms from a raw ASGI middleware, dependency timings from
+# timed() and the Mongo command listener, exported as Server-Timing and /metrics.
+
+METRIC_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class LatencyHistogram:
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(METRIC_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        self.counts[bisect_left(METRIC_BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+_metrics_lock = threading.Lock()
+_http_latency: Dict[tuple, LatencyHistogram] = {}
+_http_responses: Dict[tuple, int] = {}
+_dependency_latency: Dict[str, LatencyHistogram] = {}
+# (name, seconds) pairs for the current request; None outside a request
+_request_timings: contextvars.ContextVar = contextvars.ContextVar("request_timings", default=None)
+
+def observe_dependency(name: str, seconds: float, timing_name: Optional[str] = None):
+    with _metrics_lock:
+        histogram = _dependency_latency.get(name)
+        if histogram is None:
+            histogram = _dependency_latency[name] = LatencyHistogram()
+        histogram.observe(seconds)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((timing_name or name, seconds))
+
+class timed:
+    """Time a block against a dependency: `with timed("yfinance"): ...` (works around awaits too)"""
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe_dependency(self.name, time.perf_counter() - self.start)
+        return False
+
+class MongoTimingListener(monitoring.CommandListener):
+    """Mongo command durations; Motor runs commands with the caller's context, so they reach Server-Timing"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        observe_dependency(f"mongo.{event.command_name}", event.duration_micros / 1e6, "mongo")
+
+    def failed(self, event):
+        observe_dependency(f"mongo.{event.command_name}", event.duration_micros / 1e6, "mongo")
+
+def server_timing_header(timings: list, elapsed: float) -> bytes:
+    if not timings:
+        return b"app;dur=%.1f" % (elapsed * 1000)
+    totals = {}
+    for name, seconds in timings:
+        totals[name] = totals.get(name, 0.0) + seconds
+    parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in totals.items()]
+    parts.append(f"app;dur={elapsed * 1000:.1f}")
+    return ", ".join(parts).encode()
+
+class MetricsMiddleware:
+    """Raw ASGI middleware: route-template latency histograms, status counts and Server-Timing"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        timings = []
+        token = _request_timings.set(timings)
+        status_code = 500
+
+        async def send_with_timing(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message["headers"] = [*message.get("headers", ()),
+                                      (b"server-timing", server_timing_header(timings, time.perf_counter() - start))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_timings.reset(token)
+            elapsed = time.perf_counter() - start
+            route = scope.get("route")
+            key = (scope["method"], route.path if route is not None else "<unmatched>")
+            # Only the event loop thread touches the HTTP tables, so no lock here
+            histogram = _http_latency.get(key)
+            if histogram is None:
+                histogram = _http_latency[key] = LatencyHistogram()
+            histogram.observe(elapsed)
+            status_key = (*key, status_code)
+            _http_responses[status_key] = _http_responses.get(status_key, 0) + 1
+
+LOOP_LAG_INTERVAL = float(os.environ.get('LOOP_LAG_INTERVAL', 0.1))
+LOOP_LAG_WINDOW = 600
+# Debug mode: > 0 starts a watchdog thread that logs the route and stack of any callback
+# holding the loop longer than this many milliseconds
+LOOP_BLOCK_THRESHOLD_MS = float(os.environ.get('LOOP_BLOCK_THRESHOLD_MS', 0))
+
+def _frame_route(frame) -> str:
+    """Route of the request whose coroutine owns frame, found through MetricsMiddleware's frame"""
+    while frame is not None:
+        if frame.f_code is MetricsMiddleware.__call__.__code__:
+            scope = frame.f_locals.get("scope") or {}
+            route = scope.get("route")
+            return f'{scope.get("method", "")} {route.path if route is not None else scope.get("path", "")}'
+        frame = frame.f_back
+    return "<no request>"
+
+class LoopMonitor:
+    """Event loop lag sampler, plus an optional watchdog thread that catches blocking callbacks"""
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, window: int = LOOP_LAG_WINDOW,
+                 block_threshold_ms: float = LOOP_BLOCK_THRESHOLD_MS):
+        self.interval = interval
+        self.block_threshold = block_threshold_ms / 1000
+        self.samples = deque(maxlen=window)
+        self.lag_total = 0.0
+        self.lag_count = 0
+        # Recent events for inspection; block_count is the all-time total for the counter
+        self.block_events = deque(maxlen=50)
+        self.block_count = 0
+        self._task = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        self._stop.clear()
+        self._task = loop.create_task(self._sample())
+        if self.block_threshold > 0:
+            self._thread = threading.Thread(target=self._watch, args=(loop, threading.get_ident()),
+                                            name="loop-watchdog", daemon=True)
+            self._thread.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._thread:
+            await asyncio.to_thread(self._thread.join)
+            self._thread = None
+
+    async def _sample(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - start - self.interval)
+            self.samples.append(lag)
+            self.lag_total += lag
+            self.lag_count += 1
+
+    def _watch(self, loop, loop_thread_id: int):
+        while not self._stop.is_set():
+            answered = threading.Event()
+            sent = time.perf_counter()
+            try:
+                loop.call_soon_threadsafe(answered.set)
+            except RuntimeError:
+                return
+            if not answered.wait(self.block_threshold):
+                frame = sys._current_frames().get(loop_thread_id)
+                route = _frame_route(frame)
+                stack = traceback.format_stack(frame) if frame is not None else []
+                while not answered.wait(0.5):
+                    if self._stop.is_set():
+                        return
+                blocked_ms = (time.perf_counter() - sent) * 1000
+                self.block_events.append({"at": datetime.now(timezone.utc).isoformat(), "route": route,
+                                          "blocked_ms": round(blocked_ms, 1), "stack": stack})
+                self.block_count += 1
+                logger.warning(f"Event loop blocked {blocked_ms:.0f}ms in {route}:\n{''.join(stack[-8:])}")
+            self._stop.wait(self.block_threshold)
+
+    def percentiles(self) -> Dict[str, float]:
+        samples = sorted(self.samples)
+        if not samples:
+            return {}
+        return {q: samples[min(len(samples) - 1, int(float(q) * len(samples)))] for q in ("0.5", "0.95", "0.99")}
+
+    def render(self) -> List[str]:
+        lines = ["# HELP karion_event_loop_lag_seconds Event loop scheduling lag over the recent window",
+                 "# TYPE karion_event_loop_lag_seconds summary"]
+        lines += [f'karion_event_loop_lag_seconds{{quantile="{q}"}} {v}' for q, v in self.percentiles().items()]
+        lines += [f"karion_event_loop_lag_seconds_sum {self.lag_total}",
+                  f"karion_event_loop_lag_seconds_count {self.lag_count}",
+                  "# HELP karion_event_loop_blocks_total Callbacks that held the loop past LOOP_BLOCK_THRESHOLD_MS",
+                  "# TYPE karion_event_loop_blocks_total counter",
+                  f"karion_event_loop_blocks_total {self.block_count}"]
+        return lines
+
+loop_monitor = LoopMonitor()
+
+class TimedORJSONResponse(ORJSONResponse):
+    def render(self, content) -> bytes:
+        with timed("serialize"):
+            return super().render(content)
+
+class _TimedResponseField:
+    """A route's response_model field whose validation and encoding are timed"""
+
+    def __init__(self, field):
+        self.field = field
+
+    def __getattr__(self, name):
+        return getattr(self.field, name)
+
+    def validate(self, *args, **kwargs):
+        with timed("validate"):
+            return self.field.validate(*args, **kwargs)
+
+    def serialize(self, *args, **kwargs):
+        with timed("serialize"):
+            return self.field.serialize(*args, **kwargs)
+
+class TimedRoute(APIRoute):
+    """response_model validation and encoding run before the response class renders;
+    time them as "validate" and "serialize" next to the render"""
+
+    def get_route_handler(self):
+        if self.secure_cloned_response_field is not None:
+            self.secure_cloned_response_field = _TimedResponseField(self.secure_cloned_response_field)
+        return super().get_route_handler()
+
+def _label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _render_histograms(name: str, help_text: str, histograms: dict, label_names: tuple) -> List[str]:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for key, histogram in sorted(histograms.items()):
+        values = key if isinstance(key, tuple) else (key,)
+        labels = ",".join(f'{label}="{_label_value(v)}"' for label, v in zip(label_names, values))
+        cumulative = 0
+        for bound, count in zip((*METRIC_BUCKETS, "+Inf"), histogram.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {histogram.total}")
+        lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+    return lines
+
+def _copy_histogram(histogram: LatencyHistogram) -> LatencyHistogram:
+    copy = LatencyHistogram()
+    copy.counts, copy.total, copy.count = list(histogram.counts), histogram.total, histogram.count
+    return copy
+
+def render_metrics() -> str:
+    """Prometheus text exposition of all metrics"""
+    http_latency = dict(_http_latency)
+    responses = dict(_http_responses)
+    with _metrics_lock:
+        dependency_latency = {k: _copy_histogram(h) for k, h in _dependency_latency.items()}
+    lines = _render_histograms("karion_http_request_duration_seconds", "HTTP request latency by route template",
+                               http_latency, ("method", "route"))
+    lines += ["# HELP karion_http_responses_total HTTP responses by route template and status",
+              "# TYPE karion_http_responses_total counter"]
+    for (method, route, status_code), count in sorted(responses.items()):
+        lines.append(f'karion_http_responses_total{{method="{method}",route="{_label_value(route)}",status="{status_code}"}} {count}')
+    lines += _render_histograms("karion_dependency_duration_seconds", "Latency of external dependencies",
+                                dependency_latency, ("dependency",))
+    lines += loop_monitor.render()
+    return "\n".join(lines) + "\n"
+
 # MongoDB connection with fallback to demo mode
 try:
     mongo_url = os.environ.get('MONGO_URL', '')
     if not mongo_url:
         raise Exception("No MONGO_URL")
-    client = AsyncIOMotorClient(mongo_url, serverSelectionTimeoutMS=3000)
+    client = AsyncIOMotorClient(mongo_url, serverSelectionTimeoutMS=3000, event_listeners=[MongoTimingListener()])
     # Test connection
     import asyncio
     async def test_mongo():
@@ -72,8 +389,9 @@ JWT_EXPIRATION_HOURS = 24
 # Emergent LLM Key
 EMERGENT_LLM_KEY = os.environ.get('EMERGENT_LLM_KEY', '')
 
-app = FastAPI(title="TradingOS API")
-api_router = APIRouter(prefix="/api")
+app = FastAPI(title="TradingOS API", default_response_class=TimedORJSONResponse)
+app.router.route_class = TimedRoute
+api_router = APIRouter(prefix="/api", route_class=TimedRoute)
 security = HTTPBearer()
 
 # Configure logging
@@ -138,6 +456,8 @@ class JournalEntry(BaseModel):
     errors_today: str
     lessons_learned: str
     ai_suggestions: List[str] = []
+    ai_status: str = "none"  # none/pending/ready/fallback
+    ai_job_id: Optional[str] = None
     created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
 
 class JournalEntryCreate(BaseModel):
@@ -207,8 +527,10 @@ class CommunityPost(BaseModel):
     image_url: str = ""
     caption: str
     profit: float = 0
+    image_thumb_url: str = ""
     likes: int = 0
-    comments: List[Dict[str, Any]] = []
+    comment_count: int = 0
+    latest_comments: List[Dict[str, Any]] = []
     created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
 
 class CommunityPostCreate(BaseModel):
@@ -216,6 +538,26 @@ class CommunityPostCreate(BaseModel):
     caption: str
     profit: float = 0
 
+    @field_validator("image_url")
+    @classmethod
+    def image_url_is_small_link(cls, v: str) -> str:
+        # Images go through /api/media/images; no inline data: blobs in posts
+        if v and not MEDIA_URL_RE.match(v) and not (re.match(r"^https?://", v) and len(v) <= 2048):
+            raise ValueError("image_url must be an uploaded media URL or an http(s) link")
+        return v
+
+class CommunityComment(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    post_id: str
+    user_id: str
+    user_name: str
+    text: str
+    created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
+
+class CommunityCommentCreate(BaseModel):
+    text: str = Field(min_length=1, max_length=2000)
+
 class AIMessage(BaseModel):
     role: str
     content: str
@@ -223,6 +565,7 @@ class AIMessage(BaseModel):
 class AIChatRequest(BaseModel):
     messages: List[AIMessage]
     context: str = "general"
+    conversation_id: Optional[str] = None
 
 class MonteCarloParams(BaseModel):
     win_rate: float
@@ -231,14 +574,33 @@ class MonteCarloParams(BaseModel):
     num_trades: int = 10000
     initial_capital: float = 10000
     risk_per_trade: float = 0.01
+    # Downsample returned curves to this many points (LTTB) and sample bands on the same grid
+    max_points: Optional[int] = Field(default=None, ge=3)
+
+class MonteCarloAnalyticParams(MonteCarloParams):
+    # Loss of initial capital counted as ruin (0.5 = account halved)
+    ruin_drawdown: float = Field(default=0.5, gt=0, lt=1)
+
+class MonteCarloSweepParams(BaseModel):
+    win_rates: List[float] = Field(min_length=1, max_length=20)
+    risks_per_trade: List[float] = Field(min_length=1, max_length=20)
+    avg_win: float
+    avg_loss: float
+    num_trades: int = Field(default=1000, ge=1, le=10000)
+    initial_capital: float = 10000
+    num_simulations: int = Field(default=2000, ge=100, le=10000)
+    # Fixed seed reproduces a sweep; returned in the response when omitted
+    seed: Optional[int] = Field(default=None, ge=0)
 
 # ==================== AUTH HELPERS ====================
 
 def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    with timed("bcrypt"):
+        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
 
 def verify_password(password: str, hashed: str) -> bool:
-    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+    with timed("bcrypt"):
+        return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
 
 def create_token(user_id: str, email: str) -> str:
     payload = {
@@ -275,6 +637,9 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
 
 @api_router.post("/auth/register", response_model=TokenResponse)
 async def register(user_data: UserCreate):
+    if user_data.email.lower() in ADMIN_EMAILS:
+        # Admin accounts are never created through the API: see sync_admin_roles
+        raise HTTPException(status_code=400, detail="Email reserved")
     if DEMO_MODE:
         if user_data.email in demo_users:
             raise HTTPException(status_code=400, detail="Email already registered")
@@ -340,6 +705,207 @@ async def login(credentials: UserLogin):
 async def get_me(current_user: dict = Depends(get_current_user)):
     return UserResponse(**current_user)
 
+# ==================== USER FEATURE STORE ====================
+
+# One small document per user with per-day sums/counts for the last 90 days and
+# precomputed 7/30/90-day windows, updated incrementally on every write.
+FEATURE_WINDOWS = (7, 30, 90)
+FEATURE_RETENTION_DAYS = 90
+# Groups holding one value set per day (an EOD resubmission replaces the day) rather than running sums
+FEATURE_DAILY_GROUPS = ("eod", "patterns")
+
+def feature_day(date_str: Optional[str] = None) -> str:
+    """Normalize a record date ("2024.01.15 10:00", "2024-01-15") to a YYYY-MM-DD day key"""
+    if date_str:
+        try:
+            return datetime.strptime(date_str[:10].replace(".", "-").replace("/", "-"), "%Y-%m-%d").strftime("%Y-%m-%d")
+        except ValueError:
+            pass
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+def checkin_feature_increments(checkin: dict) -> Dict[str, float]:
+    return {
+        "checkin.n": 1,
+        "checkin.confidence": checkin.get("confidence", 0),
+        "checkin.discipline": checkin.get("discipline", 0),
+        "checkin.sleep_hours": checkin.get("sleep_hours", 0),
+        "checkin.sleep_quality": checkin.get("sleep_quality", 0),
+    }
+
+def eod_feature_increments(stress: int, scores: dict, patterns: List[dict]) -> Dict[str, float]:
+    increments = {
+        "eod.n": 1,
+        "eod.stress": stress,
+        "eod.shark_score": scores["shark_score_0_100"],
+        "eod.discipline": scores["discipline_0_100"],
+        "eod.clarity": scores["clarity_0_100"],
+        "eod.emotional_stability": scores["emotional_stability_0_100"],
+        "eod.compulsion_risk": scores["compulsion_risk_0_100"],
+    }
+    for pattern in patterns:
+        key = f"patterns.{pattern['pattern_id']}"
+        increments[key] = increments.get(key, 0) + 1
+    return increments
+
+def trade_feature_increments(trades: List[dict]) -> Dict[str, Dict[str, float]]:
+    """Group trades by day into {day: increments}"""
+    by_day = {}
+    for trade in trades:
+        inc = by_day.setdefault(feature_day(trade.get("date")), {"trades.n": 0, "trades.wins": 0, "trades.pnl": 0, "trades.r": 0})
+        inc["trades.n"] += 1
+        inc["trades.wins"] += 1 if trade.get("profit_loss", 0) > 0 else 0
+        inc["trades.pnl"] += trade.get("profit_loss", 0)
+        inc["trades.r"] += trade.get("profit_loss_r", 0)
+    return by_day
+
+def _feature_mean(bucket: dict, field: str, count_field: str = "n") -> float:
+    n = bucket.get(count_field, 0)
+    return round(bucket.get(field, 0) / n, 2) if n else 0
+
+def compute_feature_windows(days: Dict[str, dict], today: Optional[str] = None) -> tuple:
+    """Fold per-day buckets into 7/30/90-day windows. Returns (windows, days past retention)"""
+    today_date = datetime.strptime(today or feature_day(), "%Y-%m-%d").date()
+    totals = {w: {} for w in FEATURE_WINDOWS}
+    expired = []
+    for day, groups in days.items():
+        age = (today_date - datetime.strptime(day, "%Y-%m-%d").date()).days
+        if age >= FEATURE_RETENTION_DAYS:
+            expired.append(day)
+            continue
+        for w in FEATURE_WINDOWS:
+            if 0 <= age < w:
+                acc = totals[w]
+                for group, values in groups.items():
+                    group_acc = acc.setdefault(group, {})
+                    for field, value in values.items():
+                        group_acc[field] = group_acc.get(field, 0) + value
+
+    windows = {}
+    for w, acc in totals.items():
+        checkin, eod, trades = acc.get("checkin", {}), acc.get("eod", {}), acc.get("trades", {})
+        patterns = acc.get("patterns", {})
+        windows[f"{w}d"] = {
+            "checkins": checkin.get("n", 0),
+            "avg_confidence": _feature_mean(checkin, "confidence"),
+            "avg_discipline": _feature_mean(checkin, "discipline"),
+            "avg_sleep_hours": _feature_mean(checkin, "sleep_hours"),
+            "avg_sleep_quality": _feature_mean(checkin, "sleep_quality"),
+            "eod_days": eod.get("n", 0),
+            "avg_stress": _feature_mean(eod, "stress"),
+            "avg_shark_score": _feature_mean(eod, "shark_score"),
+            "avg_eod_discipline": _feature_mean(eod, "discipline"),
+            "avg_clarity": _feature_mean(eod, "clarity"),
+            "avg_emotional_stability": _feature_mean(eod, "emotional_stability"),
+            "avg_compulsion_risk": _feature_mean(eod, "compulsion_risk"),
+            "pattern_counts": patterns,
+            "pattern_rate": {p: round(c / eod["n"], 2) for p, c in patterns.items()} if eod.get("n") else {},
+            "trades": trades.get("n", 0),
+            "win_rate": round(trades.get("wins", 0) / trades["n"] * 100, 1) if trades.get("n") else 0,
+            "total_pnl": round(trades.get("pnl", 0), 2),
+            "avg_r": _feature_mean(trades, "r"),
+            "journal_entries": acc.get("journal", {}).get("n", 0),
+        }
+    return windows, expired
+
+async def record_user_features(user_id: str, day: str, increments: Dict[str, float], replace_groups: tuple = ()):
+    """Apply per-day increments to the user's feature document and refresh its windows.
+
+    Groups listed in replace_groups are overwritten for that day instead of incremented,
+    so writing the same day twice is idempotent.
+    """
+    today = feature_day()
+    age = (datetime.strptime(today, "%Y-%m-%d") - datetime.strptime(day, "%Y-%m-%d")).days
+    if age >= FEATURE_RETENTION_DAYS or not increments:
+        return
+    inc, replaced = {}, {group: {} for group in replace_groups}
+    for field, value in increments.items():
+        group, name = field.split(".", 1)
+        if group in replaced:
+            replaced[group][name] = value
+        else:
+            inc[f"days.{day}.{field}"] = value
+    # version orders the windows refresh below against overlapping writes
+    update = {"$inc": {**inc, "version": 1}}
+    if replaced:
+        update["$set"] = {f"days.{day}.{group}": values for group, values in replaced.items()}
+    try:
+        doc = await db.user_features.find_one_and_update(
+            {"user_id": user_id},
+            update,
+            projection={"_id": 0},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        windows, expired = compute_feature_windows(doc.get("days", {}), today)
+        update = {"$set": {"windows": windows, "windows_date": today, "updated_at": datetime.now(timezone.utc).isoformat()}}
+        if expired:
+            update["$unset"] = {f"days.{d}": "" for d in expired}
+        # Skipped if a later write bumped the version: its own refresh has newer days
+        await db.user_features.update_one({"user_id": user_id, "version": doc["version"]}, update)
+    except Exception as e:
+        # Features are derived data: never fail the user's write because of them
+        logger.error(f"Feature store update error for {user_id}: {e}")
+
+async def get_user_features(user_id: str) -> dict:
+    """Read the feature document, re-windowing in memory if it was computed on an earlier day"""
+    doc = await db.user_features.find_one({"user_id": user_id}, {"_id": 0})
+    if not doc:
+        windows, _ = compute_feature_windows({})
+        return {"user_id": user_id, "windows": windows, "windows_date": feature_day()}
+    today = feature_day()
+    if doc.get("windows_date") != today:
+        doc["windows"], _ = compute_feature_windows(doc.get("days", {}), today)
+        doc["windows_date"] = today
+    return doc
+
+async def rebuild_user_features(user_id: str) -> dict:
+    """Backfill the feature document from the source collections (one scan per collection)"""
+    since = (datetime.now(timezone.utc) - timedelta(days=FEATURE_RETENTION_DAYS)).strftime("%Y-%m-%d")
+    days = {}
+
+    def add(day, increments):
+        bucket = days.setdefault(day, {})
+        for field, value in increments.items():
+            group, name = field.split(".", 1)
+            bucket.setdefault(group, {})
+            bucket[group][name] = bucket[group].get(name, 0) + value
+
+    async for c in db.psychology_checkins.find({"user_id": user_id, "date": {"$gte": since}}, {"_id": 0}):
+        add(feature_day(c.get("date")), checkin_feature_increments(c))
+    # Only the latest EOD of each day counts, as in record_user_features
+    latest_eod = {}
+    async for e in db.psychology_eod.find(
+        {"user_id": user_id, "date": {"$gte": since}}, {"_id": 0, "input": 1, "result": 1, "date": 1}
+    ).sort("created_at", 1):
+        result = e.get("result", {})
+        stress = e.get("input", {}).get("eod_psych", {}).get("stress_1_10", 0)
+        latest_eod[feature_day(e.get("date"))] = eod_feature_increments(stress, result.get("scores", {}), result.get("detected_patterns", []))
+    for day, increments in latest_eod.items():
+        add(day, increments)
+    trades = await db.trades.find({"user_id": user_id, "date": {"$gte": since}}, {"_id": 0, "date": 1, "profit_loss": 1, "profit_loss_r": 1}).to_list(100000)
+    for day, increments in trade_feature_increments(trades).items():
+        add(day, increments)
+    async for j in db.journal_entries.find({"user_id": user_id, "date": {"$gte": since}}, {"_id": 0, "date": 1}):
+        add(feature_day(j.get("date")), {"journal.n": 1})
+
+    days = {d: v for d, v in days.items() if d >= since}
+    windows, _ = compute_feature_windows(days)
+    doc = {"user_id": user_id, "days": days, "windows": windows, "windows_date": feature_day(),
+           "updated_at": datetime.now(timezone.utc).isoformat()}
+    await db.user_features.replace_one({"user_id": user_id}, doc, upsert=True)
+    return doc
+
+@api_router.get("/features")
+async def get_features(current_user: dict = Depends(get_current_user)):
+    """Rolling 7/30/90-day features for dashboards and AI prompts"""
+    doc = await get_user_features(current_user["id"])
+    return {"windows": doc["windows"], "windows_date": doc["windows_date"], "updated_at": doc.get("updated_at")}
+
+@api_router.post("/features/rebuild")
+async def rebuild_features(current_user: dict = Depends(get_current_user)):
+    doc = await rebuild_user_features(current_user["id"])
+    return {"windows": doc["windows"], "windows_date": doc["windows_date"], "updated_at": doc["updated_at"]}
+
 # ==================== PSYCHOLOGY ROUTES ====================
 
 @api_router.post("/psychology/checkin", response_model=PsychologyCheckin)
@@ -350,6 +916,7 @@ async def create_checkin(data: PsychologyCheckinCreate, current_user: dict = Dep
         **data.model_dump()
     )
     await db.psychology_checkins.insert_one(checkin.model_dump())
+    await record_user_features(current_user["id"], checkin.date, checkin_feature_increments(checkin.model_dump()))
     
     # Update user XP
     await db.users.update_one({"id": current_user["id"]}, {"$inc": {"xp": 10}})
@@ -358,9 +925,9 @@ async def create_checkin(data: PsychologyCheckinCreate, current_user: dict = Dep
 @api_router.get("/psychology/checkins", response_model=List[PsychologyCheckin])
 async def get_checkins(current_user: dict = Depends(get_current_user)):
     checkins = await db.psychology_checkins.find(
-        {"user_id": current_user["id"]}, {"_id": 0}
+        {"user_id": current_user["id"]}, model_projection(PsychologyCheckin)
     ).sort("created_at", -1).to_list(100)
-    return checkins
+    return trusted_response(PsychologyCheckin, checkins)
 
 @api_router.get("/psychology/stats")
 async def get_psychology_stats(current_user: dict = Depends(get_current_user)):
@@ -397,6 +964,165 @@ async def get_psychology_stats(current_user: dict = Depends(get_current_user)):
         "trend": trend_data
     }
 
+# Weekly/monthly reports: buckets are aggregated in MongoDB; closed buckets (not
+# containing today) are stored in psychology_report_cache and never recomputed,
+# unless a backdated EOD lands in one (see invalidate_psychology_report).
+REPORT_PERIODS = ("week", "month")
+REPORT_MAX_BUCKETS = 52
+CHECKIN_REPORT_FIELDS = {
+    "confidence": "$confidence",
+    "discipline": "$discipline",
+    "sleep_hours": "$sleep_hours",
+    "sleep_quality": "$sleep_quality",
+}
+EOD_REPORT_FIELDS = {
+    "stress": "$input.eod_psych.stress_1_10",
+    "shark_score": "$result.scores.shark_score_0_100",
+    "discipline": "$result.scores.discipline_0_100",
+    "clarity": "$result.scores.clarity_0_100",
+    "emotional_stability": "$result.scores.emotional_stability_0_100",
+    "compulsion_risk": "$result.scores.compulsion_risk_0_100",
+}
+
+def report_bucket_key(period: str, day) -> str:
+    if period == "week":
+        iso_year, iso_week, _ = day.isocalendar()
+        return f"{iso_year}-W{iso_week:02d}"
+    return day.strftime("%Y-%m")
+
+def report_buckets(period: str, count: int, today=None) -> List[dict]:
+    """The last `count` buckets, oldest first, with [start, until) day ranges"""
+    today = today or datetime.now(timezone.utc).date()
+    buckets = []
+    if period == "week":
+        start = today - timedelta(days=today.weekday())
+        starts = [start - timedelta(weeks=i) for i in range(count)]
+        ranges = [(s, s + timedelta(weeks=1)) for s in starts]
+    else:
+        year, month = today.year, today.month
+        ranges = []
+        for _ in range(count):
+            start = today.replace(year=year, month=month, day=1)
+            until = start.replace(year=year + month // 12, month=month % 12 + 1)
+            ranges.append((start, until))
+            year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+    for start, until in reversed(ranges):
+        buckets.append({
+            "bucket": report_bucket_key(period, start),
+            "start": start.isoformat(),
+            "until": until.isoformat(),
+            "end": (until - timedelta(days=1)).isoformat(),
+            "closed": until <= today,
+        })
+    return buckets
+
+def _report_stats(row: dict, fields: Dict[str, str]) -> dict:
+    """Mean / population stdev / min / max from the summed moments of a $group row"""
+    n = row["count"]
+    stats = {"count": n}
+    for name in fields:
+        mean = row[f"{name}_sum"] / n
+        variance = max(0.0, row[f"{name}_sq"] / n - mean * mean)
+        stats[name] = {
+            "mean": round(mean, 2),
+            "stdev": round(math.sqrt(variance), 2),
+            "min": row[f"{name}_min"],
+            "max": row[f"{name}_max"],
+        }
+    return stats
+
+async def aggregate_psychology_buckets(user_id: str, buckets: List[dict]) -> Dict[str, dict]:
+    """Bucketed checkin / EOD aggregates and pattern counts, grouped database-side"""
+    bucket_of = {"$switch": {
+        "branches": [
+            {"case": {"$and": [{"$gte": ["$date", b["start"]]}, {"$lt": ["$date", b["until"]]}]}, "then": b["bucket"]}
+            for b in buckets
+        ],
+        "default": None
+    }}
+    match = {"$match": {"user_id": user_id, "$or": [{"date": {"$gte": b["start"], "$lt": b["until"]}} for b in buckets]}}
+
+    def group_stage(fields):
+        group = {"_id": bucket_of, "count": {"$sum": 1}}
+        for name, path in fields.items():
+            group[f"{name}_sum"] = {"$sum": path}
+            group[f"{name}_sq"] = {"$sum": {"$multiply": [path, path]}}
+            group[f"{name}_min"] = {"$min": path}
+            group[f"{name}_max"] = {"$max": path}
+        return {"$group": group}
+
+    checkin_rows = await db.psychology_checkins.aggregate([match, group_stage(CHECKIN_REPORT_FIELDS)]).to_list(None)
+    eod_rows = await db.psychology_eod.aggregate([match, group_stage(EOD_REPORT_FIELDS)]).to_list(None)
+    pattern_rows = await db.psychology_eod.aggregate([
+        match,
+        {"$unwind": "$result.detected_patterns"},
+        {"$group": {"_id": {"bucket": bucket_of, "pattern": "$result.detected_patterns.pattern_id"}, "count": {"$sum": 1}}}
+    ]).to_list(None)
+
+    results = {b["bucket"]: {"checkins": {"count": 0}, "eod": {"count": 0}, "patterns": {}} for b in buckets}
+    for row in checkin_rows:
+        if row["_id"] in results:
+            results[row["_id"]]["checkins"] = _report_stats(row, CHECKIN_REPORT_FIELDS)
+    for row in eod_rows:
+        if row["_id"] in results:
+            results[row["_id"]]["eod"] = _report_stats(row, EOD_REPORT_FIELDS)
+    for row in pattern_rows:
+        if row["_id"]["bucket"] in results:
+            results[row["_id"]["bucket"]]["patterns"][row["_id"]["pattern"]] = row["count"]
+    return results
+
+async def invalidate_psychology_report(user_id: str, date_str: str):
+    """Drop cached buckets containing a (possibly backdated) write"""
+    day = datetime.strptime(feature_day(date_str), "%Y-%m-%d").date()
+    await db.psychology_report_cache.delete_many({
+        "user_id": user_id,
+        "$or": [{"period": p, "bucket": report_bucket_key(p, day)} for p in REPORT_PERIODS]
+    })
+
+@api_router.get("/psychology/report")
+async def get_psychology_report(period: str = "week", buckets: int = 12, current_user: dict = Depends(get_current_user)):
+    """Per ISO week / month aggregates of checkins, EOD scores and patterns"""
+    if period not in REPORT_PERIODS:
+        raise HTTPException(status_code=400, detail="Periodo non valido. Usa: week, month")
+    buckets = max(1, min(buckets, REPORT_MAX_BUCKETS))
+    user_id = current_user["id"]
+    wanted = report_buckets(period, buckets)
+
+    closed_keys = [b["bucket"] for b in wanted if b["closed"]]
+    cached = {}
+    if closed_keys:
+        async for doc in db.psychology_report_cache.find(
+            {"user_id": user_id, "period": period, "bucket": {"$in": closed_keys}}, {"_id": 0}
+        ):
+            cached[doc["bucket"]] = doc
+
+    missing = [b for b in wanted if b["bucket"] not in cached]
+    computed = await aggregate_psychology_buckets(user_id, missing) if missing else {}
+
+    report = []
+    for b in wanted:
+        if b["bucket"] in cached:
+            data, from_cache = cached[b["bucket"]], True
+        else:
+            data, from_cache = computed[b["bucket"]], False
+            if b["closed"]:
+                await db.psychology_report_cache.update_one(
+                    {"user_id": user_id, "period": period, "bucket": b["bucket"]},
+                    {"$set": {**data, "computed_at": datetime.now(timezone.utc).isoformat()}},
+                    upsert=True
+                )
+        report.append({
+            "bucket": b["bucket"],
+            "start": b["start"],
+            "end": b["end"],
+            "closed": b["closed"],
+            "cached": from_cache,
+            "checkins": data["checkins"],
+            "eod": data["eod"],
+            "patterns": data["patterns"],
+        })
+    return {"period": period, "buckets": report}
+
 # ==================== SHARK MIND ENGINE (Psychology EOD) ====================
 
 class EODPsychInput(BaseModel):
@@ -412,6 +1138,15 @@ class EODPsychInput(BaseModel):
     triggers_selected: List[str] = []
     free_note_optional: str = ""
 
+    @field_validator("date")
+    @classmethod
+    def date_is_iso_day(cls, v: str) -> str:
+        # Reports and the backtest compare stored dates as strings, so keep them YYYY-MM-DD
+        try:
+            return datetime.strptime(v[:10].replace(".", "-").replace("/", "-"), "%Y-%m-%d").strftime("%Y-%m-%d")
+        except ValueError:
+            raise ValueError("date must be YYYY-MM-DD") from None
+
 class JournalTelemetryInput(BaseModel):
     session_type: str = "trade_day"
     pnl: float = 0
@@ -516,136 +1251,437 @@ def calculate_shark_scores(eod: EODPsychInput, telemetry: Optional[JournalTeleme
         "compulsion_risk_0_100": int(compulsion_risk)
     }
 
+# Patterns and the tomorrow protocol are declared in shark_rules.json and compiled
+# once into predicate closures. Triggers become a bitmask, so membership tests are a
+# single AND; predicates only use & | and comparisons, so the same compiled rule
+# runs on one EOD (Python scalars) or on numpy columns (score_eod_batch).
+SHARK_RULES_PATH = Path(os.environ.get('SHARK_RULES_PATH', ROOT_DIR / 'shark_rules.json'))
+SHARK_RULES_RELOAD_SECONDS = float(os.environ.get('SHARK_RULES_RELOAD_SECONDS', 2))
+SHARK_RULE_OPS = {">", ">=", "<", "<=", "==", "!="}
+SHARK_RULE_FEATURES = {
+    "stress", "focus", "energy", "tension", "urge", "limits_broken", "shutdown_done", "breaks_taken",
+    "has_telemetry", "unplanned", "overtrading_flag", "mode", "tilt_streak", "overtrading_days",
+    "shark_score", "discipline", "clarity", "emotional_stability", "compulsion_risk"
+}
+SHARK_SCORE_FEATURES = {
+    "shark_score_0_100": "shark_score", "discipline_0_100": "discipline", "clarity_0_100": "clarity",
+    "emotional_stability_0_100": "emotional_stability", "compulsion_risk_0_100": "compulsion_risk"
+}
+
+class SharkRuleSet:
+    """Shark Mind rules compiled from a JSON spec"""
+
+    def __init__(self, spec: dict, hits: Optional[Dict[str, int]] = None):
+        self.version = spec.get("version")
+        self.triggers = list(spec["triggers"])
+        self.trigger_bits = {t: 1 << i for i, t in enumerate(self.triggers)}
+        self.state_groups = {g: frozenset(s.lower() for s in states) for g, states in spec.get("state_groups", {}).items()}
+        self.hits = hits if hits is not None else {}
+
+        self.pattern_ids = [rule["id"] for rule in spec["patterns"]]
+        self.patterns = []
+        for rule in spec["patterns"]:
+            severity = rule["severity"]
+            if isinstance(severity, str):
+                severity = [{"value": severity}]
+            self.patterns.append({
+                "id": rule["id"],
+                "stage": rule.get("stage", "day"),
+                "when": rule["when"],
+                "severity": [(s.get("when"), s["value"]) for s in severity],
+                "evidence": list(rule.get("evidence", [])),
+                "confidence": rule.get("confidence", 0.5),
+            })
+
+        protocol = spec["protocol"]
+        self.modes = [(row["mode"], row.get("when")) for row in protocol["modes"]]
+        self.mode_names = [name for name, _ in self.modes]
+        self.micro_rules = [(row.get("when"), row["text"]) for row in protocol["micro_rules"]]
+        self.constraints = protocol["constraints"]
+        self.reset_steps = protocol["reset_steps"]
+        missing = [m for m in self.mode_names if m not in self.constraints]
+        if missing or self.modes[-1][1] is not None or not self.micro_rules or self.micro_rules[-1][0] is not None:
+            raise ValueError(f"Protocol table incomplete (constraints missing for {missing} or no default row)")
+
+        # Scalar evaluators: one generated function per stage / table
+        self._match_stage = {stage: self._generate_matcher(stage) for stage in ("day", "window")}
+        self._choose_mode = self._generate_table([when for _, when in self.modes])
+        self._choose_micro_rule = self._generate_table([when for when, _ in self.micro_rules])
+        # Vectorized predicates (numpy columns) for score_eod_batch; window-stage rules
+        # need earlier days and are replayed row by row instead (replay_engine_window)
+        self.day_pattern_ids = [p["id"] for p in self.patterns if p["stage"] == "day"]
+        self._batch_when = [self._compile_vectorized(p["when"]) for p in self.patterns if p["stage"] == "day"]
+        self._batch_severity = [[(self._compile_vectorized(w), v) for w, v in p["severity"]]
+                                for p in self.patterns if p["stage"] == "day"]
+        self._batch_modes = [self._compile_vectorized(when) for _, when in self.modes]
+
+    def _expression(self, spec, vectorized: bool = False) -> str:
+        """Translate a condition into a Python expression over the feature dict f"""
+        if isinstance(spec, list):
+            field, op, value = spec
+            if op not in SHARK_RULE_OPS or not isinstance(value, (bool, int, float, str)):
+                raise ValueError(f"Invalid comparison {spec}")
+            if field.startswith("pattern_"):
+                # Pattern flags are only present for detected patterns
+                if field.removeprefix("pattern_").removesuffix("_high") not in self.pattern_ids:
+                    raise ValueError(f"Unknown pattern in {spec}")
+                return f"(f.get({field!r}, False) {op} {value!r})"
+            if field not in SHARK_RULE_FEATURES and field.removeprefix("state_") not in self.state_groups:
+                raise ValueError(f"Unknown feature {field!r}")
+            return f"(f[{field!r}] {op} {value!r})"
+        if "all" in spec or "any" in spec:
+            # numpy needs element-wise & |; scalars short-circuit with and/or
+            if vectorized:
+                joiner = " & " if "all" in spec else " | "
+            else:
+                joiner = " and " if "all" in spec else " or "
+            parts = spec.get("all", spec.get("any"))
+            return "(" + joiner.join(self._expression(s, vectorized) for s in parts) + ")"
+        if "triggers_any" in spec or "triggers_all" in spec:
+            names = spec.get("triggers_any", spec.get("triggers_all"))
+            unknown = [t for t in names if t not in self.trigger_bits]
+            if unknown:
+                raise ValueError(f"Unknown triggers {unknown}")
+            mask = self.trigger_mask(names)
+            if "triggers_any" in spec:
+                return f"((f['trigger_mask'] & {mask}) != 0)"
+            return f"((f['trigger_mask'] & {mask}) == {mask})"
+        raise ValueError(f"Unknown condition {spec}")
+
+    @staticmethod
+    def _build(source: str, name: str):
+        namespace = {}
+        exec(source, {"__builtins__": {}}, namespace)
+        return namespace[name]
+
+    def _compile_vectorized(self, spec):
+        if spec is None:
+            return None
+        return self._build(f"def when(f):\n    return {self._expression(spec, vectorized=True)}\n", "when")
+
+    def _generate_matcher(self, stage: str):
+        """def match(f) -> [(pattern index, severity), ...] for every rule of the stage"""
+        lines = ["def match(f):", "    out = []"]
+        for i, rule in enumerate(self.patterns):
+            if rule["stage"] != stage:
+                continue
+            lines.append(f"    if {self._expression(rule['when'])}:")
+            for j, (when, value) in enumerate(rule["severity"]):
+                keyword = "if" if j == 0 else "elif"
+                lines.append(f"        {keyword} {'True' if when is None else self._expression(when)}:")
+                lines.append(f"            out.append(({i}, {value!r}))")
+        lines.append("    return out")
+        return self._build("\n".join(lines) + "\n", "match")
+
+    def _generate_table(self, conditions: list):
+        """def choose(f) -> index of the first matching row (the last row is the default)"""
+        lines = ["def choose(f):"]
+        for i, when in enumerate(conditions[:-1]):
+            lines.append(f"    if {self._expression(when)}:")
+            lines.append(f"        return {i}")
+        lines.append(f"    return {len(conditions) - 1}")
+        return self._build("\n".join(lines) + "\n", "choose")
+
+    def trigger_mask(self, triggers: List[str]) -> int:
+        bits = self.trigger_bits
+        mask = 0
+        for t in triggers:
+            if t in bits:
+                mask |= bits[t]
+        return mask
+
+    def eod_features(self, eod: EODPsychInput, telemetry: Optional[JournalTelemetryInput],
+                     scores: Optional[dict] = None, patterns: Optional[list] = None) -> dict:
+        """Flat feature dict the compiled predicates read"""
+        behaviors = eod.behaviors
+        state = eod.dominant_state_one_word
+        features = {
+            "stress": eod.stress_1_10,
+            "focus": eod.focus_1_10,
+            "energy": eod.energy_1_10,
+            "tension": eod.physical_tension_1_10,
+            "urge": eod.urge_to_trade_0_10,
+            "limits_broken": not behaviors.get('limits_respected', True),
+            "shutdown_done": behaviors.get('shutdown_ritual_done', False),
+            "breaks_taken": behaviors.get('breaks_taken', False),
+            "has_telemetry": telemetry is not None,
+            "unplanned": telemetry.unplanned_trades_count if telemetry else 0,
+            "overtrading_flag": telemetry.overtrading_detected if telemetry else False,
+            "trigger_mask": self.trigger_mask(eod.triggers_selected),
+            "triggers": ','.join(eod.triggers_selected),
+            "state": state,
+        }
+        if self.state_groups:
+            lowered = state.lower()
+            for group, states in self.state_groups.items():
+                features[f"state_{group}"] = lowered in states
+        if scores:
+            for key, value in scores.items():
+                features[SHARK_SCORE_FEATURES.get(key, key)] = value
+        if patterns:
+            features.update(self.pattern_features(patterns))
+        return features
+
+    def pattern_features(self, patterns: list) -> dict:
+        features = {}
+        for p in patterns:
+            features[f"pattern_{p['pattern_id']}"] = True
+            features[f"pattern_{p['pattern_id']}_high"] = p.get("severity") == "high"
+        return features
+
+    def _hit(self, rule_id: str):
+        self.hits[rule_id] = self.hits.get(rule_id, 0) + 1
+
+    def record_hits(self, patterns: List[dict], mode: str):
+        """Count one evaluation whose result was kept (see analyze_eod's retry loop)"""
+        for p in patterns:
+            self._hit(f"pattern:{p['pattern_id']}")
+        self._hit(f"mode:{mode}")
+
+    def match_patterns(self, features: dict, stage: str = "day", count: bool = True) -> List[dict]:
+        patterns = []
+        for i, severity in self._match_stage[stage](features):
+            rule = self.patterns[i]
+            patterns.append({
+                "pattern_id": rule["id"],
+                "evidence": [e.format_map(features) for e in rule["evidence"]],
+                "severity": severity,
+                "confidence_0_1": rule["confidence"]
+            })
+            if count:
+                self._hit(f"pattern:{rule['id']}")
+        return patterns
+
+    def protocol(self, features: dict, count: bool = True) -> dict:
+        mode = self.mode_names[self._choose_mode(features)]
+        features["mode"] = mode
+        micro_rule = self.micro_rules[self._choose_micro_rule(features)][1]
+        if count:
+            self._hit(f"mode:{mode}")
+        return {
+            "mode": mode,
+            "micro_rule_if_then": micro_rule,
+            "constraints": dict(self.constraints[mode]),
+            "reset_steps": list(self.reset_steps.get(mode, self.reset_steps["default"]))
+        }
+
+    def match_patterns_batch(self, features: Dict[str, np.ndarray], n: int) -> Dict[str, np.ndarray]:
+        """Day-stage patterns over columns: pattern_<ID> and pattern_<ID>_high boolean arrays"""
+        out = {}
+        for pattern_id, when, severity_rows in zip(self.day_pattern_ids, self._batch_when, self._batch_severity):
+            matched = np.broadcast_to(when(features), n)
+            conditions = [np.broadcast_to(True if w is None else w(features), n) for w, _ in severity_rows]
+            severity = np.select(conditions, [value for _, value in severity_rows], default="")
+            out[f"pattern_{pattern_id}"] = matched
+            out[f"pattern_{pattern_id}_high"] = matched & (severity == "high")
+        return out
+
+    def choose_mode_batch(self, features: Dict[str, np.ndarray], n: int) -> np.ndarray:
+        """Index into mode_names of the first matching decision-table row, per row"""
+        conditions = [np.broadcast_to(True if when is None else when(features), n) for when in self._batch_modes]
+        return np.select(conditions, list(range(len(self.modes))), default=len(self.modes) - 1).astype(np.int8)
+
+class SharkRulesLoader:
+    """Hot-reloads the rule file when its mtime changes, checked at most every interval seconds"""
+
+    def __init__(self, path: Path, check_interval: float):
+        self.path = path
+        self.check_interval = check_interval
+        self.rules: Optional[SharkRuleSet] = None
+        self.hits: Dict[str, int] = {}
+        self.mtime = None
+        self.next_check = 0.0
+        self.loaded_at = None
+        self.reloads = 0
+        self.last_error = None
+
+    def get(self) -> SharkRuleSet:
+        now = time.monotonic()
+        if self.rules is None or now >= self.next_check:
+            self.next_check = now + self.check_interval
+            self._reload_if_changed()
+        return self.rules
+
+    def _reload_if_changed(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            if mtime == self.mtime:
+                return
+            self.mtime = mtime
+            with open(self.path, encoding="utf-8") as f:
+                rules = SharkRuleSet(json.load(f), hits=self.hits)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            if self.rules is None:
+                raise
+            # Keep serving the last good rules until the file is fixed
+            self.last_error = str(e)
+            logger.error(f"Shark rules reload failed, keeping version {self.rules.version}: {e}")
+            return
+        if self.rules is not None:
+            self.reloads += 1
+            logger.info(f"Shark rules reloaded: version {self.rules.version} -> {rules.version}")
+        self.rules = rules
+        self.loaded_at = datetime.now(timezone.utc).isoformat()
+        self.last_error = None
+
+    def stats(self) -> dict:
+        return {
+            "path": str(self.path),
+            "version": self.rules.version if self.rules else None,
+            "loaded_at": self.loaded_at,
+            "reloads": self.reloads,
+            "last_error": self.last_error,
+            # Window-stage hits come from live EODs only; batch scoring never counts
+            "pattern_stages": {p["id"]: p["stage"] for p in self.rules.patterns} if self.rules else {},
+            "hits": dict(sorted(self.hits.items()))
+        }
+
+_shark_rules = SharkRulesLoader(SHARK_RULES_PATH, SHARK_RULES_RELOAD_SECONDS)
+_shark_rules.get()
+
+def get_shark_rules() -> SharkRuleSet:
+    return _shark_rules.get()
+
 def detect_patterns(eod: EODPsychInput, telemetry: Optional[JournalTelemetryInput]):
     """Detect behavioral patterns from EOD data"""
-    patterns = []
-    
-    # Tilt Risk
-    if ('REVENGE' in eod.triggers_selected or 'CHASING' in eod.triggers_selected) and eod.stress_1_10 > 6:
-        patterns.append({
-            "pattern_id": "TILT_RISK",
-            "evidence": [f"eod:stress_{eod.stress_1_10}", f"triggers:{','.join(eod.triggers_selected)}"],
-            "severity": "high" if not eod.behaviors.get('limits_respected', True) else "medium",
-            "confidence_0_1": 0.85
-        })
-    
-    # Overtrading
-    if telemetry and (telemetry.overtrading_detected or telemetry.unplanned_trades_count > 1):
-        patterns.append({
-            "pattern_id": "OVERTRADING",
-            "evidence": [f"journal:unplanned_trades_{telemetry.unplanned_trades_count}"],
-            "severity": "high" if telemetry.unplanned_trades_count > 2 else "medium",
-            "confidence_0_1": 0.9
-        })
-    
-    # FOMO Loop
-    if 'FOMO' in eod.triggers_selected and eod.urge_to_trade_0_10 > 7:
-        patterns.append({
-            "pattern_id": "FOMO_LOOP",
-            "evidence": [f"eod:urge_{eod.urge_to_trade_0_10}", "trigger:FOMO"],
-            "severity": "medium",
-            "confidence_0_1": 0.75
-        })
-    
-    # Self Deception
-    if eod.stress_1_10 > 6 and not eod.behaviors.get('limits_respected', True) and eod.dominant_state_one_word.lower() in ['bene', 'ok', 'tranquillo', 'calm']:
-        patterns.append({
-            "pattern_id": "SELF_DECEPTION",
-            "evidence": [f"eod:stress_{eod.stress_1_10}", "behavior:limits_broken", f"state:{eod.dominant_state_one_word}"],
-            "severity": "high",
-            "confidence_0_1": 0.8
-        })
-    
-    # Avoidance
-    if 'AVOIDANCE' in eod.triggers_selected or 'FEAR' in eod.triggers_selected:
-        patterns.append({
-            "pattern_id": "AVOIDANCE",
-            "evidence": [f"triggers:{','.join(eod.triggers_selected)}"],
-            "severity": "low",
-            "confidence_0_1": 0.6
-        })
-    
-    return patterns
+    rules = get_shark_rules()
+    return rules.match_patterns(rules.eod_features(eod, telemetry))
 
 def generate_tomorrow_protocol(scores: dict, patterns: list, eod: EODPsychInput, telemetry: Optional[JournalTelemetryInput]):
     """Generate tomorrow's trading protocol based on analysis"""
-    
-    # Determine mode
-    mode = "NORMAL"
-    tilt_pattern = next((p for p in patterns if p["pattern_id"] == "TILT_RISK" and p["severity"] == "high"), None)
-    overtrading_pattern = next((p for p in patterns if p["pattern_id"] == "OVERTRADING"), None)
-    
-    if tilt_pattern:
-        mode = "TILT_LOCK"
-    elif overtrading_pattern or scores["compulsion_risk_0_100"] > 60:
-        mode = "OVERTRADING_LOCK"
-    elif scores["discipline_0_100"] < 60 or scores["clarity_0_100"] < 50:
-        mode = "A_PLUS_ONLY"
-    
-    # Generate micro rule
-    if mode == "TILT_LOCK":
-        micro_rule = "IF senti urgenza di 'recuperare' THEN chiudi la piattaforma e fai 10 respiri profondi. Nessun trade per 30 minuti."
-    elif mode == "OVERTRADING_LOCK":
-        micro_rule = "IF hai già fatto 2 trade THEN stop. Nessuna eccezione. Chiudi la piattaforma."
-    elif 'FOMO' in eod.triggers_selected:
-        micro_rule = "IF vedi un setup 'imperdibile' che non era nel piano THEN scrivi sul journal perché vuoi entrare. Aspetta 15 minuti. Se ancora lo vuoi, è un no."
-    elif eod.urge_to_trade_0_10 > 6:
-        micro_rule = "IF l'urge to trade supera 6 THEN fai una pausa di 10 minuti e rivedi il piano. Solo setup A+."
-    else:
-        micro_rule = "IF completi il pre-market routine THEN puoi tradare. Altrimenti, no trade."
-    
-    # Constraints
-    constraints = {
-        "max_trades": 2 if mode in ["TILT_LOCK", "OVERTRADING_LOCK"] else 5,
-        "timebox_minutes": 120 if mode == "TILT_LOCK" else 0,
-        "allowed_setups": ["A_PLUS_ONLY"] if mode != "NORMAL" else ["A+", "B+"]
+    rules = get_shark_rules()
+    return rules.protocol(rules.eod_features(eod, telemetry, scores, patterns))
+
+@api_router.get("/psychology/rules/stats")
+async def shark_rules_stats(current_user: dict = Depends(get_current_user)):
+    """Loaded rule version and per-rule hit counters since startup"""
+    return _shark_rules.stats()
+
+# Server-side engine state: one engine_states document per user holding the
+# progression fields plus a 7-day sliding window of pattern flags. Counts and
+# tilt streaks are maintained incrementally, so no history query per EOD.
+ENGINE_WINDOW_DAYS = 7
+ENGINE_WINDOW_PATTERNS = ("TILT_RISK", "OVERTRADING")
+ENGINE_STATE_MAX_RETRIES = 5
+
+def default_engine_state(user_id: str, seed: Optional[EngineStateInput] = None) -> dict:
+    """Initial state; seeded from the client's legacy engine_state so existing progress is kept"""
+    return {
+        "user_id": user_id,
+        **(seed or EngineStateInput()).model_dump(),
+        "version": 0,
+        "window": [],
+        "counts": {p: 0 for p in ENGINE_WINDOW_PATTERNS},
+        "updated_at": None
     }
-    
-    # Reset steps
-    reset_steps = []
-    if mode == "TILT_LOCK":
-        reset_steps = [
-            "Chiudi la piattaforma immediatamente dopo 1 loss",
-            "Fai 5 minuti di respirazione o camminata",
-            "Scrivi sul journal cosa è successo prima di rientrare"
-        ]
-    elif mode == "OVERTRADING_LOCK":
-        reset_steps = [
-            "Dopo ogni trade, pausa di 15 minuti",
-            "Rivedi il trade appena chiuso sul journal",
-            "Conferma che il prossimo trade è nel piano"
-        ]
-    else:
-        reset_steps = [
-            "Pre-market routine completata",
-            "Piano di trading definito",
-            "Livelli chiave identificati"
-        ]
-    
+
+def _window_date(entry: dict):
+    return datetime.strptime(entry["date"], "%Y-%m-%d").date()
+
+def push_engine_window(state: dict, day: str, patterns: List[dict]):
+    """Insert (or replace) one day in the sliding window, updating counts and streaks in place"""
+    detected = {p["pattern_id"] for p in patterns}
+    entry = {"date": day, "tilt_streak": 0, **{p: p in detected for p in ENGINE_WINDOW_PATTERNS}}
+    window, counts = state["window"], state["counts"]
+
+    # Re-submitting a day replaces its previous entry
+    for i, old in enumerate(window):
+        if old["date"] == day:
+            for p in ENGINE_WINDOW_PATTERNS:
+                counts[p] -= old[p]
+            window.pop(i)
+            break
+
+    pos = next((i for i, e in enumerate(window) if e["date"] > day), len(window))
+    window.insert(pos, entry)
+    for p in ENGINE_WINDOW_PATTERNS:
+        counts[p] += entry[p]
+
+    # Evict days that slid out relative to the newest day
+    newest = _window_date(window[-1])
+    while (newest - _window_date(window[0])).days >= ENGINE_WINDOW_DAYS:
+        old = window.pop(0)
+        for p in ENGINE_WINDOW_PATTERNS:
+            counts[p] -= old[p]
+        pos -= 1
+    if pos < 0:
+        return
+
+    # Streaks only change from the inserted day forward
+    for i in range(pos, len(window)):
+        current, prev = window[i], window[i - 1] if i else None
+        consecutive = prev is not None and (_window_date(current) - _window_date(prev)).days == 1
+        current["tilt_streak"] = ((prev["tilt_streak"] if consecutive else 0) + 1) if current["TILT_RISK"] else 0
+
+def detect_multiday_patterns(state: dict, day: str, rules: Optional[SharkRuleSet] = None) -> List[dict]:
+    """Window-stage rules (TILT_STREAK, OVERTRADING_WEEK) over the sliding window; hits are not counted"""
+    entry = next((e for e in state["window"] if e["date"] == day), None)
+    features = {
+        "tilt_streak": entry["tilt_streak"] if entry else 0,
+        "overtrading_days": state["counts"]["OVERTRADING"],
+        "window_days": ENGINE_WINDOW_DAYS
+    }
+    return (rules or get_shark_rules()).match_patterns(features, stage="window", count=False)
+
+def public_engine_state(state: dict) -> dict:
     return {
-        "mode": mode,
-        "micro_rule_if_then": micro_rule,
-        "constraints": constraints,
-        "reset_steps": reset_steps
+        **{k: state[k] for k in EngineStateInput.model_fields},
+        "version": state["version"],
+        "window_days": ENGINE_WINDOW_DAYS,
+        "window_counts": state["counts"],
+        "tilt_streak": state["window"][-1]["tilt_streak"] if state["window"] else 0,
+        "updated_at": state["updated_at"]
     }
 
-@api_router.post("/psychology/eod")
-async def analyze_eod(data: SharkMindRequest, current_user: dict = Depends(get_current_user)):
-    """Shark Mind Engine - EOD Analysis Endpoint"""
-    
-    eod = data.eod_psych
-    telemetry = data.journal_telemetry
-    engine_state = data.engine_state or EngineStateInput()
+async def load_engine_state(user_id: str, seed: Optional[EngineStateInput] = None) -> dict:
+    state = await db.engine_states.find_one({"user_id": user_id}, {"_id": 0})
+    return state or default_engine_state(user_id, seed)
+
+async def save_engine_state(state: dict) -> bool:
+    """Compare-and-swap on version; False means another EOD updated the state first"""
+    version = state["version"]
+    updated = {**state, "version": version + 1, "updated_at": datetime.now(timezone.utc).isoformat()}
+    try:
+        if version == 0:
+            await db.engine_states.insert_one(dict(updated))
+        else:
+            res = await db.engine_states.replace_one({"user_id": state["user_id"], "version": version}, updated)
+            if res.matched_count == 0:
+                return False
+    except DuplicateKeyError:
+        return False
+    state.update(version=updated["version"], updated_at=updated["updated_at"])
+    return True
+
+@api_router.get("/psychology/engine-state")
+async def get_engine_state(current_user: dict = Depends(get_current_user)):
+    return public_engine_state(await load_engine_state(current_user["id"]))
+
+def evaluate_eod(eod: EODPsychInput, telemetry: Optional[JournalTelemetryInput], state: dict):
+    """Run the Shark Mind Engine for one EOD against the user's engine state (mutated in place)"""
+    day = feature_day(eod.date)
+    replaced = next((e for e in state["window"] if e["date"] == day), None)
+    if replaced:
+        # A re-submitted day replaces its earlier progression instead of adding to it
+        state["confidence_readiness"] = max(0, min(100, state["confidence_readiness"] - replaced.get("readiness_delta", 0)))
+        state["grace_tokens"] -= replaced.get("grace_delta", 0)
+    engine_state = EngineStateInput(**{k: state[k] for k in EngineStateInput.model_fields})
     phase = engine_state.phase
     
     # Calculate scores
     scores = calculate_shark_scores(eod, telemetry, phase)
     
-    # Detect patterns
-    patterns = detect_patterns(eod, telemetry)
+    # Detect patterns (single day, then across the sliding window). Hit counters are
+    # left to the caller: a lost version check re-runs this on a fresh state.
+    rules = get_shark_rules()
+    features = rules.eod_features(eod, telemetry, scores)
+    patterns = rules.match_patterns(features, count=False)
+    push_engine_window(state, day, patterns)
+    patterns += detect_multiday_patterns(state, day, rules)
     
     # Generate tomorrow protocol
-    tomorrow_protocol = generate_tomorrow_protocol(scores, patterns, eod, telemetry)
+    features.update(rules.pattern_features(patterns))
+    tomorrow_protocol = rules.protocol(features, count=False)
     
     # Determine key cause and well done
     one_key_cause = "Hai mantenuto il controllo oggi."
@@ -674,15 +1710,24 @@ async def analyze_eod(data: SharkMindRequest, current_user: dict = Depends(get_c
     elif scores["shark_score_0_100"] < 40:
         confidence_readiness = max(0, confidence_readiness - 10)
     
-    # Check promotion eligibility
-    promotion_eligible = confidence_readiness >= 75 and scores["discipline_0_100"] >= 70
-    promotion_suggested = promotion_eligible and phase != "MAINTENANCE_PLUS"
-    
     # Grace tokens logic
     grace_tokens = engine_state.grace_tokens
     if phase == "ACQUISITION" and not eod.behaviors.get('limits_respected', True):
         grace_tokens = max(0, grace_tokens - 1)
     
+    # The window entry remembers the applied deltas so a re-submission can undo them.
+    # A day already older than the window has no entry to undo by, so it does not progress.
+    entry = next((e for e in state["window"] if e["date"] == day), None)
+    if entry is None:
+        confidence_readiness, grace_tokens = engine_state.confidence_readiness, engine_state.grace_tokens
+    else:
+        entry["readiness_delta"] = confidence_readiness - engine_state.confidence_readiness
+        entry["grace_delta"] = grace_tokens - engine_state.grace_tokens
+    
+    # Check promotion eligibility
+    promotion_eligible = confidence_readiness >= 75 and scores["discipline_0_100"] >= 70
+    promotion_suggested = promotion_eligible and phase != "MAINTENANCE_PLUS"
+    
     # Readiness message
     if scores["shark_score_0_100"] >= 75:
         message = f"Oggi hai dimostrato solidità. Shark Score {scores['shark_score_0_100']}. Continua così e la promozione arriverà naturalmente."
@@ -724,58 +1769,671 @@ async def analyze_eod(data: SharkMindRequest, current_user: dict = Depends(get_c
     if tomorrow_protocol["mode"] == "OVERTRADING_LOCK":
         result["data_updates"]["flags"].append("OVERTRADING_FLAG")
     
+    state["confidence_readiness"] = confidence_readiness
+    state["grace_tokens"] = grace_tokens
+    return result, scores, patterns
+
+@api_router.post("/psychology/eod")
+async def analyze_eod(data: SharkMindRequest, current_user: dict = Depends(get_current_user)):
+    """Shark Mind Engine - EOD Analysis Endpoint"""
+    
+    eod = data.eod_psych
+    telemetry = data.journal_telemetry
+    
+    # The stored engine state is authoritative; the client's engine_state only seeds a new user
+    for _ in range(ENGINE_STATE_MAX_RETRIES):
+        state = await load_engine_state(current_user["id"], seed=data.engine_state)
+        result, scores, patterns = evaluate_eod(eod, telemetry, state)
+        if await save_engine_state(state):
+            break
+    else:
+        raise HTTPException(status_code=409, detail="Analisi EOD in corso su un'altra sessione, riprova")
+    get_shark_rules().record_hits(patterns, result["tomorrow_protocol"]["mode"])
+    result["engine_state"] = public_engine_state(state)
+    
     # Save to DB
-    await db.psychology_eod.insert_one({
+    stored_input = data.model_dump()
+    stored_input["engine_state"] = {k: result["engine_state"][k] for k in EngineStateInput.model_fields}
+    # One document per day: a re-submission replaces the earlier analysis
+    saved = await db.psychology_eod.replace_one({"user_id": current_user["id"], "date": eod.date}, {
         "user_id": current_user["id"],
         "date": eod.date,
-        "input": data.model_dump(),
+        "input": stored_input,
         "result": result,
         "created_at": datetime.now(timezone.utc).isoformat()
-    })
+    }, upsert=True)
+    await record_user_features(current_user["id"], feature_day(eod.date), eod_feature_increments(eod.stress_1_10, scores, patterns),
+                               replace_groups=FEATURE_DAILY_GROUPS)
+    await invalidate_psychology_report(current_user["id"], eod.date)
     
-    # Update user XP
-    await db.users.update_one({"id": current_user["id"]}, {"$inc": {"xp": 20}})
+    # Update user XP, once per day
+    if saved.matched_count == 0:
+        await db.users.update_one({"id": current_user["id"]}, {"$inc": {"xp": 20}})
     
     return result
 
+# ==================== SHARK MIND BATCH ====================
+
+# Column-wise replica of calculate_shark_scores plus the compiled day-stage rules
+# and protocol decision table, for re-scoring whole EOD histories and backtesting
+# rule changes. Window-stage rules depend on earlier days, so they are replayed
+# row by row through the engine window when the rows are one user's dated history.
+# Must stay identical to the scalar path (see tests/test_shark_batch.py).
+SHARK_PHASES = ("ACQUISITION", "MAINTENANCE", "MAINTENANCE_PLUS")
+
+def eod_requests_to_columns(requests: List[dict], phase: Optional[str] = None,
+                            rules: Optional[SharkRuleSet] = None) -> Dict[str, np.ndarray]:
+    """Flatten SharkMindRequest-shaped dicts (as stored in psychology_eod.input) into numpy columns"""
+    rules = rules or get_shark_rules()
+    n = len(requests)
+    ints = {k: np.zeros(n, dtype=np.int64) for k in (
+        "stress", "focus", "energy", "tension", "urge", "unplanned", "phase", "trigger_mask")}
+    flags = {k: np.zeros(n, dtype=bool) for k in (
+        "limits_respected", "shutdown_done", "breaks_taken", "has_telemetry", "overtrading_flag",
+        "fomo", "revenge", *(f"state_{g}" for g in rules.state_groups))}
+
+    for i, req in enumerate(requests):
+        eod = req["eod_psych"]
+        behaviors = eod.get("behaviors") or {}
+        ints["stress"][i] = eod["stress_1_10"]
+        ints["focus"][i] = eod["focus_1_10"]
+        ints["energy"][i] = eod["energy_1_10"]
+        ints["tension"][i] = eod["physical_tension_1_10"]
+        ints["urge"][i] = eod["urge_to_trade_0_10"]
+        flags["limits_respected"][i] = behaviors.get('limits_respected', True)
+        flags["shutdown_done"][i] = behaviors.get('shutdown_ritual_done', False)
+        flags["breaks_taken"][i] = behaviors.get('breaks_taken', False)
+        state = (eod.get("dominant_state_one_word") or "").lower()
+        for group, states in rules.state_groups.items():
+            flags[f"state_{group}"][i] = state in states
+        selected = eod.get("triggers_selected") or []
+        ints["trigger_mask"][i] = rules.trigger_mask(selected)
+        # calculate_shark_scores reads these triggers directly, independent of the rule file
+        flags["fomo"][i] = 'FOMO' in selected
+        flags["revenge"][i] = 'REVENGE' in selected or 'CHASING' in selected
+        telemetry = req.get("journal_telemetry")
+        if telemetry:
+            flags["has_telemetry"][i] = True
+            ints["unplanned"][i] = telemetry.get("unplanned_trades_count", 0)
+            flags["overtrading_flag"][i] = telemetry.get("overtrading_detected", False)
+        row_phase = phase or (req.get("engine_state") or {}).get("phase", "ACQUISITION")
+        # Any unknown phase takes the strictest branch, like calculate_shark_scores' else
+        ints["phase"][i] = SHARK_PHASES.index(row_phase) if row_phase in SHARK_PHASES else 2
+
+    return {**ints, **flags}
+
+def replay_engine_window(features: Dict[str, np.ndarray], days: List[str], rules: SharkRuleSet) -> Dict[str, np.ndarray]:
+    """Window-stage pattern columns from pushing each row's day-stage patterns through a fresh engine window"""
+    n = len(days)
+    out = {}
+    for rule in rules.patterns:
+        if rule["stage"] == "window":
+            out[f"pattern_{rule['id']}"] = np.zeros(n, dtype=bool)
+            out[f"pattern_{rule['id']}_high"] = np.zeros(n, dtype=bool)
+    state = default_engine_state("")
+    for i, day in enumerate(days):
+        push_engine_window(state, day, [{"pattern_id": p} for p in ENGINE_WINDOW_PATTERNS if features[f"pattern_{p}"][i]])
+        for p in detect_multiday_patterns(state, day, rules):
+            out[f"pattern_{p['pattern_id']}"][i] = True
+            out[f"pattern_{p['pattern_id']}_high"][i] = p["severity"] == "high"
+    return out
+
+def score_eod_batch(c: Dict[str, np.ndarray], rules: Optional[SharkRuleSet] = None,
+                    days: Optional[List[str]] = None) -> Dict[str, np.ndarray]:
+    """Vectorized Shark Mind scoring, pattern flags and protocol mode for every row of c
+
+    days (YYYY-MM-DD, in submission order) marks the rows as one user's history and
+    replays the window-stage rules over it; without it they are not evaluated and
+    are left out of patterns / patterns_high (the protocol then reads them as absent).
+    """
+    rules = rules or get_shark_rules()
+    n = len(c["stress"])
+    stress, focus, tension, urge = c["stress"], c["focus"], c["tension"], c["urge"]
+    limits_broken = ~c["limits_respected"]
+    unplanned = np.where(c["has_telemetry"], c["unplanned"], 0)
+
+    # Same operation order as the scalar path so float results match exactly
+    emotional_load = (stress + tension) / 2 + urge / 2
+    clarity = np.clip((focus - stress + 10) * 10, 0, 100)
+
+    discipline = (50 + np.where(c["limits_respected"], 20, 0) + np.where(c["shutdown_done"], 15, 0)
+                  + np.where(c["breaks_taken"], 10, 0) - np.where(limits_broken, 30, 0))
+    discipline = discipline - np.where(unplanned > 0, unplanned * 10, 0) - np.where(c["has_telemetry"] & c["overtrading_flag"], 20, 0)
+    discipline = np.clip(discipline, 0, 100)
+
+    emotional_stability = np.clip(100 - emotional_load * 5, 0, 100)
+
+    compulsion = (np.where(urge > 7, 30, 0) + np.where(c["fomo"], 20, 0)
+                  + np.where(c["revenge"], 25, 0) + np.where(unplanned > 0, 15, 0))
+    compulsion = np.minimum(100, compulsion)
+
+    permissive = (discipline * 0.35 + clarity * 0.25 + emotional_stability * 0.25 + (100 - compulsion) * 0.15)
+    strict = (discipline * 0.40 + clarity * 0.20 + emotional_stability * 0.20 + (100 - compulsion) * 0.20)
+    phase = c["phase"]
+    shark = np.where(phase == 1, strict, permissive).astype(np.int64)
+    shark = shark - np.where((phase == 2) & (discipline < 80), 10, 0)
+    shark = np.clip(shark, 0, 100)
+
+    scores = {
+        "shark_score_0_100": shark,
+        "discipline_0_100": discipline.astype(np.int64),
+        "clarity_0_100": clarity.astype(np.int64),
+        "emotional_stability_0_100": emotional_stability.astype(np.int64),
+        "compulsion_risk_0_100": compulsion.astype(np.int64),
+    }
+
+    # Same feature names as SharkRuleSet.eod_features, so the compiled predicates apply
+    features = {**c, "limits_broken": limits_broken, "unplanned": unplanned}
+    features.update({k.replace("_0_100", ""): v for k, v in scores.items()})
+    features.update(rules.match_patterns_batch(features, n))
+    if days is not None:
+        features.update(replay_engine_window(features, days, rules))
+
+    evaluated = [pid for pid in rules.pattern_ids if f"pattern_{pid}" in features]
+    return {
+        **scores,
+        "patterns": {pid: features[f"pattern_{pid}"] for pid in evaluated},
+        "patterns_high": {pid: features[f"pattern_{pid}_high"] for pid in evaluated},
+        "mode": rules.choose_mode_batch(features, n),
+        "mode_names": rules.mode_names,
+    }
+
+def summarize_eod_batch(batch: Dict[str, np.ndarray]) -> dict:
+    """Aggregate a scored batch into score averages, pattern counts and protocol mode counts"""
+    n = len(batch["mode"])
+    if not n:
+        return {"rows": 0, "avg_scores": {}, "pattern_counts": {}, "mode_counts": {}}
+    score_keys = ("shark_score_0_100", "discipline_0_100", "clarity_0_100", "emotional_stability_0_100", "compulsion_risk_0_100")
+    mode_counts = np.bincount(batch["mode"], minlength=len(batch["mode_names"]))
+    return {
+        "rows": n,
+        "avg_scores": {k: round(float(batch[k].mean()), 2) for k in score_keys},
+        "pattern_counts": {p: int(v.sum()) for p, v in batch["patterns"].items()},
+        "mode_counts": {m: int(mode_counts[i]) for i, m in enumerate(batch["mode_names"])},
+    }
+
+@api_router.post("/psychology/eod/backtest")
+async def backtest_eod_history(phase: Optional[str] = None, include_rows: bool = False,
+                               current_user: dict = Depends(get_current_user)):
+    """Re-score the user's whole EOD history with the current rules (optionally under another phase)"""
+    if phase and phase not in SHARK_PHASES:
+        raise HTTPException(status_code=400, detail=f"Fase non valida. Usa: {', '.join(SHARK_PHASES)}")
+
+    docs = await db.psychology_eod.find(
+        {"user_id": current_user["id"]},
+        {"_id": 0, "date": 1, "input": 1, "result.scores.shark_score_0_100": 1, "result.tomorrow_protocol.mode": 1}
+    ).sort([("date", 1), ("created_at", 1)]).to_list(100000)
+    docs = [d for d in docs if d.get("input", {}).get("eod_psych")]
+
+    # History is replayed through the sliding window so multi-day rules feed the modes
+    batch = score_eod_batch(eod_requests_to_columns([d["input"] for d in docs], phase),
+                            days=[feature_day(d["date"]) for d in docs])
+    modes = [batch["mode_names"][m] for m in batch["mode"]]
+    stored_modes = [d.get("result", {}).get("tomorrow_protocol", {}).get("mode") for d in docs]
+
+    response = {
+        "phase": phase,
+        "summary": summarize_eod_batch(batch),
+        "mode_changes": sum(1 for new, old in zip(modes, stored_modes) if old and new != old),
+    }
+    if include_rows:
+        response["rows"] = [{
+            "date": d["date"],
+            "shark_score_0_100": int(batch["shark_score_0_100"][i]),
+            "stored_shark_score_0_100": d.get("result", {}).get("scores", {}).get("shark_score_0_100"),
+            "mode": modes[i],
+            "stored_mode": stored_modes[i],
+        } for i, d in enumerate(docs)]
+    return response
+
+# ==================== LLM GATEWAY ====================
+
+LLM_PROVIDER = "openai"
+LLM_MODEL = "gpt-5.2"
+LLM_CACHE_TTL_SECONDS = int(os.environ.get('LLM_CACHE_TTL_SECONDS', 24 * 3600))
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get('LLM_CACHE_MAX_ENTRIES', 2000))
+LLM_CACHE_PATH = os.environ.get('LLM_CACHE_PATH', str(ROOT_DIR / 'llm_cache.sqlite3'))
+# Optional OpenAI-compatible endpoint used for token streaming (e.g. https://host/v1)
+LLM_STREAM_URL = os.environ.get('LLM_STREAM_URL', '')
+LLM_STREAM_API_KEY = os.environ.get('LLM_STREAM_API_KEY', EMERGENT_LLM_KEY)
+LLM_STREAM_TIMEOUT_SECONDS = float(os.environ.get('LLM_STREAM_TIMEOUT_SECONDS', 120))
+
+class LLMResponseCache:
+    """Content-addressed LRU cache of LLM completions with TTL, persisted to SQLite.
+
+    Reads are served from memory; the SQLite file only warms the cache on startup.
+    Writes to the file run in order on one background thread, off the event loop.
+    """
+
+    def __init__(self, path: Optional[str], max_entries: int, ttl_seconds: int):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (expires_at, response)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._store = None
+        self._writer = None
+        if path:
+            try:
+                self._store = sqlite3.connect(path, check_same_thread=False)
+                self._store.execute("PRAGMA journal_mode=WAL")
+                self._store.execute("PRAGMA synchronous=NORMAL")
+                self._store.execute(
+                    "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, response TEXT, expires_at REAL)"
+                )
+                self._store.execute("DELETE FROM llm_cache WHERE expires_at < ?", (time.time(),))
+                self._store.commit()
+                rows = self._store.execute(
+                    "SELECT key, response, expires_at FROM llm_cache ORDER BY expires_at DESC LIMIT ?", (max_entries,)
+                ).fetchall()
+                for key, response, expires_at in reversed(rows):
+                    self._entries[key] = (expires_at, response)
+                self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="llm-cache")
+            except sqlite3.Error as e:
+                logger.warning(f"LLM cache store unavailable, using memory only: {e}")
+                self._store = None
+
+    @staticmethod
+    def make_key(system_message: str, model: str, text: str) -> str:
+        normalized = " ".join(text.split())
+        payload = json.dumps([" ".join(system_message.split()), model, normalized], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, response = entry
+        if expires_at < time.time():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return response
+
+    def set(self, key: str, response: str):
+        expires_at = time.time() + self.ttl_seconds
+        self._entries[key] = (expires_at, response)
+        self._entries.move_to_end(key)
+        evicted = []
+        while len(self._entries) > self.max_entries:
+            evicted.append(self._entries.popitem(last=False)[0])
+            self.evictions += 1
+        if self._writer:
+            self._writer.submit(self._persist, [(key, response, expires_at)], evicted)
+
+    def _remove(self, key: str):
+        self._entries.pop(key, None)
+        if self._writer:
+            self._writer.submit(self._persist, [], [key])
+
+    def _persist(self, upserts: List[tuple], deletes: List[str]):
+        try:
+            if upserts:
+                self._store.executemany(
+                    "INSERT OR REPLACE INTO llm_cache (key, response, expires_at) VALUES (?, ?, ?)", upserts
+                )
+            if deletes:
+                self._store.executemany("DELETE FROM llm_cache WHERE key = ?", [(k,) for k in deletes])
+            self._store.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"LLM cache persist error: {e}")
+
+    def flush(self):
+        """Block until queued writes have reached the SQLite file"""
+        if self._writer:
+            self._writer.submit(lambda: None).result()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "persistent": self._store is not None,
+        }
+
+_llm_cache = LLMResponseCache(LLM_CACHE_PATH, LLM_CACHE_MAX_ENTRIES, LLM_CACHE_TTL_SECONDS)
+_llm_inflight = {}  # cache key -> Task shared by identical concurrent calls
+
+async def _llm_send(system_message: str, text: str, session_id: str) -> str:
+    from emergentintegrations.llm.chat import LlmChat, UserMessage
+    chat = LlmChat(
+        api_key=EMERGENT_LLM_KEY,
+        session_id=session_id,
+        system_message=system_message
+    ).with_model(LLM_PROVIDER, LLM_MODEL)
+    with timed("llm"):
+        return await chat.send_message(UserMessage(text=text))
+
+async def _llm_fetch(key: str, system_message: str, text: str, session_id: str) -> str:
+    try:
+        response = await _llm_send(system_message, text, session_id)
+        if response:
+            _llm_cache.set(key, response)
+        return response
+    finally:
+        _llm_inflight.pop(key, None)
+
+def _retrieve_task_exception(task: asyncio.Task):
+    # Nobody may be left awaiting the task; retrieve its exception so asyncio does not log it
+    if not task.cancelled():
+        task.exception()
+
+async def llm_complete(system_message: str, text: str, session_id: str, use_cache: bool = True) -> str:
+    """Single entry point for LLM calls: content-addressed cache, then LlmChat.
+
+    Identical concurrent requests share one upstream call. The call runs as its own task,
+    so a caller that is cancelled does not cancel it for the others (its result is still cached).
+    """
+    if not use_cache:
+        return await _llm_send(system_message, text, session_id)
+
+    key = LLMResponseCache.make_key(system_message, f"{LLM_PROVIDER}/{LLM_MODEL}", text)
+    cached = _llm_cache.get(key)
+    if cached is not None:
+        return cached
+    task = _llm_inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(_llm_fetch(key, system_message, text, session_id))
+        task.add_done_callback(_retrieve_task_exception)
+        _llm_inflight[key] = task
+    return await asyncio.shield(task)
+
+async def _stream_openai_compatible(system_message: str, text: str):
+    """Yield content deltas from an OpenAI-compatible /chat/completions SSE stream"""
+    payload = {
+        "model": LLM_MODEL,
+        "stream": True,
+        "messages": [
+            {"role": "system", "content": system_message},
+            {"role": "user", "content": text},
+        ],
+    }
+    headers = {"Authorization": f"Bearer {LLM_STREAM_API_KEY}"} if LLM_STREAM_API_KEY else {}
+    timeout = httpx.Timeout(LLM_STREAM_TIMEOUT_SECONDS, connect=10)
+    async with httpx.AsyncClient(timeout=timeout) as http:
+        async with http.stream("POST", f"{LLM_STREAM_URL.rstrip('/')}/chat/completions", json=payload, headers=headers) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                choices = json.loads(data).get("choices") or [{}]
+                delta = (choices[0].get("delta") or {}).get("content")
+                if delta:
+                    yield delta
+
+async def llm_stream(system_message: str, text: str, session_id: str):
+    """Token stream for the LLM gateway.
+
+    Uses the OpenAI-compatible endpoint in LLM_STREAM_URL when configured; otherwise falls back to
+    a single chunk from llm_complete(). Completed streams are stored in the response cache.
+    """
+    if not LLM_STREAM_URL:
+        yield await llm_complete(system_message, text, session_id)
+        return
+
+    key = LLMResponseCache.make_key(system_message, f"{LLM_PROVIDER}/{LLM_MODEL}", text)
+    cached = _llm_cache.get(key)
+    if cached is not None:
+        yield cached
+        return
+
+    parts = []
+    async for token in _stream_openai_compatible(system_message, text):
+        parts.append(token)
+        yield token
+    if parts:
+        _llm_cache.set(key, "".join(parts))
+
+@api_router.get("/ai/cache/stats")
+async def get_llm_cache_stats(current_user: dict = Depends(get_current_user)):
+    return _llm_cache.stats()
+
+# ==================== BACKGROUND JOBS ====================
+
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 4))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 5))
+JOB_BACKOFF_BASE_SECONDS = 2.0
+JOB_BACKOFF_MAX_SECONDS = 300.0
+JOB_LLM_CONCURRENCY = int(os.environ.get('JOB_LLM_CONCURRENCY', 2))
+JOB_WAIT_MAX_SECONDS = 30
+
+class Job(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    kind: str
+    user_id: str
+    payload: Dict[str, Any] = {}
+    status: str = "queued"  # queued/running/succeeded/failed
+    attempts: int = 0
+    max_attempts: int = JOB_MAX_ATTEMPTS
+    result: Optional[Any] = None
+    error: Optional[str] = None
+    run_after: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
+    created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
+    updated_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
+
+# kind -> (handler, on_final_failure)
+JOB_HANDLERS = {}
+_job_queue = None
+_job_workers = []
+_job_llm_semaphore = None
+_job_waiters = {}  # job id -> set of asyncio.Events, one per long-poll, set when the job settles
+
+def job_handler(kind: str, on_failure=None):
+    """Register an async handler(job) for a job kind; on_failure(job, error) runs after the last attempt"""
+    def register(fn):
+        JOB_HANDLERS[kind] = (fn, on_failure)
+        return fn
+    return register
+
+async def enqueue_job(kind: str, user_id: str, payload: Dict[str, Any], job_id: Optional[str] = None) -> Job:
+    """Persist a job and hand it to the in-process workers"""
+    job = Job(kind=kind, user_id=user_id, payload=payload)
+    if job_id:
+        job.id = job_id
+    await db.jobs.insert_one(job.model_dump())
+    if _job_queue is not None:
+        _job_queue.put_nowait(job.id)
+    return job
+
+def _job_backoff_seconds(attempts: int) -> float:
+    delay = min(JOB_BACKOFF_MAX_SECONDS, JOB_BACKOFF_BASE_SECONDS * 2 ** (attempts - 1))
+    return delay * (0.5 + random.random() / 2)
+
+def _schedule_job(job_id: str, delay: float):
+    if _job_queue is None:
+        return
+    if delay <= 0:
+        _job_queue.put_nowait(job_id)
+    else:
+        asyncio.get_running_loop().call_later(delay, _job_queue.put_nowait, job_id)
+
+def _settle_job(job_id: str):
+    for waiter in _job_waiters.pop(job_id, ()):
+        waiter.set()
+
+async def _run_job(job_id: str):
+    now = datetime.now(timezone.utc).isoformat()
+    # Claim the job atomically so a requeued id never runs twice
+    job = await db.jobs.find_one_and_update(
+        {"id": job_id, "status": "queued"},
+        {"$set": {"status": "running", "updated_at": now}, "$inc": {"attempts": 1}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.BEFORE
+    )
+    if not job:
+        return
+    job["attempts"] += 1
+    handler, on_failure = JOB_HANDLERS.get(job["kind"], (None, None))
+    try:
+        if handler is None:
+            raise ValueError(f"No handler for job kind {job['kind']}")
+        result = await handler(job)
+    except Exception as e:
+        now = datetime.now(timezone.utc).isoformat()
+        if job["attempts"] < job["max_attempts"]:
+            delay = _job_backoff_seconds(job["attempts"])
+            logger.warning(f"Job {job_id} ({job['kind']}) attempt {job['attempts']} failed, retry in {delay:.1f}s: {e}")
+            await db.jobs.update_one({"id": job_id}, {"$set": {
+                "status": "queued",
+                "error": str(e),
+                "run_after": (datetime.now(timezone.utc) + timedelta(seconds=delay)).isoformat(),
+                "updated_at": now
+            }})
+            _schedule_job(job_id, delay)
+            return
+        logger.error(f"Job {job_id} ({job['kind']}) failed after {job['attempts']} attempts: {e}")
+        await db.jobs.update_one({"id": job_id}, {"$set": {"status": "failed", "error": str(e), "updated_at": now}})
+        if on_failure:
+            try:
+                await on_failure(job, e)
+            except Exception as hook_error:
+                logger.error(f"Job {job_id} failure hook error: {hook_error}")
+        _settle_job(job_id)
+        return
+
+    await db.jobs.update_one({"id": job_id}, {"$set": {
+        "status": "succeeded",
+        "result": result,
+        "error": None,
+        "updated_at": datetime.now(timezone.utc).isoformat()
+    }})
+    _settle_job(job_id)
+
+async def _job_worker():
+    while True:
+        job_id = await _job_queue.get()
+        try:
+            await _run_job(job_id)
+        except Exception as e:
+            logger.error(f"Job worker error on {job_id}: {e}")
+        finally:
+            _job_queue.task_done()
+
+async def start_job_workers():
+    """Start the workers and requeue jobs left unfinished by a previous process"""
+    global _job_queue, _job_llm_semaphore
+    _job_queue = asyncio.Queue()
+    _job_llm_semaphore = asyncio.Semaphore(JOB_LLM_CONCURRENCY)
+    _job_workers.extend(asyncio.create_task(_job_worker()) for _ in range(JOB_WORKERS))
+
+    await db.jobs.update_many({"status": "running"}, {"$set": {"status": "queued"}})
+    now = datetime.now(timezone.utc)
+    pending = await db.jobs.find({"status": "queued"}, {"_id": 0, "id": 1, "run_after": 1}).to_list(10000)
+    for job in pending:
+        delay = (datetime.fromisoformat(job["run_after"]) - now).total_seconds() if job.get("run_after") else 0
+        _schedule_job(job["id"], delay)
+    if pending:
+        logger.info(f"Requeued {len(pending)} pending jobs")
+
+async def stop_job_workers():
+    for task in _job_workers:
+        task.cancel()
+    await asyncio.gather(*_job_workers, return_exceptions=True)
+    _job_workers.clear()
+
+@api_router.get("/jobs")
+async def list_jobs(job_status: Optional[str] = Query(None, alias="status"), current_user: dict = Depends(get_current_user)):
+    query = {"user_id": current_user["id"]}
+    if job_status:
+        query["status"] = job_status
+    return await db.jobs.find(query, {"_id": 0}).sort("created_at", -1).to_list(50)
+
+@api_router.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0, current_user: dict = Depends(get_current_user)):
+    """Job status. With `wait` (seconds) the call long-polls until the job settles."""
+    job = await db.jobs.find_one({"id": job_id, "user_id": current_user["id"]}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if wait > 0 and job["status"] in ("queued", "running"):
+        waiter = asyncio.Event()
+        waiters = _job_waiters.setdefault(job_id, set())
+        waiters.add(waiter)
+        try:
+            # Re-read now that the waiter is registered: the job may have settled in between
+            job = await db.jobs.find_one({"id": job_id}, {"_id": 0})
+            if job["status"] in ("queued", "running"):
+                try:
+                    await asyncio.wait_for(waiter.wait(), timeout=min(wait, JOB_WAIT_MAX_SECONDS))
+                except asyncio.TimeoutError:
+                    pass
+                job = await db.jobs.find_one({"id": job_id}, {"_id": 0})
+        finally:
+            waiters.discard(waiter)
+            if not waiters and _job_waiters.get(job_id) is waiters:
+                del _job_waiters[job_id]
+    return job
+
 # ==================== JOURNAL ROUTES ====================
 
+JOURNAL_FALLBACK_SUGGESTIONS = ["Rivedi il tuo piano di trading", "Mantieni la disciplina", "Gestisci le emozioni"]
+
+async def _store_journal_suggestions(entry_id: str, suggestions: List[str], ai_status: str):
+    await db.journal_entries.update_one(
+        {"id": entry_id},
+        {"$set": {"ai_suggestions": suggestions, "ai_status": ai_status}}
+    )
+
+async def _journal_suggestions_failed(job: dict, error: Exception):
+    await _store_journal_suggestions(job["payload"]["entry_id"], JOURNAL_FALLBACK_SUGGESTIONS, "fallback")
+
+@job_handler("journal_suggestions", on_failure=_journal_suggestions_failed)
+async def generate_journal_suggestions(job: dict):
+    """Background job: ask the coach for 3 suggestions and attach them to the journal entry"""
+    payload = job["payload"]
+    async with _job_llm_semaphore:
+        response = await llm_complete(
+            "Sei un coach di trading esperto. Analizza gli errori del trader e dai 3 consigli pratici brevi in italiano.",
+            f"Errori di oggi: {payload['errors_today']}\nLezioni apprese: {payload['lessons_learned']}",
+            session_id=f"journal-{job['user_id']}-{datetime.now().isoformat()}"
+        )
+    ai_suggestions = [s.strip() for s in response.split('\n') if s.strip()][:3]
+    await _store_journal_suggestions(payload["entry_id"], ai_suggestions, "ready")
+    return {"ai_suggestions": ai_suggestions}
+
 @api_router.post("/journal/entry", response_model=JournalEntry)
 async def create_journal_entry(data: JournalEntryCreate, current_user: dict = Depends(get_current_user)):
-    # Generate AI suggestions based on errors
-    ai_suggestions = []
-    if EMERGENT_LLM_KEY and data.errors_today:
-        try:
-            from emergentintegrations.llm.chat import LlmChat, UserMessage
-            chat = LlmChat(
-                api_key=EMERGENT_LLM_KEY,
-                session_id=f"journal-{current_user['id']}-{datetime.now().isoformat()}",
-                system_message="Sei un coach di trading esperto. Analizza gli errori del trader e dai 3 consigli pratici brevi in italiano."
-            ).with_model("openai", "gpt-5.2")
-            
-            msg = UserMessage(text=f"Errori di oggi: {data.errors_today}\nLezioni apprese: {data.lessons_learned}")
-            response = await chat.send_message(msg)
-            ai_suggestions = [s.strip() for s in response.split('\n') if s.strip()][:3]
-        except Exception as e:
-            logger.error(f"AI suggestion error: {e}")
-            ai_suggestions = ["Rivedi il tuo piano di trading", "Mantieni la disciplina", "Gestisci le emozioni"]
-    
     entry = JournalEntry(
         user_id=current_user["id"],
         date=datetime.now(timezone.utc).strftime("%Y-%m-%d"),
-        ai_suggestions=ai_suggestions,
         **data.model_dump()
     )
+    # AI suggestions are generated in the background; poll /jobs/{ai_job_id} or re-fetch the entry
+    if EMERGENT_LLM_KEY and data.errors_today:
+        entry.ai_status = "pending"
+        entry.ai_job_id = str(uuid.uuid4())
     await db.journal_entries.insert_one(entry.model_dump())
+    await record_user_features(current_user["id"], entry.date, {"journal.n": 1})
+    if entry.ai_job_id:
+        await enqueue_job("journal_suggestions", current_user["id"], {
+            "entry_id": entry.id,
+            "errors_today": data.errors_today,
+            "lessons_learned": data.lessons_learned
+        }, job_id=entry.ai_job_id)
     await db.users.update_one({"id": current_user["id"]}, {"$inc": {"xp": 15}})
     return entry
 
 @api_router.get("/journal/entries", response_model=List[JournalEntry])
 async def get_journal_entries(current_user: dict = Depends(get_current_user)):
     entries = await db.journal_entries.find(
-        {"user_id": current_user["id"]}, {"_id": 0}
+        {"user_id": current_user["id"]}, model_projection(JournalEntry)
     ).sort("created_at", -1).to_list(100)
-    return entries
+    return trusted_response(JournalEntry, entries)
 
 @api_router.post("/journal/analyze")
 async def analyze_journal_entry(data: dict, current_user: dict = Depends(get_current_user)):
@@ -785,8 +2443,6 @@ async def analyze_journal_entry(data: dict, current_user: dict = Depends(get_cur
     # Generate AI response in coach-friend style
     if EMERGENT_LLM_KEY:
         try:
-            from emergentintegrations.llm.chat import LlmChat, UserMessage
-            
             system_message = """Sei Karion, il coach-amico del trader. Il tuo compito è aiutare, non interrogare.
             
 Rispondi in 4 blocchi brevi:
@@ -798,12 +2454,6 @@ Rispondi in 4 blocchi brevi:
 Stile: caldo, diretto, senza giudicare. Se c'è un errore, trattalo come informazione utile.
 Rispondi in JSON con chiavi: understood, keyPoint, wellDone, optimization"""
             
-            chat = LlmChat(
-                api_key=EMERGENT_LLM_KEY,
-                session_id=f"journal-analyze-{current_user['id']}-{datetime.now().timestamp()}",
-                system_message=system_message
-            ).with_model("openai", "gpt-5.2")
-            
             prompt = f"""Analizza questa entry del trader:
 - Traded: {entry.get('traded', 'N/A')}
 - Mood: {entry.get('mood', 5)}/10, Focus: {entry.get('focus', 5)}/10
@@ -813,12 +2463,13 @@ Rispondi in JSON con chiavi: understood, keyPoint, wellDone, optimization"""
 - Cosa cambierebbe: {entry.get('changeOne', '')}
 - PnL: {entry.get('pnl', 'N/A')}"""
 
-            msg = UserMessage(text=prompt)
-            response = await chat.send_message(msg)
+            response = await llm_complete(
+                system_message, prompt,
+                session_id=f"journal-analyze-{current_user['id']}-{datetime.now().timestamp()}"
+            )
             
             # Try to parse JSON response
             try:
-                import json
                 return json.loads(response)
             except:
                 # Fallback parsing
@@ -867,15 +2518,11 @@ async def optimize_strategy(strategy_id: str, current_user: dict = Depends(get_c
     optimizations = []
     if EMERGENT_LLM_KEY:
         try:
-            from emergentintegrations.llm.chat import LlmChat, UserMessage
-            chat = LlmChat(
-                api_key=EMERGENT_LLM_KEY,
-                session_id=f"strategy-{strategy_id}",
-                system_message="Sei un esperto di trading. Analizza questa strategia e suggerisci 3-5 ottimizzazioni concrete in italiano."
-            ).with_model("openai", "gpt-5.2")
-            
-            msg = UserMessage(text=f"Strategia: {strategy['content']}")
-            response = await chat.send_message(msg)
+            response = await llm_complete(
+                "Sei un esperto di trading. Analizza questa strategia e suggerisci 3-5 ottimizzazioni concrete in italiano.",
+                f"Strategia: {strategy['content']}",
+                session_id=f"strategy-{strategy_id}"
+            )
             optimizations = [s.strip() for s in response.split('\n') if s.strip()][:5]
         except Exception as e:
             logger.error(f"Strategy optimization error: {e}")
@@ -887,21 +2534,245 @@ async def optimize_strategy(strategy_id: str, current_user: dict = Depends(get_c
     )
     return {"optimizations": optimizations}
 
+# ==================== RESPONSE FORMATS ====================
+# JSON stays the default. Clients that send Accept: application/msgpack or
+# application/vnd.apache.arrow.stream get numeric columns as raw buffers:
+# msgpack encodes arrays as {"dtype", "shape", "data": <bin>} maps, Arrow IPC as
+# a stream with a single table (one row per record, or one row for a dict payload).
+
+BINARY_FORMATS = {
+    "msgpack": ("msgpack", ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")),
+    "arrow": ("pyarrow", ("application/vnd.apache.arrow.stream",)),
+}
+
+@lru_cache(maxsize=None)
+def optional_module(name: str):
+    """Import an optional dependency on first use; None when it is not installed"""
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
+
+def negotiate_format(request: Request) -> str:
+    """json, msgpack or arrow from the Accept header; 406 if only missing binary formats were acceptable"""
+    accept = request.headers.get("accept")
+    if not accept:
+        return "json"
+    ranges = []
+    for position, part in enumerate(accept.split(",")):
+        media, _, media_params = part.partition(";")
+        q = 1.0
+        for param in media_params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            ranges.append((-q, position, media.strip().lower()))
+    for _, _, media in sorted(ranges):
+        if media in ("application/json", "application/*", "*/*"):
+            return "json"
+        for fmt, (module, media_types) in BINARY_FORMATS.items():
+            if media in media_types and optional_module(module) is not None:
+                return fmt
+    raise HTTPException(status_code=406, detail="Formato richiesto non disponibile: usa application/json")
+
+@lru_cache(maxsize=None)
+def model_projection(model: type) -> Dict[str, int]:
+    """Mongo projection of a model's fields, so stored documents come back in its exact shape"""
+    return {"_id": 0, **{name: 1 for name in model.model_fields}}
+
+@lru_cache(maxsize=None)
+def _model_defaults(model: type) -> tuple:
+    return tuple((name, field) for name, field in model.model_fields.items() if not field.is_required())
+
+def trusted_documents(model: type, docs: List[dict]) -> List[dict]:
+    """Documents written by `model` and read with model_projection, without re-validating them.
+
+    Only documents stored before a field was added are touched: they get that field's default.
+    """
+    field_count = len(model.model_fields)
+    defaults = _model_defaults(model)
+    out = []
+    for doc in docs:
+        if len(doc) < field_count:
+            doc = {**{name: field.get_default(call_default_factory=True) for name, field in defaults if name not in doc}, **doc}
+        out.append(doc)
+    return out
+
+def trusted_response(model: type, docs: List[dict]) -> TimedORJSONResponse:
+    """Fast path for list endpoints: skips the response_model round trip through Pydantic"""
+    return TimedORJSONResponse(trusted_documents(model, docs))
+
+# Polled market endpoints serialize once per cache version; the body, its gzip/brotli
+# encodings and the validators are reused until the underlying cache refreshes.
+COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', 1024))
+
+class VersionedPayload:
+    """A payload serialized for one cache version, with weak ETag, Last-Modified and memoized encodings"""
+
+    def __init__(self, name: str, version, modified: datetime, payload: dict):
+        self.version = version
+        self.body = orjson.dumps(payload)
+        self.etag = f'W/"{hashlib.sha1(repr((name, version)).encode()).hexdigest()[:20]}"'
+        self.modified = modified.replace(microsecond=0)
+        self.last_modified = format_datetime(self.modified, usegmt=True)
+        self._encoded = {}
+
+    def encoded(self, coding: str) -> bytes:
+        if coding not in self._encoded:
+            if coding == "br":
+                self._encoded[coding] = optional_module("brotli").compress(self.body, quality=5)
+            else:
+                self._encoded[coding] = gzip.compress(self.body, compresslevel=6, mtime=0)
+        return self._encoded[coding]
+
+_versioned_payloads: Dict[str, VersionedPayload] = {}
+
+def versioned_payload(name: str, version, modified: datetime, build) -> VersionedPayload:
+    """Current payload for name, rebuilt with build() only when the version changes"""
+    entry = _versioned_payloads.get(name)
+    if entry is None or entry.version != version:
+        entry = VersionedPayload(name, version, modified, build())
+        _versioned_payloads[name] = entry
+    return entry
+
+def _accepted_codings(header: str) -> set:
+    codings = set()
+    for part in header.split(","):
+        coding, _, params = part.partition(";")
+        q = params.strip()
+        if not (q.startswith("q=") and q[2:].strip() in ("0", "0.0", "0.00", "0.000")):
+            codings.add(coding.strip().lower())
+    return codings
+
+def conditional_response(request: Request, entry: VersionedPayload) -> Response:
+    """304 when the client's validators match, otherwise the (pre-encoded) body"""
+    headers = {"ETag": entry.etag, "Last-Modified": entry.last_modified,
+               "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if "*" in tags or entry.etag.removeprefix("W/") in tags:
+            return Response(status_code=304, headers=headers)
+    elif request.headers.get("if-modified-since"):
+        try:
+            since = parsedate_to_datetime(request.headers["if-modified-since"])
+        except (TypeError, ValueError):
+            since = None
+        if since is not None:
+            if since.tzinfo is None:
+                since = since.replace(tzinfo=timezone.utc)
+            if entry.modified <= since:
+                return Response(status_code=304, headers=headers)
+
+    body = entry.body
+    if len(body) >= COMPRESSION_MIN_BYTES:
+        accepted = _accepted_codings(request.headers.get("accept-encoding", ""))
+        for coding in ("br", "gzip"):
+            if coding in accepted and (coding != "br" or optional_module("brotli") is not None):
+                body = entry.encoded(coding)
+                headers["Content-Encoding"] = coding
+                break
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def market_data_version(now: datetime) -> tuple:
+    """(version, modified) for payloads derived from the VIX/price caches and the current hour"""
+    hour = now.replace(minute=0, second=0, microsecond=0)
+    stamps = (_vix_cache["timestamp"], _market_cache["timestamp"])
+    return (*stamps, hour), max([s for s in stamps if s] + [hour])
+
+def to_builtin(value):
+    """numpy arrays and scalars to plain lists/numbers for the JSON path"""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, dict):
+        return {k: to_builtin(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_builtin(v) for v in value]
+    return value
+
+def records_to_columns(records: List[dict]) -> Dict[str, Any]:
+    """Column-major view of DB documents; numeric fields become float64 arrays"""
+    keys = list(dict.fromkeys(k for record in records for k in record))
+    columns = {}
+    for key in keys:
+        values = [record.get(key) for record in records]
+        if values and all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values):
+            columns[key] = np.asarray(values, dtype=np.float64)
+        else:
+            columns[key] = values
+    return columns
+
+def _msgpack_default(value):
+    if isinstance(value, np.ndarray):
+        value = np.ascontiguousarray(value)
+        return {"dtype": value.dtype.str, "shape": list(value.shape), "data": value.data.cast("B")}
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+def _arrow_cell(pa, value):
+    """One-row Arrow column for a payload value; numeric arrays are wrapped without copying"""
+    if isinstance(value, np.ndarray):
+        return pa.ListArray.from_arrays(pa.array([0, len(value)], pa.int32()), pa.array(value))
+    if isinstance(value, list) and value and all(isinstance(v, np.ndarray) for v in value):
+        offsets = np.concatenate([[0], np.cumsum([len(v) for v in value])]).astype(np.int32)
+        inner = pa.ListArray.from_arrays(pa.array(offsets), pa.array(np.concatenate(value)))
+        return pa.ListArray.from_arrays(pa.array([0, len(value)], pa.int32()), inner)
+    return pa.array([to_builtin(value)])
+
+def _flatten_payload(payload: dict, prefix: str = "") -> Dict[str, Any]:
+    flat = {}
+    for key, value in payload.items():
+        if isinstance(value, dict) and value:
+            flat.update(_flatten_payload(value, f"{prefix}{key}."))
+        else:
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+def encode_response(payload, fmt: str) -> Response:
+    """Binary response for a negotiated format; list payloads are sent column-major"""
+    module, media_types = BINARY_FORMATS[fmt]
+    lib = optional_module(module)
+    if isinstance(payload, list):
+        payload = {"count": len(payload), "columns": records_to_columns(payload)}
+    if fmt == "msgpack":
+        body = lib.packb(payload, default=_msgpack_default)
+    else:
+        if "columns" in payload and "count" in payload:
+            table = lib.table({k: lib.array(v) for k, v in payload["columns"].items()})
+        else:
+            table = lib.table({k: _arrow_cell(lib, v) for k, v in _flatten_payload(payload).items()})
+        sink = lib.BufferOutputStream()
+        with lib.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        body = sink.getvalue().to_pybytes()
+    return Response(content=body, media_type=media_types[0], headers={"Vary": "Accept"})
+
 # ==================== TRADES ROUTES ====================
 
 @api_router.post("/trades", response_model=TradeRecord)
 async def create_trade(data: TradeRecordCreate, current_user: dict = Depends(get_current_user)):
     trade = TradeRecord(user_id=current_user["id"], **data.model_dump())
     await db.trades.insert_one(trade.model_dump())
+    await record_user_features(current_user["id"], feature_day(trade.date), trade_feature_increments([trade.model_dump()])[feature_day(trade.date)])
     await db.users.update_one({"id": current_user["id"]}, {"$inc": {"xp": 5}})
     return trade
 
 @api_router.get("/trades", response_model=List[TradeRecord])
-async def get_trades(current_user: dict = Depends(get_current_user)):
+async def get_trades(request: Request, current_user: dict = Depends(get_current_user)):
+    fmt = negotiate_format(request)
     trades = await db.trades.find(
-        {"user_id": current_user["id"]}, {"_id": 0}
+        {"user_id": current_user["id"]}, model_projection(TradeRecord)
     ).sort("created_at", -1).to_list(500)
-    return trades
+    if fmt != "json":
+        return encode_response(trades, fmt)
+    return trusted_response(TradeRecord, trades)
 
 @api_router.get("/trades/stats")
 async def get_trade_stats(current_user: dict = Depends(get_current_user)):
@@ -924,6 +2795,311 @@ async def get_trade_stats(current_user: dict = Depends(get_current_user)):
         "losses": total - wins
     }
 
+# ==================== TRADE IMPORT (CSV / MT5) ====================
+
+TRADE_IMPORT_CHUNK_SIZE = 64 * 1024
+TRADE_IMPORT_BATCH_SIZE = 500
+TRADE_IMPORT_MAX_ERRORS = 200
+
+# Progress of recent imports, keyed by (user id, import id) (bounded)
+_trade_import_progress = {}
+_TRADE_IMPORT_PROGRESS_MAX = 100
+
+# Header aliases (lowercase) for generic CSV exports and MT5 "Positions" tables
+TRADE_IMPORT_ALIASES = {
+    "symbol": ["symbol", "simbolo", "instrument", "asset"],
+    "date": ["date", "data", "open time", "open_time"],
+    "entry_price": ["entry_price", "entry", "open price", "open_price"],
+    "exit_price": ["exit_price", "exit", "close price", "close_price"],
+    "profit_loss": ["profit_loss", "profit", "pnl", "p/l", "net profit"],
+    "profit_loss_r": ["profit_loss_r", "r", "r_multiple", "r multiple"],
+    "notes": ["notes", "note", "comment", "commento"],
+}
+# MT5 reports repeat "Time" and "Price": the first is the open, the second the close
+TRADE_IMPORT_REPEATED = {"price": ["entry_price", "exit_price"], "time": ["date", None]}
+TRADE_IMPORT_REQUIRED = ["symbol", "date", "entry_price", "exit_price", "profit_loss"]
+
+class _HTMLTableRowParser(HTMLParser):
+    """Incremental <table> row extractor: feed() chunks, then drain `rows`"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.rows = []
+        self._row = None
+        self._cell = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "tr":
+            self._row = []
+        elif tag in ("td", "th") and self._row is not None:
+            self._cell = []
+
+    def handle_endtag(self, tag):
+        if tag in ("td", "th") and self._row is not None and self._cell is not None:
+            self._row.append("".join(self._cell).strip())
+            self._cell = None
+        elif tag == "tr" and self._row is not None:
+            self.rows.append(self._row)
+            self._row = None
+
+    def handle_data(self, data):
+        if self._cell is not None:
+            self._cell.append(data)
+
+def _parse_import_number(value: str) -> float:
+    """Parse numbers as written by MT5/Excel ('1 234.50', '1234,5', '-12.3')"""
+    value = value.replace("\xa0", "").replace(" ", "").strip()
+    if "," in value and "." not in value:
+        value = value.replace(",", ".")
+    else:
+        value = value.replace(",", "")
+    return float(value)
+
+def _normalize_import_date(value: str) -> str:
+    """MT5 writes dates as 2024.01.15 10:23:45 - normalize to 2024-01-15 10:23:45"""
+    value = value.strip()
+    return value[:10].replace(".", "-").replace("/", "-") + value[10:]
+
+def _map_import_header(row: List[str]) -> Optional[Dict[str, int]]:
+    """Map a header row to {field: column index}, or None if it is not a usable trades header"""
+    mapping = {}
+    seen = {}
+    for idx, cell in enumerate(row):
+        name = cell.strip().lower()
+        if not name:
+            continue
+        if name in TRADE_IMPORT_REPEATED:
+            occurrence = seen.get(name, 0)
+            seen[name] = occurrence + 1
+            targets = TRADE_IMPORT_REPEATED[name]
+            field = targets[occurrence] if occurrence < len(targets) else None
+            if field and field not in mapping:
+                mapping[field] = idx
+            continue
+        for field, aliases in TRADE_IMPORT_ALIASES.items():
+            if name in aliases and field not in mapping:
+                mapping[field] = idx
+                break
+    if all(f in mapping for f in TRADE_IMPORT_REQUIRED):
+        return mapping
+    return None
+
+def _is_import_header_candidate(row: List[str]) -> bool:
+    return any(cell.strip().lower() in TRADE_IMPORT_ALIASES["symbol"] for cell in row)
+
+def _row_to_trade_fields(row: List[str], mapping: Dict[str, int]) -> Dict[str, Any]:
+    """Convert a data row into TradeRecordCreate kwargs (raises ValueError on bad cells)"""
+    def cell(field):
+        idx = mapping.get(field)
+        return row[idx].strip() if idx is not None and idx < len(row) else ""
+
+    fields = {
+        "symbol": cell("symbol").upper(),
+        "date": _normalize_import_date(cell("date")),
+        "entry_price": _parse_import_number(cell("entry_price")),
+        "exit_price": _parse_import_number(cell("exit_price")),
+        "profit_loss": _parse_import_number(cell("profit_loss")),
+        "profit_loss_r": _parse_import_number(cell("profit_loss_r")) if cell("profit_loss_r") else 0.0,
+        "notes": cell("notes"),
+    }
+    if not fields["symbol"]:
+        raise ValueError("missing symbol")
+    return fields
+
+def _trade_natural_key(trade: dict) -> tuple:
+    return (trade["symbol"], trade["date"], float(trade["entry_price"]), float(trade["exit_price"]))
+
+async def _iter_upload_rows(file: UploadFile):
+    """Stream an uploaded CSV or MT5 HTML statement chunk by chunk, yielding table rows"""
+    first = await file.read(TRADE_IMPORT_CHUNK_SIZE)
+    if not first:
+        return
+
+    # MT5 HTML reports are UTF-16 with BOM; CSV exports are usually UTF-8
+    if first.startswith(codecs.BOM_UTF16_LE) or first.startswith(codecs.BOM_UTF16_BE):
+        encoding = "utf-16"
+    else:
+        encoding = "utf-8-sig"
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    text = decoder.decode(first)
+
+    name = (file.filename or "").lower()
+    is_html = name.endswith((".htm", ".html")) or text.lstrip()[:1] == "<"
+
+    if is_html:
+        parser = _HTMLTableRowParser()
+        chunk = first
+        while True:
+            parser.feed(text)
+            rows, parser.rows = parser.rows, []
+            for row in rows:
+                yield row
+            if not chunk:
+                break
+            chunk = await file.read(TRADE_IMPORT_CHUNK_SIZE)
+            text = decoder.decode(chunk, final=not chunk)
+        parser.close()
+        for row in parser.rows:
+            yield row
+        return
+
+    # CSV: pick the delimiter from the first line, then parse complete records as they arrive.
+    # A record is complete once its quotes balance, so quoted fields may span lines.
+    first_line = text.split("\n", 1)[0]
+    delimiter = max([",", ";", "\t"], key=first_line.count)
+    pending = ""
+    record = []
+    quotes = 0
+    chunk = first
+    while True:
+        pending += text
+        *lines, pending = pending.split("\n")
+        records = []
+        for line in lines:
+            record.append(line)
+            quotes += line.count('"')
+            if quotes % 2 == 0:
+                records.append("\n".join(record))
+                record, quotes = [], 0
+        for row in csv.reader(records, delimiter=delimiter):
+            yield row
+        if not chunk:
+            break
+        chunk = await file.read(TRADE_IMPORT_CHUNK_SIZE)
+        text = decoder.decode(chunk, final=not chunk)
+    tail = "\n".join(record + [pending])
+    if tail.strip():
+        for row in csv.reader([tail], delimiter=delimiter):
+            yield row
+
+async def _flush_trade_import_batch(batch: List[tuple], user_id: str, seen_keys: set, progress: dict):
+    """Validate a batch of (row_number, fields), drop duplicates and write it with insert_many"""
+    candidates = []
+    for row_number, fields in batch:
+        try:
+            data = TradeRecordCreate(**fields)
+        except ValidationError as e:
+            _record_import_error(progress, row_number, e.errors()[0].get("msg", "invalid row"))
+            continue
+        key = _trade_natural_key(data.model_dump())
+        if key in seen_keys:
+            progress["duplicates"] += 1
+            continue
+        seen_keys.add(key)
+        candidates.append((key, data))
+
+    if not candidates:
+        return
+
+    # Dedupe against trades already stored for this user
+    existing = await db.trades.find(
+        {"user_id": user_id, "$or": [
+            {"symbol": k[0], "date": k[1], "entry_price": k[2], "exit_price": k[3]} for k, _ in candidates
+        ]},
+        {"_id": 0, "symbol": 1, "date": 1, "entry_price": 1, "exit_price": 1}
+    ).to_list(len(candidates))
+    existing_keys = {_trade_natural_key(t) for t in existing}
+
+    docs = []
+    for key, data in candidates:
+        if key in existing_keys:
+            progress["duplicates"] += 1
+            continue
+        docs.append(TradeRecord(user_id=user_id, **data.model_dump()).model_dump())
+
+    if docs:
+        await db.trades.insert_many(docs, ordered=False)
+        progress["imported"] += len(docs)
+        for day, increments in trade_feature_increments(docs).items():
+            await record_user_features(user_id, day, increments)
+
+def _record_import_error(progress: dict, row_number: int, message: str):
+    progress["error_count"] += 1
+    if len(progress["errors"]) < TRADE_IMPORT_MAX_ERRORS:
+        progress["errors"].append({"row": row_number, "error": message})
+
+@api_router.post("/trades/import")
+async def import_trades(file: UploadFile = File(...), import_id: Optional[str] = None,
+                        current_user: dict = Depends(get_current_user)):
+    """Bulk import trades from a CSV export or an MT5 HTML/CSV statement.
+
+    Pass an `import_id` to poll GET /trades/import/{import_id} while the upload is processed.
+    """
+    name = (file.filename or "").lower()
+    if not name.endswith((".csv", ".txt", ".htm", ".html")):
+        raise HTTPException(status_code=400, detail="Only CSV or MT5 HTML statements are supported")
+
+    import_id = import_id or str(uuid.uuid4())
+    key = (current_user["id"], import_id)
+    running = _trade_import_progress.get(key)
+    if running and running["status"] == "running":
+        raise HTTPException(status_code=409, detail="An import with this import_id is already running")
+    progress = {
+        "import_id": import_id,
+        "filename": file.filename,
+        "status": "running",
+        "rows_processed": 0,
+        "imported": 0,
+        "duplicates": 0,
+        "error_count": 0,
+        "errors": [],
+        "started_at": datetime.now(timezone.utc).isoformat(),
+    }
+    _trade_import_progress.pop(key, None)
+    _trade_import_progress[key] = progress
+    while len(_trade_import_progress) > _TRADE_IMPORT_PROGRESS_MAX:
+        _trade_import_progress.pop(next(iter(_trade_import_progress)))
+
+    mapping = None
+    batch = []
+    seen_keys = set()
+    row_number = 0
+    try:
+        async for row in _iter_upload_rows(file):
+            row_number += 1
+            filled = sum(1 for cell in row if cell.strip())
+            if filled == 0:
+                continue
+            if filled == 1:
+                # Section title such as MT5 "Orders"/"Deals": the previous table has ended
+                mapping = None
+                continue
+            if _is_import_header_candidate(row):
+                # A new table starts: only trade tables (e.g. MT5 "Positions") are mapped
+                mapping = _map_import_header(row)
+                continue
+            if mapping is None:
+                continue
+
+            progress["rows_processed"] += 1
+            try:
+                batch.append((row_number, _row_to_trade_fields(row, mapping)))
+            except (ValueError, IndexError) as e:
+                _record_import_error(progress, row_number, str(e) or "invalid row")
+
+            if len(batch) >= TRADE_IMPORT_BATCH_SIZE:
+                await _flush_trade_import_batch(batch, current_user["id"], seen_keys, progress)
+                batch = []
+
+        if batch:
+            await _flush_trade_import_batch(batch, current_user["id"], seen_keys, progress)
+    except Exception as e:
+        logger.error(f"Trade import error: {e}")
+        progress["status"] = "failed"
+        progress["finished_at"] = datetime.now(timezone.utc).isoformat()
+        raise HTTPException(status_code=500, detail=f"Error importing trades: {str(e)}")
+
+    progress["status"] = "completed"
+    progress["finished_at"] = datetime.now(timezone.utc).isoformat()
+    return progress
+
+@api_router.get("/trades/import/{import_id}")
+async def get_trade_import_progress(import_id: str, current_user: dict = Depends(get_current_user)):
+    progress = _trade_import_progress.get((current_user["id"], import_id))
+    if not progress:
+        raise HTTPException(status_code=404, detail="Import not found")
+    return progress
+
 # ==================== DISCIPLINE RULES ====================
 
 @api_router.post("/rules", response_model=DisciplineRule)
@@ -948,6 +3124,143 @@ async def delete_rule(rule_id: str, current_user: dict = Depends(get_current_use
 
 # ==================== COMMUNITY ====================
 
+# The newest FEED_CACHE_SIZE posts are cached in memory and reloaded after a new
+# post; older pages go to MongoDB with a (created_at, id) cursor. Likes live in
+# post_likes (unique per user and post) and the post counters are $inc'd in
+# batches by a background flusher; reads overlay the pending deltas, so the feed
+# never touches post_likes.
+#
+# Both are per process. Pending like deltas are safe with several workers ($inc
+# commutes, and stop_like_flusher flushes them on shutdown), but a worker cannot
+# see another worker's new post, so the feed cache is only used by a single
+# worker: it is off when WEB_CONCURRENCY > 1 (set it when running uvicorn --workers).
+FEED_CACHE_SIZE = int(os.environ.get('FEED_CACHE_SIZE', 200))
+FEED_CACHE_ENABLED = int(os.environ.get('WEB_CONCURRENCY', 1)) <= 1
+FEED_PAGE_SIZE = 20
+FEED_MAX_PAGE_SIZE = 50
+LIKE_FLUSH_SECONDS = float(os.environ.get('LIKE_FLUSH_SECONDS', 1.0))
+COMMENT_PREVIEW_SIZE = 3
+
+_feed_cache: Optional[List[dict]] = None
+_feed_generation = 0
+_feed_lock = asyncio.Lock()
+_pending_like_deltas: Dict[str, int] = {}
+_like_flusher: Optional[asyncio.Task] = None
+
+def encode_feed_cursor(post: dict) -> str:
+    return base64.urlsafe_b64encode(f"{post['created_at']}|{post['id']}".encode()).decode()
+
+def decode_feed_cursor(cursor: str) -> tuple:
+    try:
+        created_at, post_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Cursor non valido")
+    return created_at, post_id
+
+async def load_feed_head() -> List[dict]:
+    """Newest posts, newest first; reloaded from MongoDB only after invalidation"""
+    global _feed_cache
+    if not FEED_CACHE_ENABLED:
+        return await db.community_posts.find({}, model_projection(CommunityPost)).sort(
+            [("created_at", -1), ("id", -1)]).to_list(FEED_CACHE_SIZE)
+    head = _feed_cache
+    if head is None:
+        async with _feed_lock:
+            head = _feed_cache
+            if head is None:
+                generation = _feed_generation
+                head = await db.community_posts.find({}, model_projection(CommunityPost)).sort(
+                    [("created_at", -1), ("id", -1)]).to_list(FEED_CACHE_SIZE)
+                # A post created while the query ran may be missing from it: serve
+                # this result once but leave the cache empty for the next reader
+                if generation == _feed_generation:
+                    _feed_cache = head
+    return head
+
+def invalidate_feed():
+    global _feed_cache, _feed_generation
+    _feed_generation += 1
+    _feed_cache = None
+
+def _with_pending_likes(post: dict) -> dict:
+    delta = _pending_like_deltas.get(post["id"])
+    return {**post, "likes": post.get("likes", 0) + delta} if delta else post
+
+async def get_feed_page(cursor: Optional[str], limit: int) -> tuple:
+    """One page of the global timeline and the cursor for the next one"""
+    head = await load_feed_head()
+    if cursor:
+        created_at, post_id = decode_feed_cursor(cursor)
+        older = [p for p in head if (p["created_at"], p["id"]) < (created_at, post_id)]
+    else:
+        created_at = post_id = None
+        older = head
+
+    # The cache covers the page if it holds enough posts or the whole collection
+    if len(older) >= limit or len(head) < FEED_CACHE_SIZE:
+        page = older[:limit]
+        has_more = len(older) > limit or len(head) >= FEED_CACHE_SIZE
+    else:
+        query = {}
+        if cursor:
+            query = {"$or": [{"created_at": {"$lt": created_at}}, {"created_at": created_at, "id": {"$lt": post_id}}]}
+        page = await db.community_posts.find(query, model_projection(CommunityPost)).sort(
+            [("created_at", -1), ("id", -1)]).limit(limit + 1).to_list(limit + 1)
+        has_more = len(page) > limit
+        page = page[:limit]
+
+    next_cursor = encode_feed_cursor(page[-1]) if page and has_more else None
+    return [_with_pending_likes(p) for p in page], next_cursor
+
+async def flush_like_deltas():
+    """Write pending like deltas as one bulk $inc and fold them into the cached feed"""
+    global _pending_like_deltas
+    if not _pending_like_deltas:
+        return
+    async with _feed_lock:
+        deltas, _pending_like_deltas = _pending_like_deltas, {}
+        deltas = {post_id: d for post_id, d in deltas.items() if d}
+        cached = {p["id"]: p for p in _feed_cache or []}
+        for post_id, delta in deltas.items():
+            if post_id in cached:
+                cached[post_id]["likes"] = cached[post_id].get("likes", 0) + delta
+        if not deltas:
+            return
+        try:
+            await db.community_posts.bulk_write(
+                [UpdateOne({"id": post_id}, {"$inc": {"likes": delta}}) for post_id, delta in deltas.items()],
+                ordered=False
+            )
+        except Exception as e:
+            logger.error(f"Like counter flush error: {e}")
+            for post_id, delta in deltas.items():
+                _pending_like_deltas[post_id] = _pending_like_deltas.get(post_id, 0) + delta
+                if post_id in cached:
+                    cached[post_id]["likes"] -= delta
+
+async def _like_flush_loop():
+    while True:
+        await asyncio.sleep(LIKE_FLUSH_SECONDS)
+        await flush_like_deltas()
+
+def start_like_flusher():
+    global _like_flusher
+    _like_flusher = asyncio.create_task(_like_flush_loop())
+
+async def stop_like_flusher():
+    if _like_flusher:
+        _like_flusher.cancel()
+        await asyncio.gather(_like_flusher, return_exceptions=True)
+        await flush_like_deltas()
+
+async def _find_post(post_id: str) -> dict:
+    post = next((p for p in await load_feed_head() if p["id"] == post_id), None)
+    if post is None:
+        post = await db.community_posts.find_one({"id": post_id}, {"_id": 0, "id": 1, "likes": 1})
+    if post is None:
+        raise HTTPException(status_code=404, detail="Post not found")
+    return post
+
 @api_router.post("/community/posts", response_model=CommunityPost)
 async def create_post(data: CommunityPostCreate, current_user: dict = Depends(get_current_user)):
     post = CommunityPost(
@@ -955,54 +3268,446 @@ async def create_post(data: CommunityPostCreate, current_user: dict = Depends(ge
         user_name=current_user["name"],
         **data.model_dump()
     )
+    if MEDIA_URL_RE.match(post.image_url):
+        post.image_thumb_url = post.image_url.rsplit("/", 1)[0] + "/thumb"
     await db.community_posts.insert_one(post.model_dump())
+    invalidate_feed()
     return post
 
 @api_router.get("/community/posts", response_model=List[CommunityPost])
 async def get_posts():
-    posts = await db.community_posts.find({}, {"_id": 0}).sort("created_at", -1).to_list(50)
-    return posts
+    posts, _ = await get_feed_page(None, FEED_MAX_PAGE_SIZE)
+    return trusted_response(CommunityPost, posts)
+
+@api_router.get("/community/feed")
+async def get_feed(cursor: Optional[str] = None, limit: int = FEED_PAGE_SIZE):
+    """Cursor-paginated global timeline, newest first"""
+    posts, next_cursor = await get_feed_page(cursor, max(1, min(limit, FEED_MAX_PAGE_SIZE)))
+    return TimedORJSONResponse({"posts": trusted_documents(CommunityPost, posts), "next_cursor": next_cursor})
 
 @api_router.post("/community/posts/{post_id}/like")
 async def like_post(post_id: str, current_user: dict = Depends(get_current_user)):
-    await db.community_posts.update_one({"id": post_id}, {"$inc": {"likes": 1}})
-    return {"status": "liked"}
+    post = await _find_post(post_id)
+    # Upsert on the unique (post_id, user_id) pair: only the first like inserts
+    result = await db.post_likes.update_one(
+        {"post_id": post_id, "user_id": current_user["id"]},
+        {"$setOnInsert": {"created_at": datetime.now(timezone.utc).isoformat()}},
+        upsert=True
+    )
+    if result.upserted_id is None:
+        return {"status": "already_liked", "likes": _with_pending_likes(post).get("likes", 0)}
+    _pending_like_deltas[post_id] = _pending_like_deltas.get(post_id, 0) + 1
+    return {"status": "liked", "likes": _with_pending_likes(post).get("likes", 0)}
+
+@api_router.delete("/community/posts/{post_id}/like")
+async def unlike_post(post_id: str, current_user: dict = Depends(get_current_user)):
+    post = await _find_post(post_id)
+    result = await db.post_likes.delete_one({"post_id": post_id, "user_id": current_user["id"]})
+    if result.deleted_count == 0:
+        return {"status": "not_liked", "likes": _with_pending_likes(post).get("likes", 0)}
+    _pending_like_deltas[post_id] = _pending_like_deltas.get(post_id, 0) - 1
+    return {"status": "unliked", "likes": _with_pending_likes(post).get("likes", 0)}
+
+async def _append_comment_to_post(post_id: str, comment: dict):
+    """Bump the denormalized count and keep only the newest COMMENT_PREVIEW_SIZE comments"""
+    preview = {k: comment[k] for k in ("id", "user_id", "user_name", "text", "created_at")}
+    await db.community_posts.update_one(
+        {"id": post_id},
+        {"$inc": {"comment_count": 1}, "$push": {"latest_comments": {"$each": [preview], "$slice": -COMMENT_PREVIEW_SIZE}}}
+    )
+    for post in _feed_cache or []:
+        if post["id"] == post_id:
+            post["comment_count"] = post.get("comment_count", 0) + 1
+            post["latest_comments"] = (post.get("latest_comments", []) + [preview])[-COMMENT_PREVIEW_SIZE:]
+            break
+
+async def migrate_embedded_comments():
+    """Move legacy CommunityPost.comments arrays into community_comments (runs at startup)
+
+    Safe to re-run after a crash: comment ids are derived from the post id and the
+    array index and upserted, and the post keeps its comments array until the
+    final update moves the counters and unsets it in one write.
+    """
+    async for post in db.community_posts.find({"comments": {"$exists": True}}, {"_id": 0}):
+        comments = []
+        for i, c in enumerate(post.get("comments") or []):
+            comments.append(CommunityComment(
+                id=f"{post['id']}:{i}",
+                post_id=post["id"],
+                user_id=c.get("user_id", ""),
+                user_name=c.get("user_name", ""),
+                text=str(c.get("text", "")),
+                created_at=c.get("created_at") or post["created_at"]
+            ).model_dump())
+        if comments:
+            await db.community_comments.bulk_write(
+                [UpdateOne({"id": c["id"]}, {"$setOnInsert": c}, upsert=True) for c in comments], ordered=False)
+        await db.community_posts.update_one({"id": post["id"], "comments": {"$exists": True}}, {
+            "$set": {
+                "comment_count": post.get("comment_count", 0) + len(comments),
+                "latest_comments": [{k: c[k] for k in ("id", "user_id", "user_name", "text", "created_at")}
+                                    for c in comments[-COMMENT_PREVIEW_SIZE:]]
+            },
+            "$unset": {"comments": ""}
+        })
+
+@api_router.post("/community/posts/{post_id}/comments", response_model=CommunityComment)
+async def create_comment(post_id: str, data: CommunityCommentCreate, current_user: dict = Depends(get_current_user)):
+    await _find_post(post_id)
+    comment = CommunityComment(
+        post_id=post_id,
+        user_id=current_user["id"],
+        user_name=current_user["name"],
+        text=data.text
+    )
+    await db.community_comments.insert_one(comment.model_dump())
+    await _append_comment_to_post(post_id, comment.model_dump())
+    return comment
+
+@api_router.get("/community/posts/{post_id}/comments")
+async def get_comments(post_id: str, cursor: Optional[str] = None, limit: int = FEED_PAGE_SIZE):
+    """Cursor-paginated comments of a post, newest first"""
+    limit = max(1, min(limit, FEED_MAX_PAGE_SIZE))
+    query = {"post_id": post_id}
+    if cursor:
+        created_at, comment_id = decode_feed_cursor(cursor)
+        query["$or"] = [{"created_at": {"$lt": created_at}}, {"created_at": created_at, "id": {"$lt": comment_id}}]
+    comments = await db.community_comments.find(query, {"_id": 0}).sort(
+        [("created_at", -1), ("id", -1)]).limit(limit + 1).to_list(limit + 1)
+    next_cursor = encode_feed_cursor(comments[limit - 1]) if len(comments) > limit else None
+    return {"comments": comments[:limit], "next_cursor": next_cursor}
+
+# ==================== MEDIA ====================
+
+# Content-addressed image store: MEDIA_DIR/<sha[:2]>/<sha>/{original.<ext>, thumb.webp,
+# medium.webp, meta.json}. The same bytes always map to the same URLs, so responses
+# are immutable and the strong ETag is just hash + variant.
+MEDIA_DIR = Path(os.environ.get('MEDIA_DIR', ROOT_DIR / 'media'))
+IMAGE_MAX_BYTES = int(os.environ.get('IMAGE_MAX_BYTES', 10 * 1024 * 1024))
+IMAGE_MAX_PIXELS = 40_000_000
+Image.MAX_IMAGE_PIXELS = IMAGE_MAX_PIXELS
+IMAGE_FORMATS = {"JPEG": ("jpg", "image/jpeg"), "PNG": ("png", "image/png"), "WEBP": ("webp", "image/webp"), "GIF": ("gif", "image/gif")}
+IMAGE_VARIANTS = {"thumb": 320, "medium": 1080}
+MEDIA_URL_RE = re.compile(r"^/api/media/[0-9a-f]{64}/(original|thumb|medium)$")
+MEDIA_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+def media_dir(digest: str) -> Path:
+    return MEDIA_DIR / digest[:2] / digest
+
+def media_urls(digest: str) -> Dict[str, str]:
+    return {variant: f"/api/media/{digest}/{variant}" for variant in ("original", *IMAGE_VARIANTS)}
+
+def _process_image(src_path: str, digest: str) -> dict:
+    """Validate, store the original and write WebP variants (runs in a worker thread)"""
+    try:
+        with Image.open(src_path) as img:
+            fmt = img.format
+            if fmt not in IMAGE_FORMATS:
+                raise ValueError(f"Unsupported image format {fmt}")
+            img.load()
+            image = ImageOps.exif_transpose(img)
+    except (OSError, Image.DecompressionBombError) as e:
+        raise ValueError(f"Invalid image: {e}")
+
+    target = media_dir(digest)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp_dir = Path(tempfile.mkdtemp(dir=target.parent))
+    try:
+        ext, mime = IMAGE_FORMATS[fmt]
+        original = tmp_dir / f"original.{ext}"
+        if fmt == "GIF":
+            # GIF has no EXIF block; copying keeps animations intact
+            shutil.copyfile(src_path, original)
+        else:
+            # Re-encode from the upright pixels so EXIF (GPS, camera, orientation) is not published
+            image.save(original, fmt, quality=95, icc_profile=image.info.get("icc_profile"))
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info or image.mode in ("LA", "PA") else "RGB")
+        meta = {
+            "hash": digest, "format": fmt, "mime": mime, "ext": ext,
+            "width": image.width, "height": image.height,
+            "bytes": original.stat().st_size, "variants": {}
+        }
+        for variant, max_side in IMAGE_VARIANTS.items():
+            resized = image.copy()
+            resized.thumbnail((max_side, max_side), Image.LANCZOS)
+            out = tmp_dir / f"{variant}.webp"
+            resized.save(out, "WEBP", quality=80, method=4)
+            meta["variants"][variant] = {"width": resized.width, "height": resized.height, "bytes": out.stat().st_size}
+        (tmp_dir / "meta.json").write_text(json.dumps(meta))
+
+        # Publish atomically; a concurrent upload of the same bytes may win the rename
+        try:
+            os.rename(tmp_dir, target)
+        except OSError:
+            if not (target / "meta.json").exists():
+                raise
+        return meta
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def load_media_meta(digest: str) -> Optional[dict]:
+    try:
+        return json.loads((media_dir(digest) / "meta.json").read_text())
+    except (OSError, ValueError):
+        return None
+
+@api_router.post("/media/images")
+async def upload_image(file: UploadFile = File(...), current_user: dict = Depends(get_current_user)):
+    """Store an image once per content hash and return its variant URLs"""
+    path, size, digest = await spool_upload(file, IMAGE_MAX_BYTES)
+    try:
+        if size == 0:
+            raise HTTPException(status_code=400, detail="File vuoto")
+        meta = load_media_meta(digest)
+        if meta is None:
+            try:
+                meta = await asyncio.to_thread(_process_image, path, digest)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        os.unlink(path)
+    return {
+        "hash": digest,
+        "width": meta["width"],
+        "height": meta["height"],
+        "urls": media_urls(digest),
+        "variants": meta["variants"]
+    }
+
+@api_router.get("/media/{digest}/{variant}")
+async def get_media(digest: str, variant: str, request: Request):
+    if not re.fullmatch(r"[0-9a-f]{64}", digest) or variant not in ("original", *IMAGE_VARIANTS):
+        raise HTTPException(status_code=404, detail="Media not found")
+    etag = f'"{digest}-{variant}"'
+    headers = {"ETag": etag, "Cache-Control": MEDIA_CACHE_CONTROL}
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in if_none_match or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+
+    meta = load_media_meta(digest)
+    if meta is None:
+        raise HTTPException(status_code=404, detail="Media not found")
+    if variant == "original":
+        path, media_type = media_dir(digest) / f"original.{meta['ext']}", meta["mime"]
+    else:
+        path, media_type = media_dir(digest) / f"{variant}.webp", "image/webp"
+    return FileResponse(path, media_type=media_type, headers=headers)
 
 # ==================== AI CHAT ====================
 
+AI_CHAT_SYSTEM_PROMPTS = {
+    "general": "Sei Karion, un AI coach di trading personale. Parla in modo amichevole, professionale e intimo. Rispondi sempre in italiano senza link o formattazione markdown complessa. Sii conciso ma empatico.",
+    "coach": "Sei Karion, coach di trading personale. Dai consigli pratici e motivazionali. Sii empatico e professionale.",
+    "risk": "Sei Karion esperto di risk management. Calcola position size e rischi. Sii preciso e chiaro.",
+    "psych": "Sei Karion psicologo del trading. Aiuta il trader a gestire stress ed emozioni. Sii comprensivo e supportivo.",
+    "strategy": "Sei Karion analista di strategie. Valuta setup e pattern con occhio critico ma costruttivo.",
+    "journal": "Sei Karion che rivede il journal del trader. Trova pattern comportamentali e suggerisci miglioramenti.",
+    "performance": "Sei Karion coach di performance. Analizza statistiche e indica aree di miglioramento."
+}
+
+# Conversation memory: recent turns verbatim plus a rolling extractive summary,
+# both bounded so the prompt stays flat however long the conversation gets.
+CHAT_CONTEXT_TOKEN_BUDGET = int(os.environ.get('CHAT_CONTEXT_TOKEN_BUDGET', 1500))
+CHAT_SUMMARY_TOKEN_BUDGET = 300
+CHAT_MAX_STORED_TURNS = 40
+CHAT_SUMMARY_SNIPPET_CHARS = 160
+CHAT_ROLE_LABELS = {"user": "Utente", "assistant": "Karion"}
+CHAT_APPEND_MAX_RETRIES = 5
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 chars per token) used for context budgeting"""
+    return len(text) // 4 + 1
+
+def fold_into_summary(summary: str, turns: List[dict]) -> str:
+    """Append one short line per evicted turn, then drop the oldest lines to fit the summary budget"""
+    lines = [line for line in summary.split("\n") if line]
+    for turn in turns:
+        snippet = " ".join(turn["content"].split())[:CHAT_SUMMARY_SNIPPET_CHARS]
+        lines.append(f"- {CHAT_ROLE_LABELS.get(turn['role'], turn['role'])}: {snippet}")
+    while lines and estimate_tokens("\n".join(lines)) > CHAT_SUMMARY_TOKEN_BUDGET:
+        lines.pop(0)
+    return "\n".join(lines)
+
+def build_chat_prompt(summary: str, turns: List[dict], message: str,
+                      budget: int = CHAT_CONTEXT_TOKEN_BUDGET) -> tuple:
+    """Build the user prompt from summary + as many recent turns as fit in `budget` tokens.
+
+    Returns (prompt, stats).
+    """
+    max_message_chars = budget * 2  # the new message may use at most half of the budget
+    message = message[:max_message_chars]
+    remaining = budget - estimate_tokens(message) - (estimate_tokens(summary) if summary else 0)
+
+    recent = []
+    for turn in reversed(turns):
+        line = f"{CHAT_ROLE_LABELS.get(turn['role'], turn['role'])}: {turn['content']}"
+        cost = estimate_tokens(line)
+        if cost > remaining:
+            break
+        recent.append(line)
+        remaining -= cost
+    recent.reverse()
+
+    parts = []
+    if summary:
+        parts.append(f"Riassunto della conversazione precedente:\n{summary}")
+    if recent:
+        parts.append("Conversazione recente:\n" + "\n".join(recent))
+    parts.append(f"Nuovo messaggio dell'utente:\n{message}" if parts else message)
+    prompt = "\n\n".join(parts)
+    return prompt, {
+        "prompt_tokens": estimate_tokens(prompt),
+        "turns_included": len(recent),
+        "turns_stored": len(turns),
+        "has_summary": bool(summary),
+    }
+
+async def load_conversation(user_id: str, request: AIChatRequest) -> dict:
+    """Fetch the user's conversation or start one, seeding it with the history the client sent.
+
+    An id that is not one of the user's conversations is never reused: the new conversation gets a fresh id.
+    """
+    if request.conversation_id:
+        conversation = await db.ai_conversations.find_one(
+            {"id": request.conversation_id, "user_id": user_id}, {"_id": 0}
+        )
+        if conversation:
+            return conversation
+    now = datetime.now(timezone.utc).isoformat()
+    seed = [{"role": m.role, "content": m.content, "created_at": now} for m in request.messages[:-1]
+            if m.role in CHAT_ROLE_LABELS]
+    summary = fold_into_summary("", seed[:-CHAT_MAX_STORED_TURNS]) if len(seed) > CHAT_MAX_STORED_TURNS else ""
+    conversation = {
+        "id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "context": request.context,
+        "summary": summary,
+        "turns": seed[-CHAT_MAX_STORED_TURNS:],
+        "turn_count": len(seed),
+        "version": 0,
+        "created_at": now,
+        "updated_at": now,
+    }
+    await db.ai_conversations.insert_one(dict(conversation))
+    return conversation
+
+async def append_conversation_turns(conversation: dict, user_message: str, response: str):
+    """Store the new exchange, folding turns beyond CHAT_MAX_STORED_TURNS into the summary.
+
+    Compare-and-swap on version: if another message was stored first, reload and append on top of it.
+    """
+    now = datetime.now(timezone.utc).isoformat()
+    exchange = [
+        {"role": "user", "content": user_message, "created_at": now},
+        {"role": "assistant", "content": response, "created_at": now},
+    ]
+    for _ in range(CHAT_APPEND_MAX_RETRIES):
+        turns = conversation["turns"] + exchange
+        summary = conversation.get("summary", "")
+        if len(turns) > CHAT_MAX_STORED_TURNS:
+            summary = fold_into_summary(summary, turns[:-CHAT_MAX_STORED_TURNS])
+            turns = turns[-CHAT_MAX_STORED_TURNS:]
+        # Conversations stored before versioning have no version field; {"version": None} matches them
+        res = await db.ai_conversations.update_one(
+            {"id": conversation["id"], "user_id": conversation["user_id"], "version": conversation.get("version")},
+            {"$set": {"turns": turns, "summary": summary, "updated_at": now}, "$inc": {"turn_count": 2, "version": 1}}
+        )
+        if res.matched_count:
+            return
+        conversation = await db.ai_conversations.find_one(
+            {"id": conversation["id"], "user_id": conversation["user_id"]}, {"_id": 0}
+        )
+        if conversation is None:
+            return  # deleted meanwhile
+    raise HTTPException(status_code=409, detail="Conversazione aggiornata da un'altra sessione, riprova")
+
 @api_router.post("/ai/chat")
 async def ai_chat(request: AIChatRequest, current_user: dict = Depends(get_current_user)):
     if not EMERGENT_LLM_KEY:
         return {"response": "AI non configurata. Contatta l'amministratore."}
     
     try:
-        from emergentintegrations.llm.chat import LlmChat, UserMessage
-        
-        system_prompts = {
-            "general": "Sei Karion, un AI coach di trading personale. Parla in modo amichevole, professionale e intimo. Rispondi sempre in italiano senza link o formattazione markdown complessa. Sii conciso ma empatico.",
-            "coach": "Sei Karion, coach di trading personale. Dai consigli pratici e motivazionali. Sii empatico e professionale.",
-            "risk": "Sei Karion esperto di risk management. Calcola position size e rischi. Sii preciso e chiaro.",
-            "psych": "Sei Karion psicologo del trading. Aiuta il trader a gestire stress ed emozioni. Sii comprensivo e supportivo.",
-            "strategy": "Sei Karion analista di strategie. Valuta setup e pattern con occhio critico ma costruttivo.",
-            "journal": "Sei Karion che rivede il journal del trader. Trova pattern comportamentali e suggerisci miglioramenti.",
-            "performance": "Sei Karion coach di performance. Analizza statistiche e indica aree di miglioramento."
-        }
-        
-        chat = LlmChat(
-            api_key=EMERGENT_LLM_KEY,
-            session_id=f"karion-{current_user['id']}-{datetime.now().timestamp()}",
-            system_message=system_prompts.get(request.context, system_prompts["general"])
-        ).with_model("openai", "gpt-5.2")
-        
         last_message = request.messages[-1].content if request.messages else ""
-        msg = UserMessage(text=last_message)
-        response = await chat.send_message(msg)
+        conversation = await load_conversation(current_user["id"], request)
+        prompt, context_stats = build_chat_prompt(conversation["summary"], conversation["turns"], last_message)
+        response = await llm_complete(
+            AI_CHAT_SYSTEM_PROMPTS.get(request.context, AI_CHAT_SYSTEM_PROMPTS["general"]),
+            prompt,
+            session_id=f"karion-{current_user['id']}-{datetime.now().timestamp()}"
+        )
+        await append_conversation_turns(conversation, last_message, response)
         
-        return {"response": response}
+        return {"response": response, "conversation_id": conversation["id"], "context": context_stats}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"AI chat error: {e}")
         return {"response": f"Errore AI: {str(e)}"}
 
+@api_router.post("/ai/chat/stream")
+async def ai_chat_stream(request: AIChatRequest, current_user: dict = Depends(get_current_user)):
+    """Server-Sent Events variant of /ai/chat: `data: {"token": ...}` per chunk, then `event: done`.
+
+    When the client disconnects Starlette cancels the generator, which closes the upstream stream.
+    """
+    system_message = AI_CHAT_SYSTEM_PROMPTS.get(request.context, AI_CHAT_SYSTEM_PROMPTS["general"])
+    last_message = request.messages[-1].content if request.messages else ""
+
+    async def events():
+        try:
+            if not EMERGENT_LLM_KEY and not LLM_STREAM_URL:
+                async for token in _single_token("AI non configurata. Contatta l'amministratore."):
+                    yield f"data: {json.dumps({'token': token}, ensure_ascii=False)}\n\n"
+                yield "event: done\ndata: {}\n\n"
+                return
+
+            conversation = await load_conversation(current_user["id"], request)
+            prompt, _ = build_chat_prompt(conversation["summary"], conversation["turns"], last_message)
+            parts = []
+            tokens = llm_stream(system_message, prompt, session_id=f"karion-{current_user['id']}-{datetime.now().timestamp()}")
+            async for token in tokens:
+                parts.append(token)
+                yield f"data: {json.dumps({'token': token}, ensure_ascii=False)}\n\n"
+            await append_conversation_turns(conversation, last_message, "".join(parts))
+            yield f"event: done\ndata: {json.dumps({'conversation_id': conversation['id']})}\n\n"
+        except asyncio.CancelledError:
+            logger.info("AI chat stream cancelled by client")
+            raise
+        except Exception as e:
+            logger.error(f"AI chat stream error: {e}")
+            yield f"event: error\ndata: {json.dumps({'error': str(e)}, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def _single_token(text: str):
+    yield text
+
+@api_router.get("/ai/conversations")
+async def list_conversations(current_user: dict = Depends(get_current_user)):
+    return await db.ai_conversations.find(
+        {"user_id": current_user["id"]},
+        {"_id": 0, "id": 1, "context": 1, "turn_count": 1, "created_at": 1, "updated_at": 1}
+    ).sort("updated_at", -1).to_list(50)
+
+@api_router.get("/ai/conversations/{conversation_id}")
+async def get_conversation(conversation_id: str, current_user: dict = Depends(get_current_user)):
+    conversation = await db.ai_conversations.find_one({"id": conversation_id, "user_id": current_user["id"]}, {"_id": 0})
+    if not conversation:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return conversation
+
+@api_router.delete("/ai/conversations/{conversation_id}")
+async def delete_conversation(conversation_id: str, current_user: dict = Depends(get_current_user)):
+    result = await db.ai_conversations.delete_one({"id": conversation_id, "user_id": current_user["id"]})
+    if result.deleted_count == 0:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return {"status": "deleted"}
+
 @api_router.post("/ai/intimate-analysis")
 async def ai_intimate_analysis(current_user: dict = Depends(get_current_user)):
     """Generate a deep, personal analysis of the trader's journey"""
@@ -1010,28 +3715,32 @@ async def ai_intimate_analysis(current_user: dict = Depends(get_current_user)):
         return {"analysis": "AI non configurata."}
     
     try:
-        from emergentintegrations.llm.chat import LlmChat, UserMessage
-        
-        # Fetch user's data from various sources
+        # Rolling windows from the feature store (one small document)
         user_id = current_user['id']
-        
-        # Get psychology stats
-        psych_entries = await db.psychology_entries.find({"user_id": user_id}).sort("date", -1).limit(30).to_list(30)
-        
-        # Get journal entries
-        journal_entries = await db.journal_entries.find({"user_id": user_id}).sort("created_at", -1).limit(20).to_list(20)
+        features = await get_user_features(user_id)
+        month = features["windows"]["30d"]
         
         # Build context
         context_parts = []
         
-        if psych_entries:
-            avg_confidence = sum(e.get('confidence', 5) for e in psych_entries) / len(psych_entries)
-            avg_stress = sum(e.get('stress', 5) for e in psych_entries) / len(psych_entries)
-            avg_sleep = sum(e.get('sleep_hours', 7) for e in psych_entries) / len(psych_entries)
-            context_parts.append(f"Ultimi 30 giorni: Confidence media {avg_confidence:.1f}/10, Stress medio {avg_stress:.1f}/10, Sonno medio {avg_sleep:.1f}h")
+        if month["checkins"]:
+            context_parts.append(f"Ultimi 30 giorni: Confidence media {month['avg_confidence']:.1f}/10, Disciplina media {month['avg_discipline']:.1f}/10, Sonno medio {month['avg_sleep_hours']:.1f}h")
+        
+        if month["eod_days"]:
+            context_parts.append(f"EOD: Stress medio {month['avg_stress']:.1f}/10, Shark Score medio {month['avg_shark_score']:.0f}/100, Rischio compulsione {month['avg_compulsion_risk']:.0f}/100")
+            if month["pattern_counts"]:
+                top_patterns = sorted(month["pattern_counts"].items(), key=lambda p: -p[1])[:3]
+                context_parts.append("Pattern ricorrenti: " + ", ".join(f"{p} ({c}x)" for p, c in top_patterns))
         
-        if journal_entries:
-            context_parts.append(f"Ha scritto {len(journal_entries)} entry nel journal recentemente")
+        if month["trades"]:
+            context_parts.append(f"Trade: {month['trades']} operazioni, win rate {month['win_rate']}%, P&L {month['total_pnl']}, R medio {month['avg_r']}")
+        
+        week = features["windows"]["7d"]
+        if week["checkins"] and month["checkins"]:
+            context_parts.append(f"Ultimi 7 giorni: Confidence media {week['avg_confidence']:.1f}/10 (vs {month['avg_confidence']:.1f} sul mese)")
+        
+        if month["journal_entries"]:
+            context_parts.append(f"Ha scritto {month['journal_entries']} entry nel journal recentemente")
         
         context = "\n".join(context_parts) if context_parts else "Dati limitati disponibili"
         
@@ -1053,12 +3762,6 @@ Struttura l'analisi in:
 
 Non usare emoji, link o formattazione markdown complessa. Scrivi in modo naturale e umano."""
 
-        chat = LlmChat(
-            api_key=EMERGENT_LLM_KEY,
-            session_id=f"intimate-{user_id}-{datetime.now().timestamp()}",
-            system_message=system_message
-        ).with_model("openai", "gpt-5.2")
-        
         prompt = f"""Analizza questo trader in modo intimo e personale.
 
 Dati disponibili:
@@ -1066,8 +3769,10 @@ Dati disponibili:
 
 Scrivi un'analisi personale come se lo conoscessi da tempo. Sii sincero, empatico e costruttivo."""
 
-        msg = UserMessage(text=prompt)
-        response = await chat.send_message(msg)
+        response = await llm_complete(
+            system_message, prompt,
+            session_id=f"intimate-{user_id}-{datetime.now().timestamp()}"
+        )
         
         return {"analysis": response}
     except Exception as e:
@@ -1090,121 +3795,615 @@ Karion"""}
 
 # ==================== MONTE CARLO ====================
 
-@api_router.post("/montecarlo/simulate")
-async def monte_carlo_simulation(params: MonteCarloParams, current_user: dict = Depends(get_current_user)):
-    results = []
-    bankruptcies = 0
-    final_capitals = []
-    max_drawdowns = []
-    
-    num_simulations = 10000  # Run 10000 simulations
-    
-    for _ in range(num_simulations):
-        capital = params.initial_capital
-        equity_curve = [capital]
-        peak = capital
-        max_dd = 0
-        
-        for _ in range(params.num_trades):
-            risk_amount = capital * params.risk_per_trade
-            if random.random() < params.win_rate:
-                capital += risk_amount * params.avg_win
-            else:
-                capital -= risk_amount * params.avg_loss
-            
-            equity_curve.append(capital)
-            
-            # Track drawdown
-            if capital > peak:
-                peak = capital
-            dd = ((peak - capital) / peak * 100) if peak > 0 else 0
-            if dd > max_dd:
-                max_dd = dd
-            
-            if capital <= 0:
-                bankruptcies += 1
-                break
-        
-        final_capitals.append(capital)
-        max_drawdowns.append(max_dd)
-        if len(results) < 100:  # Store first 100 curves for visualization
-            results.append(equity_curve)
-    
-    # Sort final capitals for percentile calculation
-    sorted_capitals = sorted(final_capitals)
-    
-    avg_final = sum(final_capitals) / len(final_capitals)
-    median_final = sorted_capitals[len(sorted_capitals) // 2]
-    max_final = max(final_capitals)
-    min_final = min(final_capitals)
-    bankruptcy_rate = (bankruptcies / num_simulations) * 100
-    avg_max_dd = sum(max_drawdowns) / len(max_drawdowns)
-    worst_dd = max(max_drawdowns)
-    
-    # Calculate percentiles
-    p10_final = sorted_capitals[int(len(sorted_capitals) * 0.1)]
-    p90_final = sorted_capitals[int(len(sorted_capitals) * 0.9)]
-    
-    return {
-        "equity_curves": results[:50],  # Send 50 for visualization
-        "avg_final_capital": round(avg_final, 2),
-        "median_final_capital": round(median_final, 2),
-        "max_final_capital": round(max_final, 2),
-        "min_final_capital": round(min_final, 2),
-        "p10_final_capital": round(p10_final, 2),
-        "p90_final_capital": round(p90_final, 2),
-        "bankruptcy_rate": round(bankruptcy_rate, 2),
-        "avg_max_drawdown": round(avg_max_dd, 2),
-        "worst_drawdown": round(worst_dd, 2),
+MC_NUM_SIMULATIONS = 10000
+MC_CURVES_RETURNED = 50
+MC_BAND_POINTS = 200
+MC_BAND_PERCENTILES = (5, 25, 50, 75, 95)
+# Cells (simulations x trades) generated per chunk, bounds memory at ~16MB per array
+MC_CHUNK_CELLS = 2_000_000
+
+def simulate_equity_chunk(uniforms: np.ndarray, win_rate: float, avg_win: float, avg_loss: float,
+                          risk_per_trade: float, initial_capital: float):
+    """Equity paths for a chunk of simulations driven by uniforms of shape (sims, trades).
+
+    Capital compounds by a fixed factor per win/loss; a path that reaches <= 0 is
+    bankrupt and stays frozen at that value, like the break in the scalar loop.
+    Returns (paths, bankrupt, lengths, max_drawdown) where lengths[i] is the
+    number of points of path i up to and including the bankruptcy step.
+    """
+    sims, trades = uniforms.shape
+    factors = np.where(uniforms < win_rate, 1 + risk_per_trade * avg_win, 1 - risk_per_trade * avg_loss)
+    capital = initial_capital * np.cumprod(factors, axis=1)
+    busted = capital <= 0
+    bankrupt = busted.any(axis=1)
+    lengths = np.full(sims, trades + 1)
+    if bankrupt.any():
+        bust_step = busted.argmax(axis=1)
+        lengths[bankrupt] = bust_step[bankrupt] + 2
+        frozen = bankrupt[:, None] & (np.arange(trades) > bust_step[:, None])
+        capital = np.where(frozen, capital[np.arange(sims), bust_step][:, None], capital)
+    paths = np.concatenate([np.full((sims, 1), float(initial_capital)), capital], axis=1)
+    peak = np.maximum.accumulate(paths, axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        drawdown = np.where(peak > 0, (peak - paths) / peak * 100, 0.0)
+    return paths, bankrupt, lengths, drawdown.max(axis=1)
+
+def lttb_downsample(values: np.ndarray, max_points: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets: indices of max_points samples that keep the curve's shape"""
+    n = len(values)
+    if max_points >= n or max_points < 3:
+        return np.arange(n)
+    y = np.asarray(values, dtype=float)
+    edges = (np.arange(max_points - 1) * ((n - 2) / (max_points - 2))).astype(int) + 1
+    edges[-1] = n - 1
+    selected = np.empty(max_points, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(max_points - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        cx = (end + next_end - 1) / 2
+        cy = y[end:next_end].mean()
+        xs = np.arange(start, end)
+        area = np.abs((a - cx) * (y[start:end] - y[a]) - (a - xs) * (cy - y[a]))
+        a = start + int(area.argmax())
+        selected[i + 1] = a
+    return selected
+
+def run_monte_carlo(params: MonteCarloParams, num_simulations: int = MC_NUM_SIMULATIONS) -> dict:
+    """Vectorized simulation; percentile bands are sampled from each chunk as it is generated"""
+    trades = params.num_trades
+    band_steps = np.unique(np.linspace(0, trades, min(params.max_points or MC_BAND_POINTS, trades + 1)).round().astype(int))
+    chunk = max(1, MC_CHUNK_CELLS // max(trades, 1))
+    rng = np.random.default_rng()
+
+    final_capitals = np.empty(num_simulations)
+    max_drawdowns = np.empty(num_simulations)
+    bankrupt = np.empty(num_simulations, dtype=bool)
+    band_values = np.empty((num_simulations, len(band_steps)))
+    curves = []
+    for start in range(0, num_simulations, chunk):
+        rows = min(chunk, num_simulations - start)
+        paths, busted, lengths, max_dd = simulate_equity_chunk(
+            rng.random((rows, trades)), params.win_rate, params.avg_win, params.avg_loss,
+            params.risk_per_trade, params.initial_capital
+        )
+        block = slice(start, start + rows)
+        final_capitals[block] = paths[:, -1]
+        max_drawdowns[block] = max_dd
+        bankrupt[block] = busted
+        band_values[block] = paths[:, band_steps]
+        for i in range(min(rows, MC_CURVES_RETURNED - len(curves))):
+            curves.append(paths[i, :lengths[i]])
+
+    bands = np.percentile(band_values, MC_BAND_PERCENTILES, axis=0)
+    sorted_capitals = np.sort(final_capitals)
+
+    result = {
+        "equity_curves": [],
+        "bands": {"steps": band_steps,
+                  **{f"p{q}": band.round(2) for q, band in zip(MC_BAND_PERCENTILES, bands)}},
+        "avg_final_capital": round(float(final_capitals.mean()), 2),
+        "median_final_capital": round(float(sorted_capitals[num_simulations // 2]), 2),
+        "max_final_capital": round(float(sorted_capitals[-1]), 2),
+        "min_final_capital": round(float(sorted_capitals[0]), 2),
+        "p10_final_capital": round(float(sorted_capitals[int(num_simulations * 0.1)]), 2),
+        "p90_final_capital": round(float(sorted_capitals[int(num_simulations * 0.9)]), 2),
+        "bankruptcy_rate": round(float(bankrupt.mean() * 100), 2),
+        "avg_max_drawdown": round(float(max_drawdowns.mean()), 2),
+        "worst_drawdown": round(float(max_drawdowns.max()), 2),
         "num_simulations": num_simulations,
         "params": params.model_dump()
     }
+    if params.max_points:
+        result["equity_curve_steps"] = []
+        for curve in curves:
+            keep = lttb_downsample(curve, params.max_points)
+            result["equity_curves"].append(curve[keep].round(2))
+            result["equity_curve_steps"].append(keep)
+    else:
+        result["equity_curves"] = curves
+    return result
+
+@api_router.post("/montecarlo/simulate")
+async def monte_carlo_simulation(params: MonteCarloParams, request: Request, current_user: dict = Depends(get_current_user)):
+    fmt = negotiate_format(request)
+    result = await asyncio.to_thread(run_monte_carlo, params)
+    if fmt != "json":
+        return encode_response(result, fmt)
+    # orjson writes the numpy arrays directly
+    return TimedORJSONResponse(result)
+
+# Upper bound on cells x simulations x trades evaluated by one sweep
+MC_SWEEP_MAX_STEPS = 500_000_000
+MC_SWEEP_WORKERS = min(4, os.cpu_count() or 1)
+MC_SWEEP_METRICS = ("bankruptcy_rate", "median_final_capital", "p10_drawdown")
+
+_mc_executor = None
+
+def _get_mc_executor() -> ProcessPoolExecutor:
+    global _mc_executor
+    if _mc_executor is None:
+        _mc_executor = ProcessPoolExecutor(max_workers=MC_SWEEP_WORKERS)
+    return _mc_executor
+
+def sweep_cells(cells: List[Tuple[float, float]], avg_win: float, avg_loss: float, num_trades: int,
+                initial_capital: float, num_simulations: int, seed: int) -> List[List[float]]:
+    """Evaluate (win_rate, risk_per_trade) cells on one shared random stream.
+
+    Every worker regenerates the same uniforms from seed, so all cells of a sweep
+    see identical trade sequences (common random numbers) and differences between
+    cells come from the parameters alone.
+    """
+    rng = np.random.default_rng(seed)
+    chunk = max(1, MC_CHUNK_CELLS // max(num_trades, 1))
+    finals = np.empty((len(cells), num_simulations))
+    drawdowns = np.empty((len(cells), num_simulations))
+    bankrupt = np.zeros(len(cells))
+    for start in range(0, num_simulations, chunk):
+        uniforms = rng.random((min(chunk, num_simulations - start), num_trades))
+        block = slice(start, start + len(uniforms))
+        for i, (win_rate, risk) in enumerate(cells):
+            paths, busted, _, max_dd = simulate_equity_chunk(uniforms, win_rate, avg_win, avg_loss, risk, initial_capital)
+            finals[i, block] = paths[:, -1]
+            drawdowns[i, block] = max_dd
+            bankrupt[i] += busted.sum()
+    return [
+        [round(float(bankrupt[i] / num_simulations * 100), 2),
+         round(float(np.median(finals[i])), 2),
+         round(float(np.percentile(drawdowns[i], 90)), 2)]
+        for i in range(len(cells))
+    ]
+
+@api_router.post("/montecarlo/sweep")
+async def monte_carlo_sweep(params: MonteCarloSweepParams, request: Request, current_user: dict = Depends(get_current_user)):
+    """Grid of win_rate x risk_per_trade cells, split across worker processes"""
+    fmt = negotiate_format(request)
+    steps = len(params.win_rates) * len(params.risks_per_trade) * params.num_simulations * params.num_trades
+    if steps > MC_SWEEP_MAX_STEPS:
+        raise HTTPException(status_code=400, detail="Sweep troppo grande: riduci combinazioni, simulazioni o trade")
+    seed = params.seed if params.seed is not None else int(np.random.SeedSequence().entropy % 2**63)
+    cells = [(w, r) for w in params.win_rates for r in params.risks_per_trade]
+    groups = [cells[i::MC_SWEEP_WORKERS] for i in range(min(MC_SWEEP_WORKERS, len(cells)))]
+
+    loop = asyncio.get_running_loop()
+    executor = _get_mc_executor()
+    results = await asyncio.gather(*[
+        loop.run_in_executor(executor, sweep_cells, group, params.avg_win, params.avg_loss,
+                             params.num_trades, params.initial_capital, params.num_simulations, seed)
+        for group in groups
+    ])
+    by_cell = {cell: stats for group, stats in zip(groups, results) for cell, stats in zip(group, stats)}
+
+    cols = len(params.risks_per_trade)
+    result = {
+        "win_rates": params.win_rates,
+        "risks_per_trade": params.risks_per_trade,
+        **{metric: [[by_cell[cells[row * cols + col]][m] for col in range(cols)]
+                    for row in range(len(params.win_rates))]
+           for m, metric in enumerate(MC_SWEEP_METRICS)},
+        "num_simulations": params.num_simulations,
+        "num_trades": params.num_trades,
+        "seed": seed
+    }
+    if fmt != "json":
+        return encode_response(result, fmt)
+    return result
+
+ANALYTIC_DP_MAX_TRADES = 20000
+
+def analytic_assumption_flags(params: MonteCarloAnalyticParams) -> Tuple[bool, List[str]]:
+    """Flags for inputs the closed-form Bernoulli model cannot handle (valid=False) or handles with caveats"""
+    invalid = []
+    if not 0 < params.win_rate < 1:
+        invalid.append("win_rate_out_of_range")
+    if params.avg_win <= 0 or params.avg_loss <= 0:
+        invalid.append("non_positive_payoff")
+    if not 0 < params.risk_per_trade <= 1:
+        invalid.append("risk_out_of_range")
+    if params.initial_capital <= 0:
+        invalid.append("non_positive_capital")
+    if invalid:
+        return False, invalid
+    flags = []
+    edge = params.win_rate * params.avg_win - (1 - params.win_rate) * params.avg_loss
+    if params.risk_per_trade * params.avg_loss >= 1:
+        flags.append("single_loss_wipes_account")
+    if edge <= 0:
+        flags.append("negative_edge")
+    elif params.risk_per_trade > edge / (params.avg_win * params.avg_loss):
+        flags.append("above_kelly")
+    if params.num_trades > ANALYTIC_DP_MAX_TRADES:
+        flags.append("ruin_horizon_truncated")
+    return True, flags
+
+def ruin_probability(win_rate: float, log_win: float, log_loss: float, num_trades: int, log_barrier: float) -> float:
+    """P(capital touches the barrier within num_trades), by DP over the number of wins.
+
+    After t trades with k wins log-capital is k*log_win + (t-k)*log_loss, so the
+    surviving probability mass lives on k only and the barrier absorbs every k
+    up to a cut that moves with t.
+    """
+    alive = np.zeros(num_trades + 1)
+    alive[0] = 1.0
+    ruined = 0.0
+    for t in range(1, num_trades + 1):
+        alive[1:t + 1] = alive[1:t + 1] * (1 - win_rate) + alive[:t] * win_rate
+        alive[0] *= 1 - win_rate
+        cut = int(np.floor((log_barrier - t * log_loss) / (log_win - log_loss) + 1e-9))
+        if cut >= 0:
+            ruined += alive[:cut + 1].sum()
+            alive[:cut + 1] = 0.0
+    return float(ruined)
+
+def monte_carlo_analytic(params: MonteCarloAnalyticParams) -> dict:
+    """Closed-form metrics of the fixed-fraction Bernoulli model simulated by run_monte_carlo"""
+    valid, flags = analytic_assumption_flags(params)
+    result = {"method": "analytic", "assumptions": {"valid": valid, "flags": flags}, "params": params.model_dump()}
+    if not valid:
+        return result
+
+    p, n, risk = params.win_rate, params.num_trades, params.risk_per_trade
+    win_factor = 1 + risk * params.avg_win
+    loss_factor = 1 - risk * params.avg_loss
+    edge = p * params.avg_win - (1 - p) * params.avg_loss
+    kelly = max(edge / (params.avg_win * params.avg_loss), 0.0)
+
+    # Final capital is monotonic in the number of wins K ~ Binomial(n, p)
+    ks = np.arange(n + 1)
+    log_pmf = np.concatenate([[n * np.log1p(-p)], np.cumsum(np.log((n - ks[:-1]) / (ks[:-1] + 1)) + np.log(p / (1 - p)))])
+    pmf = np.exp(log_pmf - log_pmf.max())
+    cdf = np.cumsum(pmf) / pmf.sum()
+    median_wins = int(np.searchsorted(cdf, 0.5))
+
+    if loss_factor <= 0:
+        # Bankrupt paths stop trading, so the compounding mean no longer applies
+        log_growth = expected_final = None
+        median_final = params.initial_capital * win_factor ** n if median_wins == n else 0.0
+        below_initial = 1 - p ** n
+        bankruptcy = 1 - p ** n
+        ruin = bankruptcy
+    else:
+        log_win, log_loss = np.log(win_factor), np.log(loss_factor)
+        log_growth = float(p * log_win + (1 - p) * log_loss)
+        expected_final = round(params.initial_capital * (1 + risk * edge) ** n, 2)
+        median_final = params.initial_capital * float(np.exp(median_wins * log_win + (n - median_wins) * log_loss))
+        breakeven_wins = np.ceil(-n * log_loss / (log_win - log_loss) - 1e-12)
+        below_initial = float(cdf[int(breakeven_wins) - 1]) if breakeven_wins > 0 else 0.0
+        bankruptcy = 0.0
+        ruin = ruin_probability(p, log_win, log_loss, min(n, ANALYTIC_DP_MAX_TRADES), np.log1p(-params.ruin_drawdown))
+
+    result.update({
+        "expectancy_r": round(edge, 4),
+        "kelly_fraction": round(kelly, 6),
+        "kelly_multiple": round(risk / kelly, 3) if kelly > 0 else None,
+        "log_growth_per_trade": round(log_growth, 8) if log_growth is not None else None,
+        "expected_final_capital": expected_final,
+        "median_final_capital": round(median_final, 2),
+        "prob_below_initial": round(below_initial * 100, 2),
+        "bankruptcy_rate": round(bankruptcy * 100, 2),
+        "ruin_rate": round(ruin * 100, 2),
+        "ruin_drawdown": params.ruin_drawdown
+    })
+    return result
+
+@api_router.post("/montecarlo/analytic")
+async def monte_carlo_analytic_endpoint(params: MonteCarloAnalyticParams, current_user: dict = Depends(get_current_user)):
+    """Bankruptcy, ruin, growth and Kelly without simulation; use /montecarlo/simulate for curves"""
+    return await asyncio.to_thread(monte_carlo_analytic, params)
 
 # ==================== PDF ANALYSIS ====================
 
+PDF_MAX_BYTES = int(os.environ.get('PDF_MAX_BYTES', 50 * 1024 * 1024))
+PDF_MAX_PAGES = int(os.environ.get('PDF_MAX_PAGES', 200))
+PDF_PAGES_PER_TASK = 8
+PDF_MAX_TRADES = 5000
+PDF_CACHE_MAX_ENTRIES = 64
+
+# Uploads are spooled to disk in chunks so memory per upload stays bounded
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+UPLOAD_TMP_DIR = os.environ.get('UPLOAD_TMP_DIR') or None
+
+# Parsed reports keyed by user and sha256 of the file content (LRU)
+_pdf_analysis_cache = OrderedDict()
+_pdf_executor = None
+
+# Numbers as printed by MT5: "1 234.56", "-12.30", "0.10"
+_MT5_NUM = r"-?(?:\d{1,3}(?:[ \u00a0]\d{3})+|\d+)(?:\.\d+)?"
+_MT5_DATE = r"\d{4}\.\d{2}\.\d{2} \d{2}:\d{2}(?::\d{2})?"
+_MT5_SYMBOL = r"[A-Za-z][A-Za-z0-9._#+-]*"
+
+MT5_METRIC_LABELS = {
+    "total_net_profit": "Total Net Profit",
+    "gross_profit": "Gross Profit",
+    "gross_loss": "Gross Loss",
+    "profit_factor": "Profit Factor",
+    "expected_payoff": "Expected Payoff",
+    "recovery_factor": "Recovery Factor",
+    "sharpe_ratio": "Sharpe Ratio",
+    "total_trades": "Total Trades",
+    "balance_drawdown_maximal": "Balance Drawdown Maximal",
+    "equity_drawdown_maximal": "Equity Drawdown Maximal",
+    "maximal_drawdown": "Maximal Drawdown",
+}
+_MT5_METRIC_RES = {
+    key: re.compile(re.escape(label) + r":?\s*(" + _MT5_NUM + r")(?:\s*\((" + _MT5_NUM + r")%\))?")
+    for key, label in MT5_METRIC_LABELS.items()
+}
+_MT5_PROFIT_TRADES_RE = re.compile(r"Profit Trades \(% of total\):?\s*(" + _MT5_NUM + r")\s*\((" + _MT5_NUM + r")%\)")
+
+# Positions table: open time, position, symbol, type, volume, price, s/l, t/p, close time, price, commission, swap, profit
+_MT5_POSITION_RE = re.compile(
+    rf"^({_MT5_DATE})\s+(\d+)\s+({_MT5_SYMBOL})\s+(buy|sell)\s+({_MT5_NUM})\s+({_MT5_NUM})\s+({_MT5_NUM})?\s*({_MT5_NUM})?\s*"
+    rf"({_MT5_DATE})\s+({_MT5_NUM})\s+({_MT5_NUM})\s+({_MT5_NUM})\s+({_MT5_NUM})\s*$",
+    re.IGNORECASE
+)
+# Deals table: time, deal, symbol, type, direction, volume, price, order, commission, swap, profit, balance
+_MT5_DEAL_RE = re.compile(
+    rf"^({_MT5_DATE})\s+(\d+)\s+({_MT5_SYMBOL})\s+(buy|sell)\s+(in/out|in|out)\s+({_MT5_NUM})\s+({_MT5_NUM})\s+(\d+)\s+"
+    rf"({_MT5_NUM})\s+({_MT5_NUM})\s+({_MT5_NUM})\s+({_MT5_NUM})",
+    re.IGNORECASE
+)
+
+def _mt5_number(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    return float(value.replace("\xa0", "").replace(" ", ""))
+
+def _parse_mt5_rows(text: str) -> Dict[str, list]:
+    """Extract positions and deals rows from the text of a few MT5 report pages"""
+    positions, deals = [], []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or not line[:1].isdigit():
+            continue
+        m = _MT5_POSITION_RE.match(line)
+        if m:
+            positions.append({
+                "symbol": m.group(3).upper(),
+                "date": _normalize_import_date(m.group(1)),
+                "side": m.group(4).lower(),
+                "volume": _mt5_number(m.group(5)),
+                "entry_price": _mt5_number(m.group(6)),
+                "exit_price": _mt5_number(m.group(10)),
+                "profit_loss": round((_mt5_number(m.group(11)) or 0) + (_mt5_number(m.group(12)) or 0) + (_mt5_number(m.group(13)) or 0), 2),
+            })
+            continue
+        m = _MT5_DEAL_RE.match(line)
+        if m:
+            deals.append({
+                "date": _normalize_import_date(m.group(1)),
+                "symbol": m.group(3).upper(),
+                "side": m.group(4).lower(),
+                "direction": m.group(5).lower(),
+                "volume": _mt5_number(m.group(6)),
+                "price": _mt5_number(m.group(7)),
+                "net": (_mt5_number(m.group(9)) or 0) + (_mt5_number(m.group(10)) or 0) + (_mt5_number(m.group(11)) or 0),
+            })
+    return {"positions": positions, "deals": deals}
+
+def _open_pdf_mmap(path: str):
+    """Open a spooled PDF read-only through mmap so workers never copy it into memory"""
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def _extract_pdf_pages(path: str, page_indices: List[int]) -> dict:
+    """Process-pool worker: extract and parse the given pages of a spooled PDF"""
+    mm = _open_pdf_mmap(path)
+    try:
+        reader = PdfReader(mm)
+        text = "\n".join(reader.pages[i].extract_text() or "" for i in page_indices)
+    finally:
+        mm.close()
+    return {"text": text, **_parse_mt5_rows(text)}
+
+def _count_pdf_pages(path: str) -> int:
+    mm = _open_pdf_mmap(path)
+    try:
+        return len(PdfReader(mm).pages)
+    finally:
+        mm.close()
+
+def requested_pages(spec: Optional[str], page_count: int) -> List[int]:
+    """Turn "1-5,8" (1-based, inclusive) into 0-based page indices; all pages when empty.
+
+    Not capped: the caller keeps the first PDF_MAX_PAGES and reports the rest as truncated.
+    """
+    if not spec:
+        return list(range(page_count))
+    indices = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            if "-" in part:
+                first, last = part.split("-", 1)
+                start, stop = int(first), int(last) if last.strip() else page_count
+            else:
+                start = stop = int(part)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid page range: {part}")
+        if start < 1 or stop < start:
+            raise HTTPException(status_code=400, detail=f"Invalid page range: {part}")
+        indices.update(range(start - 1, min(stop, page_count)))
+    if not indices:
+        raise HTTPException(status_code=400, detail=f"No pages in range {spec} (document has {page_count} pages)")
+    return sorted(indices)
+
+async def spool_upload(file: UploadFile, max_bytes: int, suffix: str = "") -> tuple:
+    """Copy an upload to a temp file chunk by chunk, enforcing max_bytes.
+
+    Writes run in a worker thread so a slow disk does not stall the event loop.
+    Returns (path, size, sha256 hexdigest). The caller must remove the file.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=suffix, dir=UPLOAD_TMP_DIR)
+    try:
+        with tmp:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(status_code=413, detail=f"File too large (max {max_bytes // (1024 * 1024)}MB)")
+                digest.update(chunk)
+                await asyncio.to_thread(tmp.write, chunk)
+    except BaseException:
+        os.unlink(tmp.name)
+        raise
+    return tmp.name, size, digest.hexdigest()
+
+def _get_pdf_executor() -> ProcessPoolExecutor:
+    global _pdf_executor
+    if _pdf_executor is None:
+        _pdf_executor = ProcessPoolExecutor(max_workers=min(4, os.cpu_count() or 1))
+    return _pdf_executor
+
+def _deals_to_trades(deals: List[dict]) -> List[dict]:
+    """Pair MT5 "in" and "out" deals FIFO per symbol into closed trades"""
+    open_deals = {}
+    trades = []
+    for deal in deals:
+        queue = open_deals.setdefault(deal["symbol"], [])
+        if deal["direction"] == "in":
+            queue.append(deal)
+        elif queue:
+            opened = queue.pop(0)
+            trades.append({
+                "symbol": deal["symbol"],
+                "date": opened["date"],
+                "side": opened["side"],
+                "volume": opened["volume"],
+                "entry_price": opened["price"],
+                "exit_price": deal["price"],
+                "profit_loss": round(opened["net"] + deal["net"], 2),
+            })
+    return trades
+
+def parse_mt5_metrics(text: str, trades: List[dict]) -> Dict[str, Any]:
+    """Read the MT5 summary table; fill gaps from the extracted trades"""
+    metrics = {}
+    for key, pattern in _MT5_METRIC_RES.items():
+        m = pattern.search(text)
+        if m:
+            metrics[key] = _mt5_number(m.group(1))
+            if m.group(2):
+                metrics[f"{key}_pct"] = _mt5_number(m.group(2))
+    if "total_trades" in metrics:
+        metrics["total_trades"] = int(metrics["total_trades"])
+    m = _MT5_PROFIT_TRADES_RE.search(text)
+    if m:
+        metrics["profit_trades"] = int(_mt5_number(m.group(1)))
+        metrics["win_rate"] = _mt5_number(m.group(2))
+
+    if trades:
+        wins = [t["profit_loss"] for t in trades if t["profit_loss"] > 0]
+        losses = [t["profit_loss"] for t in trades if t["profit_loss"] < 0]
+        metrics.setdefault("total_trades", len(trades))
+        metrics.setdefault("win_rate", round(len(wins) / len(trades) * 100, 2))
+        metrics.setdefault("total_net_profit", round(sum(wins) + sum(losses), 2))
+        if losses:
+            metrics.setdefault("profit_factor", round(sum(wins) / abs(sum(losses)), 2))
+        if wins:
+            metrics.setdefault("avg_win", round(sum(wins) / len(wins), 2))
+        if losses:
+            metrics.setdefault("avg_loss", round(abs(sum(losses)) / len(losses), 2))
+    return metrics
+
+async def extract_mt5_report(path: str, pages_spec: Optional[str] = None) -> dict:
+    """Extract text, metrics and trades from a spooled MT5 PDF, spreading pages over worker processes"""
+    loop = asyncio.get_running_loop()
+    executor = _get_pdf_executor()
+    page_count = await loop.run_in_executor(executor, _count_pdf_pages, path)
+    requested = requested_pages(pages_spec, page_count)
+    page_indices = requested[:PDF_MAX_PAGES]
+
+    chunks = await asyncio.gather(*[
+        loop.run_in_executor(executor, _extract_pdf_pages, path, page_indices[i:i + PDF_PAGES_PER_TASK])
+        for i in range(0, len(page_indices), PDF_PAGES_PER_TASK)
+    ])
+
+    text = "\n".join(c["text"] for c in chunks)
+    positions = [p for c in chunks for p in c["positions"]]
+    trades = positions or _deals_to_trades([d for c in chunks for d in c["deals"]])
+
+    return {
+        "page_count": page_count,
+        "pages_processed": len(page_indices),
+        "truncated": len(requested) > len(page_indices),
+        "text": text,
+        "metrics": parse_mt5_metrics(text, trades),
+        "trades": trades[:PDF_MAX_TRADES],
+        "trade_count": len(trades),
+    }
+
 @api_router.post("/analysis/pdf")
-async def analyze_pdf(file: UploadFile = File(...), current_user: dict = Depends(get_current_user)):
+async def analyze_pdf(file: UploadFile = File(...), pages: Optional[str] = None,
+                      current_user: dict = Depends(get_current_user)):
+    """Analyze an MT5 PDF report. `pages` limits processing to ranges like "1-5,8"."""
     if not file.filename.endswith('.pdf'):
         raise HTTPException(status_code=400, detail="Only PDF files are supported")
     
+    path = None
     try:
-        content = await file.read()
-        pdf_reader = PdfReader(io.BytesIO(content))
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() or ""
+        path, size, content_hash = await spool_upload(file, PDF_MAX_BYTES, suffix=".pdf")
+        if size == 0:
+            raise HTTPException(status_code=400, detail="Empty PDF file")
+
+        # The AI commentary is generated for the uploader, so reports are never shared across users
+        cache_key = f"{current_user['id']}:{content_hash}:{pages or ''}"
+        cached = _pdf_analysis_cache.get(cache_key)
+        if cached:
+            _pdf_analysis_cache.move_to_end(cache_key)
+            return {**cached, "filename": file.filename, "cached": True}
+
+        report = await extract_mt5_report(path, pages)
+        text = report["text"]
         
-        # Extract basic stats (simplified)
         stats = {
             "raw_text": text[:2000],  # First 2000 chars
-            "page_count": len(pdf_reader.pages)
+            "page_count": report["page_count"],
+            "pages_processed": report["pages_processed"],
+            "truncated": report["truncated"],
+            "metrics": report["metrics"],
+            "trades": report["trades"],
+            "trade_count": report["trade_count"]
         }
         
         # AI Analysis
         ai_analysis = ""
         if EMERGENT_LLM_KEY and text:
             try:
-                from emergentintegrations.llm.chat import LlmChat, UserMessage
-                chat = LlmChat(
-                    api_key=EMERGENT_LLM_KEY,
-                    session_id=f"pdf-{current_user['id']}-{datetime.now().timestamp()}",
-                    system_message="Sei un esperto di analisi report MT5. Analizza questo report e identifica: Win Rate, Drawdown, Profit Factor, numero trade. Dai consigli di miglioramento in italiano."
-                ).with_model("openai", "gpt-5.2")
-                
-                msg = UserMessage(text=f"Analizza questo report MT5:\n{text[:3000]}")
-                ai_analysis = await chat.send_message(msg)
+                ai_analysis = await llm_complete(
+                    "Sei un esperto di analisi report MT5. Ti vengono fornite le metriche già estratte dal report. Commentale e dai consigli di miglioramento in italiano.",
+                    f"Metriche del report MT5:\n{json.dumps(report['metrics'], ensure_ascii=False)}\nTrade estratti: {report['trade_count']}\n\nEstratto:\n{text[:1500]}",
+                    session_id=f"pdf-{current_user['id']}-{datetime.now().timestamp()}"
+                )
             except Exception as e:
                 logger.error(f"PDF AI analysis error: {e}")
                 ai_analysis = "Analisi AI non disponibile"
         
-        return {
+        result = {
             "filename": file.filename,
             "stats": stats,
             "ai_analysis": ai_analysis
         }
+        if ai_analysis != "Analisi AI non disponibile":
+            _pdf_analysis_cache[cache_key] = result
+            while len(_pdf_analysis_cache) > PDF_CACHE_MAX_ENTRIES:
+                _pdf_analysis_cache.popitem(last=False)
+        return {**result, "cached": False}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"PDF processing error: {e}")
         raise HTTPException(status_code=500, detail=f"Error processing PDF: {str(e)}")
+    finally:
+        if path:
+            os.unlink(path)
 
 # ==================== MARKET DATA ====================
 
@@ -1215,8 +4414,9 @@ _vix_cache = {"data": None, "timestamp": None}
 def get_yf_ticker_safe(symbol: str, period: str = "5d", interval: str = "1d"):
     """Safely fetch data from yfinance with error handling"""
     try:
-        ticker = yf.Ticker(symbol)
-        hist = ticker.history(period=period, interval=interval)
+        with timed("yfinance"):
+            ticker = yf.Ticker(symbol)
+            hist = ticker.history(period=period, interval=interval)
         if hist.empty:
             return None
         return hist
@@ -1293,8 +4493,7 @@ async def get_vix_data():
             "source": "simulated"
         }
 
-@api_router.get("/market/prices")
-async def get_market_prices():
+async def load_market_prices() -> dict:
     """Get real market prices from Yahoo Finance"""
     global _market_cache
     now = datetime.now(timezone.utc)
@@ -1361,6 +4560,12 @@ async def get_market_prices():
     _market_cache["timestamp"] = now
     return prices
 
+@api_router.get("/market/prices")
+async def get_market_prices(request: Request):
+    prices = await load_market_prices()
+    modified = _market_cache["timestamp"]
+    return conditional_response(request, versioned_payload("market_prices", modified, modified, lambda: prices))
+
 # ==================== MULTI-SOURCE ENGINE (Hourly Analysis) ====================
 
 class AssetAnalysis(BaseModel):
@@ -1542,14 +4747,19 @@ def calculate_multi_source_score(symbol: str, vix_data: dict, prices: dict):
     }
 
 @api_router.get("/analysis/multi-source")
-async def get_multi_source_analysis():
+async def get_multi_source_analysis(request: Request):
     """Get hourly multi-source analysis for all assets"""
     now = datetime.now(timezone.utc)
     
     # Get VIX and prices
     vix_data = await get_vix_data()
-    prices = await get_market_prices()
-    
+    prices = await load_market_prices()
+    version, modified = market_data_version(now)
+    entry = versioned_payload("multi_source", version, modified,
+                              lambda: compute_multi_source_analysis(vix_data, prices, now))
+    return conditional_response(request, entry)
+
+def compute_multi_source_analysis(vix_data: dict, prices: dict, now: datetime) -> dict:
     analyses = {}
     for symbol in ["XAUUSD", "NAS100", "SP500", "EURUSD"]:
         analysis = calculate_multi_source_score(symbol, vix_data, prices)
@@ -1763,10 +4973,14 @@ def generate_cot_data(symbol: str):
     }
 
 @api_router.get("/cot/data")
-async def get_cot_data():
+async def get_cot_data(request: Request):
     """Get COT data for all tracked assets"""
     now = datetime.now(timezone.utc)
-    
+    hour = now.replace(minute=0, second=0, microsecond=0)
+    # Releases are weekly; the countdown has hour resolution
+    return conditional_response(request, versioned_payload("cot_data", hour, hour, lambda: compute_cot_data(now)))
+
+def compute_cot_data(now: datetime) -> dict:
     # Calculate next release
     days_to_friday = (4 - now.weekday()) % 7
     if days_to_friday == 0 and now.hour >= 20:  # After 15:30 ET (20:30 UTC)
@@ -1827,7 +5041,7 @@ MACRO_EVENTS = [
 ]
 
 @api_router.get("/risk/analysis")
-async def get_risk_analysis():
+async def get_risk_analysis(request: Request):
     """
     Comprehensive risk analysis based on:
     1. VIX Level (0-25 points)
@@ -1842,11 +5056,17 @@ async def get_risk_analysis():
     
     # 1. Get VIX data
     vix_data = await get_vix_data()
-    vix_current = vix_data.get("current", 18)
-    vix_change = vix_data.get("change", 0)
     
     # 2. Get market prices
-    prices = await get_market_prices()
+    prices = await load_market_prices()
+    
+    version, modified = market_data_version(now)
+    entry = versioned_payload("risk_analysis", version, modified, lambda: compute_risk_analysis(vix_data, prices, now))
+    return conditional_response(request, entry)
+
+def compute_risk_analysis(vix_data: dict, prices: dict, now: datetime) -> dict:
+    vix_current = vix_data.get("current", 18)
+    vix_change = vix_data.get("change", 0)
     
     # 3. Calculate Component 1: VIX Level (0-25)
     if vix_current >= 30:
@@ -2117,12 +5337,182 @@ async def update_language(language: str, current_user: dict = Depends(get_curren
     await db.users.update_one({"id": current_user["id"]}, {"$set": {"language": language}})
     return {"status": "updated", "language": language}
 
+# ==================== ADMIN PROFILING ====================
+
+# Accounts granted role "admin" at startup. They must already exist and belong to the
+# operator: registration does not verify email ownership, so these addresses cannot register.
+ADMIN_EMAILS = {e.strip().lower() for e in os.environ.get('ADMIN_EMAILS', '').split(',') if e.strip()}
+PROFILE_MAX_SECONDS = 60
+MEMORY_MAX_SNAPSHOTS = 5
+TRACEMALLOC_FRAMES = int(os.environ.get('TRACEMALLOC_FRAMES', 10))
+# Module-level caches reported next to every memory snapshot
+MEMORY_WATCHED_CACHES = (
+    "_multi_source_cache", "demo_users", "demo_data", "_pdf_analysis_cache", "_feed_cache",
+    "_pending_like_deltas", "_versioned_payloads", "_http_latency", "_http_responses", "_dependency_latency",
+)
+
+_profile_lock = asyncio.Lock()
+_memory_snapshots = OrderedDict()
+
+async def get_admin_user(current_user: dict = Depends(get_current_user)) -> dict:
+    if current_user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Accesso riservato agli amministratori")
+    return current_user
+
+async def sync_admin_roles():
+    """Grant role "admin" to the existing ADMIN_EMAILS accounts and revoke it from everyone else"""
+    emails = sorted(ADMIN_EMAILS)
+    await db.users.update_many({"email": {"$in": emails}}, {"$set": {"role": "admin"}})
+    await db.users.update_many({"role": "admin", "email": {"$nin": emails}}, {"$unset": {"role": ""}})
+
+def sample_cpu_profile(seconds: float, interval: float) -> str:
+    """Sample every thread's stack for `seconds`; returns collapsed stacks (flamegraph.pl / speedscope input)"""
+    me = threading.get_ident()
+    names = {t.ident: t.name for t in threading.enumerate()}
+    stacks = Counter()
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == me:
+                continue
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            frames.append(names.get(thread_id, f"thread-{thread_id}"))
+            stacks[";".join(reversed(frames))] += 1
+        time.sleep(interval)
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+def _deep_sizeof(obj, seen: set, budget: List[int]) -> int:
+    """Approximate retained size of a container, bounded by budget[0] visited objects"""
+    if id(obj) in seen or budget[0] <= 0:
+        return 0
+    seen.add(id(obj))
+    budget[0] -= 1
+    size = sys.getsizeof(obj)
+    # list() copies in one C call, so a container mutated by the loop meanwhile cannot break the walk
+    if isinstance(obj, dict):
+        size += sum(_deep_sizeof(k, seen, budget) + _deep_sizeof(v, seen, budget) for k, v in list(obj.items()))
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        size += sum(_deep_sizeof(v, seen, budget) for v in list(obj))
+    return size
+
+def watched_caches() -> Dict[str, Any]:
+    """Shallow copies of MEMORY_WATCHED_CACHES, taken on the loop for cache_sizes' worker thread"""
+    caches = {}
+    for name in MEMORY_WATCHED_CACHES:
+        value = globals().get(name)
+        if name == "_dependency_latency":
+            # Written by Motor's threads too
+            with _metrics_lock:
+                value = dict(value)
+        elif isinstance(value, (dict, list, deque)):
+            value = value.copy()
+        caches[name] = value
+    return caches
+
+def cache_sizes(caches: Dict[str, Any]) -> Dict[str, Any]:
+    """Entry counts and approximate sizes; walks up to 200k objects per cache, so run it in a thread"""
+    sizes = {}
+    for name, value in caches.items():
+        sizes[name] = {
+            "entries": len(value) if hasattr(value, "__len__") else None,
+            "approx_bytes": _deep_sizeof(value, set(), [200_000]),
+        }
+    return sizes
+
+def _snapshot_filters() -> list:
+    return [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap*>")]
+
+def _format_stat(stat) -> dict:
+    frame = stat.traceback[0]
+    return {"file": frame.filename, "line": frame.lineno, "size": stat.size, "count": stat.count,
+            "size_diff": getattr(stat, "size_diff", None), "count_diff": getattr(stat, "count_diff", None)}
+
+@api_router.post("/admin/profile/cpu")
+async def profile_cpu(seconds: float = 10, interval_ms: float = 5, admin: dict = Depends(get_admin_user)):
+    """Sampling CPU profile of this worker as a collapsed-stack file"""
+    if not 0 < seconds <= PROFILE_MAX_SECONDS or not 1 <= interval_ms <= 1000:
+        raise HTTPException(status_code=400, detail=f"seconds in (0, {PROFILE_MAX_SECONDS}], interval_ms in [1, 1000]")
+    if _profile_lock.locked():
+        raise HTTPException(status_code=409, detail="Profilo già in corso")
+    async with _profile_lock:
+        collapsed = await asyncio.to_thread(sample_cpu_profile, seconds, interval_ms / 1000)
+    filename = f"cpu-{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')}.collapsed"
+    return Response(collapsed, media_type="text/plain",
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@api_router.post("/admin/memory/snapshots")
+async def take_memory_snapshot(limit: int = 20, admin: dict = Depends(get_admin_user)):
+    """Start tracemalloc if needed and keep a snapshot for later diffs"""
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    snapshot = (await asyncio.to_thread(tracemalloc.take_snapshot)).filter_traces(_snapshot_filters())
+    snapshot_id = uuid.uuid4().hex[:8]
+    _memory_snapshots[snapshot_id] = snapshot
+    while len(_memory_snapshots) > MEMORY_MAX_SNAPSHOTS:
+        _memory_snapshots.popitem(last=False)
+    current, peak = tracemalloc.get_traced_memory()
+    return {
+        "id": snapshot_id,
+        "snapshots": list(_memory_snapshots),
+        "traced_bytes": current,
+        "peak_bytes": peak,
+        "top": [_format_stat(s) for s in snapshot.statistics("lineno")[:limit]],
+        "caches": await asyncio.to_thread(cache_sizes, watched_caches())
+    }
+
+@api_router.get("/admin/memory/diff")
+async def diff_memory_snapshots(base: str, target: Optional[str] = None, key_type: str = "lineno",
+                                limit: int = 25, admin: dict = Depends(get_admin_user)):
+    """Allocation growth between two snapshots (target defaults to a fresh one)"""
+    if key_type not in ("lineno", "filename", "traceback"):
+        raise HTTPException(status_code=400, detail="key_type: lineno, filename o traceback")
+    if base not in _memory_snapshots or (target and target not in _memory_snapshots):
+        raise HTTPException(status_code=404, detail="Snapshot non trovato")
+    if target:
+        newer = _memory_snapshots[target]
+    elif tracemalloc.is_tracing():
+        newer = (await asyncio.to_thread(tracemalloc.take_snapshot)).filter_traces(_snapshot_filters())
+    else:
+        raise HTTPException(status_code=409, detail="tracemalloc non attivo")
+    stats = await asyncio.to_thread(newer.compare_to, _memory_snapshots[base], key_type)
+    return {
+        "base": base,
+        "target": target,
+        "size_diff": sum(s.size_diff for s in stats),
+        "top": [_format_stat(s) for s in stats[:limit]],
+        "caches": await asyncio.to_thread(cache_sizes, watched_caches())
+    }
+
+@api_router.delete("/admin/memory/snapshots")
+async def clear_memory_snapshots(admin: dict = Depends(get_admin_user)):
+    """Drop snapshots and stop tracemalloc, which slows every allocation while tracing"""
+    _memory_snapshots.clear()
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+    return {"status": "stopped"}
+
 # ==================== ROOT ====================
 
 @api_router.get("/")
 async def root():
     return {"message": "TradingOS API v1.0", "status": "online"}
 
+# Prometheus scrapers authenticate with METRICS_TOKEN; otherwise /metrics is admin-only
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+async def require_metrics_access(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    if METRICS_TOKEN and hmac.compare_digest(credentials.credentials.encode(), METRICS_TOKEN.encode()):
+        return
+    await get_admin_user(await get_current_user(credentials))
+
+@app.get("/metrics", include_in_schema=False, dependencies=[Depends(require_metrics_access)])
+async def metrics():
+    return Response(render_metrics(), media_type="text/plain; version=0.0.4")
+
 # Include router and middleware
 app.include_router(api_router)
 
@@ -2133,10 +5523,41 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Added last so it wraps everything, CORS included
+app.add_middleware(MetricsMiddleware)
+
+@app.on_event("startup")
+async def create_indexes():
+    if not DEMO_MODE:
+        await db.jobs.create_index("id", unique=True)
+        # Startup requeue scans queued jobs by due time
+        await db.jobs.create_index([("status", 1), ("run_after", 1)])
+        await db.ai_conversations.create_index("id", unique=True)
+        await db.engine_states.create_index("user_id", unique=True)
+        await db.psychology_checkins.create_index([("user_id", 1), ("date", 1)])
+        await db.psychology_eod.create_index([("user_id", 1), ("date", 1)])
+        await db.psychology_report_cache.create_index([("user_id", 1), ("period", 1), ("bucket", 1)], unique=True)
+        await db.community_posts.create_index([("created_at", -1), ("id", -1)])
+        await db.post_likes.create_index([("post_id", 1), ("user_id", 1)], unique=True)
+        await db.community_comments.create_index([("post_id", 1), ("created_at", -1), ("id", -1)])
+        await db.community_comments.create_index("id", unique=True)
+        await migrate_embedded_comments()
+        await sync_admin_roles()
+
+@app.on_event("startup")
+async def start_background_workers():
+    loop_monitor.start()
+    if not DEMO_MODE:
+        await start_job_workers()
+        start_like_flusher()
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await loop_monitor.stop()
+    await stop_job_workers()
+    await asyncio.to_thread(_llm_cache.flush)
     if not DEMO_MODE:
+        await stop_like_flusher()
         client.close()
 
 if __name__ == "__main__":
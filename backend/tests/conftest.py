@@ -0,0 +1,24 @@
+"""
+Shared fixtures for the offline backend tests
+"""
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+os.environ.setdefault("LLM_CACHE_PATH", "")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import server  # noqa: E402
+
+
+@pytest.fixture
+def mongo_db(monkeypatch):
+    """Point server.db at a fresh in-memory Mongo (mongomock-motor) for one test"""
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    client = mongomock_motor.AsyncMongoMockClient()
+    monkeypatch.setattr(server, "client", client, raising=False)
+    monkeypatch.setattr(server, "db", client["karion_test"])
+    monkeypatch.setattr(server, "DEMO_MODE", False)
+    return server.db
@@ -0,0 +1,122 @@
+"""
+Karion admin profiling tests
+CPU sampling profile and tracemalloc snapshot diffs, with the admin gate
+"""
+import asyncio
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+
+ADMIN = {"id": "admin-1", "email": "ops@karion.app", "name": "Ops", "role": "admin"}
+
+
+@pytest.fixture
+def client():
+    server.app.dependency_overrides[server.get_current_user] = lambda: ADMIN
+    yield TestClient(server.app)
+    server.app.dependency_overrides.clear()
+    server._memory_snapshots.clear()
+    if server.tracemalloc.is_tracing():
+        server.tracemalloc.stop()
+
+
+def spin_for_profile(stop: threading.Event):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+class TestAdminProfiling:
+    """Admin-only diagnostics"""
+
+    def test_requires_admin(self, client):
+        """Test a regular user gets 403"""
+        server.app.dependency_overrides[server.get_current_user] = lambda: {**ADMIN, "role": "user"}
+        assert client.post("/api/admin/profile/cpu?seconds=0.1").status_code == 403
+        assert client.post("/api/admin/memory/snapshots").status_code == 403
+
+    def test_cpu_profile_is_collapsed_stacks(self, client):
+        """Test the profile names the busy function, in 'frame;frame count' lines"""
+        stop = threading.Event()
+        worker = threading.Thread(target=spin_for_profile, args=(stop,), name="spinner")
+        worker.start()
+        try:
+            response = client.post("/api/admin/profile/cpu?seconds=0.3&interval_ms=2")
+        finally:
+            stop.set()
+            worker.join()
+        assert response.status_code == 200
+        assert response.headers["content-disposition"].endswith('.collapsed"')
+        lines = response.text.splitlines()
+        assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+        spinner = [line for line in lines if line.startswith("spinner;")]
+        assert spinner and any("spin_for_profile (test_admin.py:" in line for line in spinner)
+
+    def test_memory_diff_finds_cache_growth(self, client, monkeypatch):
+        """Test growth of a module-level cache shows up in the diff and in the cache sizes"""
+        monkeypatch.setattr(server, "_multi_source_cache", {})
+        base = client.post("/api/admin/memory/snapshots").json()
+        assert base["caches"]["_multi_source_cache"]["entries"] == 0
+
+        for i in range(20000):
+            server._multi_source_cache[f"SYMBOL{i}_prev_score"] = i * 0.5
+
+        diff = client.get(f"/api/admin/memory/diff?base={base['id']}&limit=5").json()
+        assert diff["size_diff"] > 500_000
+        assert diff["top"][0]["file"].endswith("test_admin.py")
+        assert diff["caches"]["_multi_source_cache"]["entries"] == 20000
+        assert client.get("/api/admin/memory/diff?base=missing").status_code == 404
+        assert client.delete("/api/admin/memory/snapshots").json() == {"status": "stopped"}
+        assert not server.tracemalloc.is_tracing()
+
+
+    def test_cache_sizes_walk_copies_off_the_loop(self, client, monkeypatch):
+        """Test the size walk runs in the loop's worker threads over copies, not the live caches"""
+        threads = []
+        deep_sizeof = server._deep_sizeof
+
+        def recording_sizeof(obj, seen, budget):
+            threads.append(threading.current_thread().name)
+            return deep_sizeof(obj, seen, budget)
+
+        monkeypatch.setattr(server, "_deep_sizeof", recording_sizeof)
+        monkeypatch.setattr(server, "_multi_source_cache", {"EURUSD_prev_score": 1.0})
+        caches = server.watched_caches()
+        assert caches["_multi_source_cache"] == server._multi_source_cache
+        assert caches["_multi_source_cache"] is not server._multi_source_cache
+        assert caches["_dependency_latency"] is not server._dependency_latency
+
+        response = client.post("/api/admin/memory/snapshots")
+        assert response.json()["caches"]["_multi_source_cache"]["entries"] == 1
+        # asyncio.to_thread runs on the loop's default executor
+        assert threads and all(name.startswith("asyncio_") for name in threads)
+
+
+class TestAdminRoles:
+    """The admin role lives on the user document; ADMIN_EMAILS only grants it at startup"""
+
+    def test_admin_email_cannot_register(self, mongo_db, monkeypatch):
+        """Test an ADMIN_EMAILS address is refused at registration, whatever its case"""
+        monkeypatch.setattr(server, "ADMIN_EMAILS", {"ops@karion.app"})
+        response = TestClient(server.app).post("/api/auth/register", json={
+            "email": "Ops@karion.app", "password": "password123", "name": "Ops"})
+        assert response.status_code == 400
+        assert asyncio.run(mongo_db.users.count_documents({})) == 0
+
+    def test_sync_grants_and_revokes(self, mongo_db, monkeypatch):
+        """Test existing listed accounts get the role and unlisted admins lose it"""
+        monkeypatch.setattr(server, "ADMIN_EMAILS", {"ops@karion.app"})
+        asyncio.run(mongo_db.users.insert_many([
+            {"id": "admin-1", "email": "ops@karion.app"},
+            {"id": "admin-0", "email": "former@karion.app", "role": "admin"},
+            {"id": "trader-1", "email": "trader@karion.app"},
+        ]))
+        asyncio.run(server.sync_admin_roles())
+        users = asyncio.run(mongo_db.users.find({}, {"_id": 0}).sort("id", 1).to_list(10))
+        assert [(u["id"], u.get("role")) for u in users] == [("admin-0", None), ("admin-1", "admin"), ("trader-1", None)]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
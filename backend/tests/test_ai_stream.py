@@ -0,0 +1,164 @@
+"""
+Karion AI streaming tests
+Runs llm_stream against a local fake OpenAI-compatible server (no network, no API key)
+"""
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+
+USER = {"id": "trader-1", "email": "trader@karion.app", "name": "Trader"}
+FAKE_TOKENS = ["Ciao", " trader", ",", " respira", " e", " segui", " il", " piano."]
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    """Streams FAKE_TOKENS as chat.completion.chunk events, slowly enough to disconnect mid-stream"""
+
+    token_delay = 0.0
+    repeat = 1
+    disconnected = threading.Event()
+    requests_seen = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        FakeLLMHandler.requests_seen.append(json.loads(body))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        try:
+            for _ in range(self.repeat):
+                for token in FAKE_TOKENS:
+                    chunk = {"choices": [{"delta": {"content": token}}]}
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                    self.wfile.flush()
+                    time.sleep(self.token_delay)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            FakeLLMHandler.disconnected.set()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), FakeLLMHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    FakeLLMHandler.token_delay = 0.0
+    FakeLLMHandler.repeat = 1
+    FakeLLMHandler.disconnected.clear()
+    FakeLLMHandler.requests_seen.clear()
+    monkeypatch.setattr(server, "LLM_STREAM_URL", f"http://127.0.0.1:{httpd.server_port}/v1")
+    monkeypatch.setattr(server, "_llm_cache", server.LLMResponseCache(None, 100, 60))
+    yield FakeLLMHandler
+    httpd.shutdown()
+    httpd.server_close()
+
+
+class TestLLMStream:
+    """Token streaming through the LLM gateway"""
+
+    def test_tokens_arrive_in_order_and_are_cached(self, fake_llm):
+        """Test llm_stream forwards every delta and caches the completed text"""
+        async def collect():
+            return [t async for t in server.llm_stream("system", "ciao", session_id="test")]
+
+        tokens = asyncio.run(collect())
+        assert tokens == FAKE_TOKENS
+        assert fake_llm.requests_seen[0]["stream"] is True
+        assert fake_llm.requests_seen[0]["messages"][1]["content"] == "ciao"
+
+        # Second identical request is served from the cache without hitting the server
+        tokens = asyncio.run(collect())
+        assert tokens == ["".join(FAKE_TOKENS)]
+        assert len(fake_llm.requests_seen) == 1
+        assert server._llm_cache.stats()["hits"] == 1
+
+    def test_disconnect_cancels_upstream(self, fake_llm):
+        """Test closing the stream early closes the upstream connection"""
+        fake_llm.token_delay = 0.05
+        fake_llm.repeat = 20
+
+        async def consume_two():
+            stream = server.llm_stream("system", "lungo", session_id="test")
+            received = [await stream.__anext__(), await stream.__anext__()]
+            await stream.aclose()
+            return received
+
+        assert asyncio.run(consume_two()) == FAKE_TOKENS[:2]
+        assert fake_llm.disconnected.wait(timeout=5)
+        # A cancelled stream must not be cached as a full answer
+        assert server._llm_cache.stats()["entries"] == 0
+
+    def test_fallback_without_stream_url(self, monkeypatch):
+        """Test llm_stream yields one chunk from llm_complete when streaming is not configured"""
+        async def fake_complete(system_message, text, session_id, use_cache=True):
+            return "risposta completa"
+
+        monkeypatch.setattr(server, "LLM_STREAM_URL", "")
+        monkeypatch.setattr(server, "llm_complete", fake_complete)
+
+        async def collect():
+            return [t async for t in server.llm_stream("system", "ciao", session_id="test")]
+
+        assert asyncio.run(collect()) == ["risposta completa"]
+
+
+def sse_events(body: str) -> list:
+    """Split an SSE body into (event, data) pairs; plain data frames have event None"""
+    events = []
+    for frame in body.split("\n\n"):
+        if not frame:
+            continue
+        fields = dict(line.split(": ", 1) for line in frame.split("\n"))
+        events.append((fields.get("event"), json.loads(fields["data"])))
+    return events
+
+
+@pytest.fixture
+def api(mongo_db):
+    server.app.dependency_overrides[server.get_current_user] = lambda: USER
+    yield TestClient(server.app)
+    server.app.dependency_overrides.clear()
+
+
+class TestChatStreamEndpoint:
+    """/ai/chat/stream event framing"""
+
+    def test_tokens_then_done(self, api, fake_llm, mongo_db):
+        """Test every token is one data frame and done carries the stored conversation id"""
+        response = api.post("/api/ai/chat/stream", json={"messages": [{"role": "user", "content": "ciao"}]})
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+
+        events = sse_events(response.text)
+        assert [data["token"] for event, data in events[:-1]] == FAKE_TOKENS
+        assert all(event is None for event, _ in events[:-1])
+        event, data = events[-1]
+        assert event == "done"
+        conversation = asyncio.run(mongo_db.ai_conversations.find_one({"id": data["conversation_id"]}))
+        assert [t["content"] for t in conversation["turns"]] == ["ciao", "".join(FAKE_TOKENS)]
+
+    def test_upstream_failure_after_tokens(self, api, mongo_db, monkeypatch):
+        """Test a failure mid-stream ends with an error event, no done and nothing stored"""
+        async def failing_stream(system_message, text, session_id):
+            yield "Ciao"
+            raise RuntimeError("upstream chiuso")
+
+        monkeypatch.setattr(server, "EMERGENT_LLM_KEY", "test-key")
+        monkeypatch.setattr(server, "llm_stream", failing_stream)
+        response = api.post("/api/ai/chat/stream", json={"messages": [{"role": "user", "content": "ciao"}]})
+        assert sse_events(response.text) == [(None, {"token": "Ciao"}), ("error", {"error": "upstream chiuso"})]
+        assert asyncio.run(mongo_db.ai_conversations.count_documents({"turn_count": {"$gt": 0}})) == 0
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
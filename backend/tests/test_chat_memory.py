@@ -0,0 +1,142 @@
+"""
+Karion chat memory tests
+Conversation ownership, concurrent appends, summary folding and prompt budgeting on an in-memory store
+"""
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+
+ALICE = {"id": "alice", "email": "alice@karion.app"}
+BOB = {"id": "bob", "email": "bob@karion.app"}
+
+
+def chat_request(text: str, conversation_id=None, history=()) -> server.AIChatRequest:
+    messages = [{"role": role, "content": content} for role, content in history] + [{"role": "user", "content": text}]
+    return server.AIChatRequest(messages=messages, conversation_id=conversation_id)
+
+
+def stored(conversation_id: str) -> dict:
+    return asyncio.run(server.db.ai_conversations.find_one({"id": conversation_id}, {"_id": 0}))
+
+
+@pytest.fixture
+def api(mongo_db, monkeypatch):
+    async def fake_complete(system_message, text, session_id, use_cache=True):
+        return f"risposta {len(text)}"
+
+    monkeypatch.setattr(server, "EMERGENT_LLM_KEY", "test-key")
+    monkeypatch.setattr(server, "llm_complete", fake_complete)
+    client = TestClient(server.app)
+    yield client
+    server.app.dependency_overrides.clear()
+
+
+def post_as(api, user, body):
+    server.app.dependency_overrides[server.get_current_user] = lambda: user
+    return api.post("/api/ai/chat", json=body).json()
+
+
+class TestConversationOwnership:
+    """A conversation id only ever refers to its owner's document"""
+
+    def test_foreign_id_starts_a_new_conversation(self, api):
+        """Test posting with another user's conversation_id neither reads nor overwrites it"""
+        first = post_as(api, ALICE, {"messages": [{"role": "user", "content": "ciao da alice"}]})
+        alice_id = first["conversation_id"]
+
+        hijack = post_as(api, BOB, {"messages": [{"role": "user", "content": "ciao da bob"}], "conversation_id": alice_id})
+        assert hijack["conversation_id"] != alice_id
+        assert hijack["context"]["turns_stored"] == 0
+
+        alice = stored(alice_id)
+        assert alice["user_id"] == "alice"
+        assert [t["content"] for t in alice["turns"]] == ["ciao da alice", first["response"]]
+        assert stored(hijack["conversation_id"])["user_id"] == "bob"
+
+    def test_own_id_continues_the_conversation(self, api):
+        first = post_as(api, ALICE, {"messages": [{"role": "user", "content": "primo"}]})
+        second = post_as(api, ALICE, {"messages": [{"role": "user", "content": "secondo"}], "conversation_id": first["conversation_id"]})
+        assert second["conversation_id"] == first["conversation_id"]
+        assert second["context"]["turns_stored"] == 2
+        assert stored(first["conversation_id"])["turn_count"] == 4
+
+
+class TestAppendTurns:
+    """Compare-and-swap appends"""
+
+    def test_concurrent_appends_keep_both_exchanges(self, mongo_db):
+        """Test two messages appended from the same snapshot are both stored"""
+        async def scenario():
+            conversation = await server.load_conversation("alice", chat_request("ciao"))
+            copy_a = await server.load_conversation("alice", chat_request("a", conversation["id"]))
+            copy_b = await server.load_conversation("alice", chat_request("b", conversation["id"]))
+            await asyncio.gather(
+                server.append_conversation_turns(copy_a, "domanda a", "risposta a"),
+                server.append_conversation_turns(copy_b, "domanda b", "risposta b"),
+            )
+            return conversation["id"]
+
+        doc = stored(asyncio.run(scenario()))
+        contents = [t["content"] for t in doc["turns"]]
+        assert sorted(contents) == ["domanda a", "domanda b", "risposta a", "risposta b"]
+        assert (doc["turn_count"], doc["version"]) == (4, 2)
+
+    def test_legacy_document_without_version(self, mongo_db):
+        """Test conversations stored before versioning still accept appends"""
+        asyncio.run(mongo_db.ai_conversations.insert_one(
+            {"id": "old", "user_id": "alice", "summary": "", "turns": [], "turn_count": 0}))
+
+        async def scenario():
+            conversation = await server.load_conversation("alice", chat_request("x", "old"))
+            await server.append_conversation_turns(conversation, "ciao", "ciao a te")
+
+        asyncio.run(scenario())
+        assert (stored("old")["turn_count"], stored("old")["version"]) == (2, 1)
+
+    def test_old_turns_fold_into_summary(self, mongo_db, monkeypatch):
+        """Test turns beyond CHAT_MAX_STORED_TURNS move into the summary"""
+        monkeypatch.setattr(server, "CHAT_MAX_STORED_TURNS", 4)
+
+        async def scenario():
+            conversation = await server.load_conversation("alice", chat_request("inizio"))
+            for i in range(3):
+                conversation = await server.load_conversation("alice", chat_request(f"m{i}", conversation["id"]))
+                await server.append_conversation_turns(conversation, f"domanda {i}", f"risposta {i}")
+            return conversation["id"]
+
+        doc = stored(asyncio.run(scenario()))
+        assert [t["content"] for t in doc["turns"]] == ["domanda 1", "risposta 1", "domanda 2", "risposta 2"]
+        assert doc["summary"] == "- Utente: domanda 0\n- Karion: risposta 0"
+        assert doc["turn_count"] == 6
+
+    def test_conflict_reaches_the_client(self, api, monkeypatch):
+        """Test a lost append is answered with 409 instead of an error reply"""
+        async def always_conflict(conversation, user_message, response):
+            raise server.HTTPException(status_code=409, detail="Conversazione modificata, riprova")
+
+        monkeypatch.setattr(server, "append_conversation_turns", always_conflict)
+        server.app.dependency_overrides[server.get_current_user] = lambda: ALICE
+        response = api.post("/api/ai/chat", json={"messages": [{"role": "user", "content": "ciao"}]})
+        assert response.status_code == 409
+
+
+class TestChatPrompt:
+    """Token-budgeted prompt assembly"""
+
+    def test_recent_turns_fit_the_budget(self):
+        turns = [{"role": "user" if i % 2 == 0 else "assistant", "content": "x" * 200} for i in range(20)]
+        prompt, stats = server.build_chat_prompt("- Utente: prima", turns, "nuovo", budget=300)
+        assert stats["prompt_tokens"] <= 300
+        assert 0 < stats["turns_included"] < 20
+        assert prompt.startswith("Riassunto della conversazione precedente:")
+        assert prompt.endswith("Nuovo messaggio dell'utente:\nnuovo")
+
+    def test_first_message_is_sent_alone(self):
+        assert server.build_chat_prompt("", [], "ciao")[0] == "ciao"
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,121 @@
+"""
+Karion community tests
+Feed head cache invalidation and the embedded comments migration, offline
+"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import server
+
+USER = {"id": "trader-1", "email": "trader@karion.app", "name": "Trader"}
+
+
+def create_post(caption: str) -> dict:
+    return asyncio.run(server.create_post(server.CommunityPostCreate(caption=caption), current_user=USER)).model_dump()
+
+
+@pytest.fixture
+def feed(mongo_db, monkeypatch):
+    monkeypatch.setattr(server, "_feed_cache", None)
+    return mongo_db
+
+
+class TestFeedCache:
+    """load_feed_head / invalidate_feed"""
+
+    def test_cached_until_new_post(self, feed):
+        """Test the head is served from memory and reloaded after a new post"""
+        create_post("primo")
+        assert [p["caption"] for p in asyncio.run(server.load_feed_head())] == ["primo"]
+        asyncio.run(feed.community_posts.delete_many({}))
+        assert [p["caption"] for p in asyncio.run(server.load_feed_head())] == ["primo"]
+
+        create_post("secondo")
+        assert [p["caption"] for p in asyncio.run(server.load_feed_head())] == ["secondo"]
+
+    def test_post_created_during_reload_is_not_lost(self, feed, monkeypatch):
+        """Test a reload that raced an invalidation is served once but not stored"""
+        create_post("primo")
+        posts = feed.community_posts
+
+        class PostCreatedDuringQuery:
+            def __init__(self, cursor):
+                self.cursor = cursor
+
+            def sort(self, *args, **kwargs):
+                self.cursor = self.cursor.sort(*args, **kwargs)
+                return self
+
+            async def to_list(self, length):
+                result = await self.cursor.to_list(length)
+                # The query has read its snapshot; a new post lands before it returns
+                monkeypatch.setattr(server, "db", SimpleNamespace(community_posts=posts))
+                await server.create_post(server.CommunityPostCreate(caption="secondo"), current_user=USER)
+                return result
+
+        class Posts:
+            def __getattr__(self, name):
+                return getattr(posts, name)
+
+            def find(self, *args, **kwargs):
+                return PostCreatedDuringQuery(posts.find(*args, **kwargs))
+
+        monkeypatch.setattr(server, "db", SimpleNamespace(community_posts=Posts()))
+        assert [p["caption"] for p in asyncio.run(server.load_feed_head())] == ["primo"]
+        assert server._feed_cache is None
+        assert [p["caption"] for p in asyncio.run(server.load_feed_head())] == ["secondo", "primo"]
+
+    def test_disabled_with_several_workers(self, feed, monkeypatch):
+        """Test every read goes to MongoDB when another worker could have added a post"""
+        monkeypatch.setattr(server, "FEED_CACHE_ENABLED", False)
+        create_post("primo")
+        assert [p["caption"] for p in asyncio.run(server.load_feed_head())] == ["primo"]
+        # Inserted by another worker: no invalidation reaches this process
+        asyncio.run(feed.community_posts.insert_one(
+            server.CommunityPost(user_id="u2", user_name="U2", caption="altrove").model_dump()))
+        assert [p["caption"] for p in asyncio.run(server.load_feed_head())] == ["altrove", "primo"]
+        assert server._feed_cache is None
+
+
+class TestCommentMigration:
+    """Legacy CommunityPost.comments arrays moved to community_comments"""
+
+    def test_rerun_after_crash_is_idempotent(self, mongo_db, monkeypatch):
+        """Test a migration interrupted after copying comments, then run twice, leaves one copy of each"""
+        legacy = [{"user_id": f"u{i}", "user_name": f"U{i}", "text": f"commento {i}",
+                   "created_at": f"2024-01-0{i + 1}T10:00:00+00:00"} for i in range(4)]
+        asyncio.run(mongo_db.community_posts.insert_one(
+            {"id": "p1", "user_id": "u0", "caption": "ciao", "created_at": "2024-01-01T09:00:00+00:00", "comments": legacy}))
+
+        posts = mongo_db.community_posts
+
+        class CrashesBeforeUnset:
+            def __getattr__(self, name):
+                return getattr(posts, name)
+
+            async def update_one(self, *args, **kwargs):
+                raise RuntimeError("connection lost")
+
+        monkeypatch.setattr(server, "db", SimpleNamespace(community_posts=CrashesBeforeUnset(),
+                                                          community_comments=mongo_db.community_comments))
+        with pytest.raises(RuntimeError):
+            asyncio.run(server.migrate_embedded_comments())
+        assert asyncio.run(mongo_db.community_comments.count_documents({})) == 4
+
+        monkeypatch.setattr(server, "db", mongo_db)
+        asyncio.run(server.migrate_embedded_comments())
+        asyncio.run(server.migrate_embedded_comments())
+
+        comments = asyncio.run(mongo_db.community_comments.find({}, {"_id": 0}).sort("created_at", 1).to_list(10))
+        assert [c["id"] for c in comments] == ["p1:0", "p1:1", "p1:2", "p1:3"]
+        assert [c["text"] for c in comments] == [c["text"] for c in legacy]
+        post = asyncio.run(mongo_db.community_posts.find_one({"id": "p1"}, {"_id": 0}))
+        assert "comments" not in post
+        assert post["comment_count"] == 4
+        assert [c["id"] for c in post["latest_comments"]] == ["p1:1", "p1:2", "p1:3"]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,176 @@
+"""
+Karion Shark Mind engine state tests
+Sliding window expiry and streaks, version-checked saves, rule hit counting and
+window replay in the backtest, offline
+"""
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+
+USER = {"id": "trader-1", "email": "trader@karion.app", "name": "Trader"}
+
+
+def tilt(day: str) -> tuple:
+    return day, [{"pattern_id": "TILT_RISK"}]
+
+
+def eod_request(day: str, revenge: bool = True) -> dict:
+    # REVENGE with high stress but limits respected: TILT_RISK medium, NORMAL on its own
+    return {
+        "eod_psych": {
+            "date": day,
+            "stress_1_10": 8,
+            "focus_1_10": 8,
+            "energy_1_10": 6,
+            "physical_tension_1_10": 5,
+            "urge_to_trade_0_10": 3,
+            "behaviors": {"limits_respected": True},
+            "triggers_selected": ["REVENGE"] if revenge else [],
+        }
+    }
+
+
+@pytest.fixture
+def api(mongo_db):
+    server.app.dependency_overrides[server.get_current_user] = lambda: USER
+    yield TestClient(server.app)
+    server.app.dependency_overrides.clear()
+
+
+class TestEngineWindow:
+    """push_engine_window bookkeeping"""
+
+    def test_streak_and_expiry(self):
+        """Test consecutive tilt days build a streak and days older than the window are evicted"""
+        state = server.default_engine_state("u")
+        for day, patterns in (tilt("2025-01-01"), tilt("2025-01-02"), tilt("2025-01-03")):
+            server.push_engine_window(state, day, patterns)
+        assert [e["tilt_streak"] for e in state["window"]] == [1, 2, 3]
+        assert state["counts"]["TILT_RISK"] == 3
+
+        server.push_engine_window(state, "2025-01-09", [{"pattern_id": "OVERTRADING"}])
+        assert [e["date"] for e in state["window"]] == ["2025-01-03", "2025-01-09"]
+        assert state["counts"] == {"TILT_RISK": 1, "OVERTRADING": 1}
+        assert state["window"][-1]["tilt_streak"] == 0
+
+    def test_resubmitted_day_replaces_entry(self):
+        """Test re-submitting a day swaps its flags and recomputes later streaks"""
+        state = server.default_engine_state("u")
+        for day, patterns in (tilt("2025-01-01"), tilt("2025-01-02"), tilt("2025-01-03")):
+            server.push_engine_window(state, day, patterns)
+        server.push_engine_window(state, "2025-01-02", [])
+        assert [e["tilt_streak"] for e in state["window"]] == [1, 0, 1]
+        assert state["counts"]["TILT_RISK"] == 2
+
+
+class TestEngineStateSave:
+    """Version-checked engine state writes"""
+
+    def test_stale_version_is_rejected(self, mongo_db):
+        """Test a save from a copy loaded before another write loses the version check"""
+        async def run():
+            await server.save_engine_state(server.default_engine_state(USER["id"]))
+            first = await server.load_engine_state(USER["id"])
+            second = await server.load_engine_state(USER["id"])
+            assert await server.save_engine_state(first)
+            assert not await server.save_engine_state(second)
+            return await server.load_engine_state(USER["id"])
+        assert asyncio.run(run())["version"] == 2
+
+    def test_conflict_retry_counts_hits_once(self, api, mongo_db, monkeypatch):
+        """Test a lost version check re-evaluates without counting the rule hits twice"""
+        save = server.save_engine_state
+        calls = []
+
+        async def conflict_once(state):
+            calls.append(state["version"])
+            return len(calls) > 1 and await save(state)
+
+        monkeypatch.setattr(server, "save_engine_state", conflict_once)
+        hits = server._shark_rules.hits
+        before = dict(hits)
+        response = api.post("/api/psychology/eod", json=eod_request("2025-01-01"))
+        assert response.status_code == 200
+        assert len(calls) == 2
+        assert hits.get("pattern:TILT_RISK", 0) == before.get("pattern:TILT_RISK", 0) + 1
+        assert hits.get("mode:NORMAL", 0) == before.get("mode:NORMAL", 0) + 1
+
+        state = asyncio.run(server.load_engine_state(USER["id"]))
+        assert (state["version"], len(state["window"])) == (1, 1)
+
+    def test_retries_exhausted(self, api, monkeypatch):
+        """Test the endpoint answers 409 when every version check is lost"""
+        async def always_conflict(state):
+            return False
+
+        monkeypatch.setattr(server, "save_engine_state", always_conflict)
+        assert api.post("/api/psychology/eod", json=eod_request("2025-01-01")).status_code == 409
+
+
+class TestResubmission:
+    """Re-submitting a day replaces its progression and its stored analysis"""
+
+    @staticmethod
+    def calm_day(day: str, limits_respected: bool = True) -> dict:
+        return {"eod_psych": {"date": day, "stress_1_10": 2, "focus_1_10": 9, "energy_1_10": 8,
+                              "physical_tension_1_10": 2, "urge_to_trade_0_10": 1,
+                              "behaviors": {"limits_respected": limits_respected, "shutdown_ritual_done": True,
+                                            "breaks_taken": True}}}
+
+    def test_readiness_and_xp_count_once_per_day(self, api, mongo_db):
+        """Test resubmitting a good day does not keep raising readiness or XP"""
+        asyncio.run(mongo_db.users.insert_one({**USER, "xp": 0}))
+        for _ in range(4):
+            body = api.post("/api/psychology/eod", json=self.calm_day("2025-01-01")).json()
+            assert body["readiness"]["confidence_readiness_0_100"] == 5
+        body = api.post("/api/psychology/eod", json=self.calm_day("2025-01-02")).json()
+        assert body["readiness"]["confidence_readiness_0_100"] == 10
+
+        assert asyncio.run(mongo_db.psychology_eod.count_documents({"user_id": USER["id"]})) == 2
+        assert asyncio.run(mongo_db.users.find_one({"id": USER["id"]}))["xp"] == 40
+
+    def test_grace_token_restored_by_corrected_day(self, api):
+        """Test correcting a day with broken limits gives its grace token back"""
+        assert api.post("/api/psychology/eod", json=self.calm_day("2025-01-01", False)).json()[
+            "data_updates"]["grace_tokens_remaining"] == 2
+        assert api.post("/api/psychology/eod", json=self.calm_day("2025-01-01", False)).json()[
+            "data_updates"]["grace_tokens_remaining"] == 2
+        assert api.post("/api/psychology/eod", json=self.calm_day("2025-01-01")).json()[
+            "data_updates"]["grace_tokens_remaining"] == 3
+
+    def test_day_older_than_window_does_not_progress(self, api):
+        """Test a backdated day outside the window cannot be replayed to farm readiness"""
+        api.post("/api/psychology/eod", json=self.calm_day("2025-01-20"))
+        for _ in range(3):
+            body = api.post("/api/psychology/eod", json=self.calm_day("2025-01-01")).json()
+        assert body["readiness"]["confidence_readiness_0_100"] == 5
+
+
+class TestBacktestWindowReplay:
+    """Window-stage rules in the batch path"""
+
+    def test_backtest_matches_stored_modes(self, api):
+        """Test a tilt streak raising TILT_LOCK live is reproduced by the backtest"""
+        days = ["2025-01-01", "2025-01-02", "2025-01-03", "2025-01-04"]
+        stored = [api.post("/api/psychology/eod", json=eod_request(d, revenge=d != "2025-01-04")).json() for d in days]
+        assert [r["tomorrow_protocol"]["mode"] for r in stored] == ["NORMAL", "NORMAL", "TILT_LOCK", "NORMAL"]
+
+        body = api.post("/api/psychology/eod/backtest?include_rows=true").json()
+        assert body["mode_changes"] == 0
+        assert [r["mode"] for r in body["rows"]] == ["NORMAL", "NORMAL", "TILT_LOCK", "NORMAL"]
+        assert body["summary"]["pattern_counts"]["TILT_STREAK"] == 2
+
+    def test_replay_follows_window_expiry(self):
+        """Test overtrading days only count towards OVERTRADING_WEEK while inside the window"""
+        requests = [{**eod_request(d, revenge=False), "journal_telemetry": {"overtrading_detected": True}}
+                    for d in ("2025-01-01", "2025-01-02", "2025-01-09", "2025-01-10", "2025-01-11")]
+        days = [r["eod_psych"]["date"] for r in requests]
+        batch = server.score_eod_batch(server.eod_requests_to_columns(requests), days=days)
+        assert batch["patterns"]["OVERTRADING_WEEK"].tolist() == [False, False, False, False, True]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,145 @@
+"""
+Karion feature store tests
+Rolling 7/30/90-day windows, retention, and idempotent EOD resubmission on an in-memory store
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+
+USER = {"id": "trader-1", "email": "trader@karion.app", "name": "Trader"}
+TODAY = "2026-03-31"
+
+
+def day(age: int, today: str = TODAY) -> str:
+    return (datetime.strptime(today, "%Y-%m-%d") - timedelta(days=age)).strftime("%Y-%m-%d")
+
+
+def eod_body(date: str, stress: int, triggers=()) -> dict:
+    return {"eod_psych": {
+        "date": date, "stress_1_10": stress, "focus_1_10": 6, "energy_1_10": 6, "physical_tension_1_10": 4,
+        "urge_to_trade_0_10": 9 if triggers else 2, "triggers_selected": list(triggers),
+    }}
+
+
+@pytest.fixture
+def api(mongo_db):
+    server.app.dependency_overrides[server.get_current_user] = lambda: USER
+    yield TestClient(server.app)
+    server.app.dependency_overrides.clear()
+
+
+class TestFeatureWindows:
+    """compute_feature_windows"""
+
+    def test_days_fall_into_windows_by_age(self):
+        """Test window boundaries (age < w), expiry at retention, and averages"""
+        days = {
+            day(0): {"eod": {"n": 1, "stress": 8}, "patterns": {"FOMO_LOOP": 1}},
+            day(6): {"eod": {"n": 1, "stress": 4}},
+            day(7): {"trades": {"n": 2, "wins": 1, "pnl": 30.5, "r": 1.0}},
+            day(29): {"checkin": {"n": 2, "confidence": 14, "discipline": 10, "sleep_hours": 13, "sleep_quality": 12}},
+            day(89): {"journal": {"n": 3}},
+            day(90): {"journal": {"n": 100}},
+        }
+        windows, expired = server.compute_feature_windows(days, TODAY)
+        assert expired == [day(90)]
+
+        week = windows["7d"]
+        assert (week["eod_days"], week["avg_stress"], week["trades"], week["checkins"]) == (2, 6.0, 0, 0)
+        assert (week["pattern_counts"], week["pattern_rate"]) == ({"FOMO_LOOP": 1}, {"FOMO_LOOP": 0.5})
+
+        month = windows["30d"]
+        assert (month["trades"], month["win_rate"], month["total_pnl"], month["avg_r"]) == (2, 50.0, 30.5, 0.5)
+        assert (month["checkins"], month["avg_confidence"], month["avg_sleep_hours"]) == (2, 7.0, 6.5)
+        assert month["journal_entries"] == 0
+        assert windows["90d"]["journal_entries"] == 3
+
+    def test_empty_and_future_days(self):
+        """Test empty input gives zeroed windows and future-dated days are ignored"""
+        windows, expired = server.compute_feature_windows({"2026-04-02": {"eod": {"n": 1, "stress": 9}}}, TODAY)
+        assert expired == []
+        assert all(w["eod_days"] == 0 and w["pattern_rate"] == {} for w in windows.values())
+
+
+class TestRecordFeatures:
+    """Incremental writes to the feature document"""
+
+    def test_replace_groups_are_idempotent_per_day(self, mongo_db):
+        """Test rewriting a day replaces eod/patterns while other groups keep accumulating"""
+        today = server.feature_day()
+
+        async def scenario():
+            await server.record_user_features("u", today, {"eod.n": 1, "eod.stress": 9, "patterns.TILT_RISK": 1},
+                                              replace_groups=server.FEATURE_DAILY_GROUPS)
+            await server.record_user_features("u", today, {"trades.n": 1, "trades.pnl": 10})
+            await server.record_user_features("u", today, {"eod.n": 1, "eod.stress": 3},
+                                              replace_groups=server.FEATURE_DAILY_GROUPS)
+            await server.record_user_features("u", today, {"trades.n": 1, "trades.pnl": 5})
+            return await server.get_user_features("u")
+
+        doc = asyncio.run(scenario())
+        assert doc["days"][today] == {"eod": {"n": 1, "stress": 3}, "patterns": {}, "trades": {"n": 2, "pnl": 15}}
+        week = doc["windows"]["7d"]
+        assert (week["eod_days"], week["avg_stress"], week["pattern_counts"], week["trades"]) == (1, 3.0, {}, 2)
+
+    def test_overlapping_writes_keep_newest_windows(self, mongo_db, monkeypatch):
+        """Test a slower write's windows refresh does not overwrite a later write's"""
+        today = server.feature_day()
+        features = mongo_db.user_features
+        second_done = asyncio.Event()
+        refreshes = []
+
+        class SlowFirstRefresh:
+            def __getattr__(self, name):
+                return getattr(features, name)
+
+            async def update_one(self, *args, **kwargs):
+                refreshes.append(args[0])
+                if len(refreshes) == 1:
+                    await second_done.wait()
+                return await features.update_one(*args, **kwargs)
+
+        monkeypatch.setattr(server, "db", SimpleNamespace(user_features=SlowFirstRefresh()))
+
+        async def scenario():
+            first = asyncio.create_task(server.record_user_features("u", today, {"trades.n": 1, "trades.pnl": 10}))
+            await asyncio.sleep(0)
+            await server.record_user_features("u", today, {"trades.n": 1, "trades.pnl": 5})
+            second_done.set()
+            await first
+            return await features.find_one({"user_id": "u"}, {"_id": 0})
+
+        doc = asyncio.run(scenario())
+        assert doc["days"][today]["trades"] == {"n": 2, "pnl": 15}
+        assert doc["windows"]["7d"]["trades"] == 2
+
+    def test_days_past_retention_are_ignored(self, mongo_db):
+        old = (datetime.now(timezone.utc) - timedelta(days=server.FEATURE_RETENTION_DAYS)).strftime("%Y-%m-%d")
+        asyncio.run(server.record_user_features("u", old, {"journal.n": 1}))
+        assert asyncio.run(mongo_db.user_features.find_one({"user_id": "u"})) is None
+
+
+class TestEodResubmission:
+    """POST /psychology/eod twice for the same day"""
+
+    def test_resubmission_counts_the_day_once(self, api):
+        """Test the features and a rebuild from the stored EODs agree on one EOD day with the latest values"""
+        today = server.feature_day()
+        assert api.post("/api/psychology/eod", json=eod_body(today, 9, ["FOMO"])).status_code == 200
+        assert api.post("/api/psychology/eod", json=eod_body(today, 2)).status_code == 200
+
+        week = api.get("/api/features").json()["windows"]["7d"]
+        assert (week["eod_days"], week["avg_stress"]) == (1, 2.0)
+        assert "FOMO_LOOP" not in week["pattern_counts"]
+
+        rebuilt = api.post("/api/features/rebuild").json()["windows"]["7d"]
+        assert rebuilt == week
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
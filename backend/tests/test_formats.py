@@ -0,0 +1,141 @@
+"""
+Karion response format tests
+Accept negotiation, trusted list responses, conditional market responses and the binary encodings
+(skipped when msgpack/pyarrow are not installed)
+"""
+import gzip
+import json
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+import server
+
+TRADES = [
+    {"id": "a", "symbol": "EURUSD", "profit_loss": 12.5, "profit_loss_r": 1, "rules_followed": ["stop"]},
+    {"id": "b", "symbol": "XAUUSD", "profit_loss": -8.0, "profit_loss_r": -0.5, "rules_followed": []},
+]
+
+
+def request_with(accept=None):
+    headers = [(b"accept", accept.encode())] if accept is not None else []
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers})
+
+
+class TestNegotiation:
+    """Accept header handling"""
+
+    def test_json_is_default(self):
+        """Test missing, wildcard and browser-style Accept headers pick JSON"""
+        assert server.negotiate_format(request_with()) == "json"
+        assert server.negotiate_format(request_with("application/json, text/plain, */*")) == "json"
+        assert server.negotiate_format(request_with("application/msgpack;q=0.2, application/json")) == "json"
+
+    def test_unavailable_format_is_406(self, monkeypatch):
+        """Test a binary-only Accept is refused when its library is missing"""
+        monkeypatch.setattr(server, "optional_module", lambda name: None)
+        with pytest.raises(HTTPException) as exc:
+            server.negotiate_format(request_with("application/msgpack"))
+        assert exc.value.status_code == 406
+        assert server.negotiate_format(request_with("application/msgpack, application/json;q=0.5")) == "json"
+
+    def test_columns(self):
+        """Test numeric fields become float64 arrays and the rest stay lists"""
+        columns = server.records_to_columns(TRADES)
+        assert columns["profit_loss"].dtype == np.float64
+        assert columns["symbol"] == ["EURUSD", "XAUUSD"]
+        assert columns["rules_followed"] == [["stop"], []]
+
+
+class TestTrustedResponses:
+    """List endpoints skipping response_model validation"""
+
+    def test_matches_response_model_output(self):
+        """Test trusted output equals what validating through the model would produce"""
+        stored = server.CommunityPost(user_id="u", user_name="A", caption="ciao").model_dump()
+        legacy = {k: v for k, v in stored.items() if k not in ("comment_count", "latest_comments")}
+        docs = server.trusted_documents(server.CommunityPost, [stored, legacy])
+        assert docs[0] is stored
+        assert docs[1] == server.CommunityPost(**legacy).model_dump()
+        assert "latest_comments" not in legacy
+
+    def test_projection_and_body(self):
+        """Test the projection lists every model field and the body is plain JSON"""
+        projection = server.model_projection(server.TradeRecord)
+        assert projection["_id"] == 0
+        assert set(projection) - {"_id"} == set(server.TradeRecord.model_fields)
+        response = server.trusted_response(server.TradeRecord, [])
+        assert response.body == b"[]" and response.media_type == "application/json"
+
+
+def request_headers(**headers):
+    raw = [(k.replace("_", "-").encode(), v.encode()) for k, v in headers.items()]
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": raw})
+
+
+class TestConditionalResponses:
+    """Versioned payloads for polled market endpoints"""
+
+    def test_validators_and_304(self):
+        """Test matching ETag or Last-Modified answers 304 with no body, and a new version does not"""
+        modified = datetime(2026, 10, 19, 9, 30, tzinfo=timezone.utc)
+        entry = server.versioned_payload("test_quotes", 1, modified, lambda: {"price": 1.0})
+        response = server.conditional_response(request_headers(), entry)
+        assert response.status_code == 200
+        assert response.headers["last-modified"] == "Mon, 19 Oct 2026 09:30:00 GMT"
+
+        not_modified = server.conditional_response(request_headers(if_none_match=entry.etag), entry)
+        assert not_modified.status_code == 304 and not_modified.body == b""
+        since = server.conditional_response(request_headers(if_modified_since=entry.last_modified), entry)
+        assert since.status_code == 304
+
+        newer = server.versioned_payload("test_quotes", 2, modified, lambda: {"price": 2.0})
+        assert newer.etag != entry.etag
+        assert server.conditional_response(request_headers(if_none_match=entry.etag), newer).status_code == 200
+
+    def test_compression_is_precomputed_per_version(self):
+        """Test bodies over the threshold are built and gzipped once per version; small ones go as is"""
+        payload = {"rows": [{"symbol": "EURUSD", "net": i} for i in range(200)]}
+        builds = []
+        modified = datetime(2026, 10, 19, tzinfo=timezone.utc)
+
+        bodies = []
+        for _ in range(3):
+            entry = server.versioned_payload("test_cot", "v1", modified, lambda: builds.append(1) or payload)
+            response = server.conditional_response(request_headers(accept_encoding="gzip, br;q=0"), entry)
+            assert response.headers["content-encoding"] == "gzip"
+            bodies.append(response.body)
+        assert len(builds) == 1
+        assert bodies[0] is bodies[1] is bodies[2]
+        assert json.loads(gzip.decompress(bodies[0])) == payload
+
+        small = server.versioned_payload("test_small", 1, modified, lambda: {"ok": True})
+        response = server.conditional_response(request_headers(accept_encoding="gzip"), small)
+        assert "content-encoding" not in response.headers
+
+class TestBinaryEncodings:
+    """Round trips through the optional libraries"""
+
+    def test_msgpack_round_trip(self):
+        msgpack = pytest.importorskip("msgpack")
+        assert server.negotiate_format(request_with("application/msgpack")) == "msgpack"
+        body = msgpack.unpackb(server.encode_response(TRADES, "msgpack").body)
+        column = body["columns"]["profit_loss"]
+        assert body["count"] == 2
+        assert np.frombuffer(column["data"], dtype=column["dtype"]).tolist() == [12.5, -8.0]
+
+    def test_arrow_round_trip(self):
+        pa = pytest.importorskip("pyarrow")
+        table = pa.ipc.open_stream(server.encode_response(TRADES, "arrow").body).read_all()
+        assert table.column("profit_loss").to_pylist() == [12.5, -8.0]
+        payload = {"bands": {"p50": np.array([1.0, 2.0])}, "curves": [np.arange(3.0), np.arange(2.0)], "rate": 1.5}
+        table = pa.ipc.open_stream(server.encode_response(payload, "arrow").body).read_all()
+        assert table.column("bands.p50").to_pylist() == [[1.0, 2.0]]
+        assert table.column("curves").to_pylist() == [[[0.0, 1.0, 2.0], [0.0, 1.0]]]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,154 @@
+"""
+Karion background job tests
+Atomic claim, retry with backoff, final failure and long-polling on an in-memory store
+"""
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import server
+
+USER = {"id": "trader-1", "email": "trader@karion.app"}
+
+
+@pytest.fixture
+def handler(monkeypatch, mongo_db):
+    """A 'test' job kind that fails the first `fail_times` attempts"""
+    state = SimpleNamespace(calls=0, fail_times=0, failures=[])
+
+    async def run(job):
+        state.calls += 1
+        await asyncio.sleep(0)
+        if state.calls <= state.fail_times:
+            raise RuntimeError(f"boom {state.calls}")
+        return {"ok": job["payload"]["n"]}
+
+    async def on_failure(job, error):
+        state.failures.append(str(error))
+
+    monkeypatch.setitem(server.JOB_HANDLERS, "test", (run, on_failure))
+    monkeypatch.setattr(server, "_job_queue", None)
+    monkeypatch.setattr(server, "_job_waiters", {})
+    return state
+
+
+def get_job(job_id: str) -> dict:
+    return asyncio.run(server.db.jobs.find_one({"id": job_id}, {"_id": 0}))
+
+
+class TestJobRunner:
+    """Claim, retry and settle"""
+
+    def test_claim_runs_once(self, handler):
+        """Test a job id requeued twice is claimed by only one runner"""
+        async def scenario():
+            job = await server.enqueue_job("test", USER["id"], {"n": 1})
+            await asyncio.gather(server._run_job(job.id), server._run_job(job.id))
+            return job.id
+
+        job = get_job(asyncio.run(scenario()))
+        assert handler.calls == 1
+        assert (job["status"], job["attempts"], job["result"]) == ("succeeded", 1, {"ok": 1})
+
+    def test_retry_with_backoff(self, handler, monkeypatch):
+        """Test a failed attempt is requeued with its error and a run_after in the future"""
+        handler.fail_times = 1
+        monkeypatch.setattr(server.random, "random", lambda: 1.0)
+        job_id = asyncio.run(server.enqueue_job("test", USER["id"], {"n": 2})).id
+
+        asyncio.run(server._run_job(job_id))
+        job = get_job(job_id)
+        assert (job["status"], job["attempts"], job["error"]) == ("queued", 1, "boom 1")
+        delay = (server.datetime.fromisoformat(job["run_after"]) - server.datetime.now(server.timezone.utc)).total_seconds()
+        assert 1 < delay <= server.JOB_BACKOFF_BASE_SECONDS
+
+        asyncio.run(server._run_job(job_id))
+        job = get_job(job_id)
+        assert (job["status"], job["attempts"], job["error"]) == ("succeeded", 2, None)
+        assert handler.failures == []
+
+    def test_final_failure_runs_hook(self, handler):
+        """Test the last attempt marks the job failed and calls on_failure once"""
+        handler.fail_times = 99
+
+        async def scenario():
+            job = await server.enqueue_job("test", USER["id"], {"n": 3})
+            for _ in range(job.max_attempts + 1):
+                await server._run_job(job.id)
+            return job.id
+
+        job = get_job(asyncio.run(scenario()))
+        assert (job["status"], job["attempts"]) == ("failed", server.JOB_MAX_ATTEMPTS)
+        assert handler.calls == server.JOB_MAX_ATTEMPTS
+        assert handler.failures == [f"boom {server.JOB_MAX_ATTEMPTS}"]
+
+    def test_backoff_grows_and_is_capped(self, monkeypatch):
+        monkeypatch.setattr(server.random, "random", lambda: 1.0)
+        delays = [server._job_backoff_seconds(n) for n in (1, 2, 3, 20)]
+        assert delays == [2.0, 4.0, 8.0, server.JOB_BACKOFF_MAX_SECONDS]
+        monkeypatch.setattr(server.random, "random", lambda: 0.0)
+        assert server._job_backoff_seconds(1) == 1.0
+
+
+class TestJobLongPoll:
+    """GET /jobs/{id}?wait="""
+
+    def test_wakes_when_job_settles(self, handler):
+        """Test concurrent long-polls return as soon as the job succeeds, and leave no waiters behind"""
+        async def scenario():
+            job = await server.enqueue_job("test", USER["id"], {"n": 4})
+            polls = [asyncio.create_task(server.get_job(job.id, wait=10, current_user=USER)) for _ in range(2)]
+            await asyncio.sleep(0.05)
+            start = time.perf_counter()
+            await server._run_job(job.id)
+            results = await asyncio.gather(*polls)
+            return results, time.perf_counter() - start
+
+        results, elapsed = asyncio.run(scenario())
+        assert [r["status"] for r in results] == ["succeeded", "succeeded"]
+        assert elapsed < 1
+        assert server._job_waiters == {}
+
+    def test_timeout_cleans_up_waiter(self, handler):
+        """Test a long-poll that times out returns the current status and unregisters itself"""
+        async def scenario():
+            job = await server.enqueue_job("test", USER["id"], {"n": 5})
+            return await server.get_job(job.id, wait=0.05, current_user=USER)
+
+        assert asyncio.run(scenario())["status"] == "queued"
+        assert server._job_waiters == {}
+
+    def test_settled_before_waiter_registered(self, handler, mongo_db, monkeypatch):
+        """Test a job settling between the first read and waiter registration does not wait for the timeout"""
+        class SettlesAfterFirstRead:
+            reads = 0
+
+            def __getattr__(self, name):
+                return getattr(mongo_db.jobs, name)
+
+            async def find_one(self, *args, **kwargs):
+                doc = await mongo_db.jobs.find_one(*args, **kwargs)
+                SettlesAfterFirstRead.reads += 1
+                if SettlesAfterFirstRead.reads == 1:
+                    await server._run_job(doc["id"])
+                return doc
+
+        job_id = asyncio.run(server.enqueue_job("test", USER["id"], {"n": 6})).id
+        monkeypatch.setattr(server, "db", SimpleNamespace(jobs=SettlesAfterFirstRead()))
+
+        start = time.perf_counter()
+        job = asyncio.run(server.get_job(job_id, wait=5, current_user=USER))
+        assert job["status"] == "succeeded"
+        assert time.perf_counter() - start < 1
+
+    def test_other_users_job_is_404(self, handler):
+        job_id = asyncio.run(server.enqueue_job("test", "someone-else", {"n": 7})).id
+        with pytest.raises(server.HTTPException) as exc:
+            asyncio.run(server.get_job(job_id, wait=0, current_user=USER))
+        assert exc.value.status_code == 404
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,169 @@
+"""
+Karion LLM gateway tests
+Response cache (TTL, LRU, SQLite persistence, stats) and in-flight dedupe in llm_complete
+"""
+import asyncio
+
+import pytest
+
+import server
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(server.time, "time", fake)
+    return fake
+
+
+@pytest.fixture
+def fake_send(monkeypatch):
+    """Replace the upstream call with one that waits for `release` and counts calls"""
+    class Upstream:
+        calls = 0
+        release = None
+
+        @classmethod
+        async def send(cls, system_message, text, session_id):
+            cls.calls += 1
+            await cls.release.wait()
+            return f"risposta a {text}"
+
+    monkeypatch.setattr(server, "_llm_send", Upstream.send)
+    monkeypatch.setattr(server, "_llm_cache", server.LLMResponseCache(None, 100, 60))
+    return Upstream
+
+
+class TestLLMResponseCache:
+    """Content-addressed completion cache"""
+
+    def test_key_ignores_whitespace(self):
+        """Test prompts differing only in whitespace share a key"""
+        key = server.LLMResponseCache.make_key("sistema", "openai/m", "ciao   trader\n")
+        assert key == server.LLMResponseCache.make_key(" sistema ", "openai/m", "ciao trader")
+        assert key != server.LLMResponseCache.make_key("sistema", "openai/other", "ciao trader")
+
+    def test_ttl_expiry(self, clock):
+        """Test entries expire after ttl_seconds and count as expirations"""
+        cache = server.LLMResponseCache(None, 10, ttl_seconds=60)
+        cache.set("k", "v")
+        clock.now += 59
+        assert cache.get("k") == "v"
+        clock.now += 2
+        assert cache.get("k") is None
+        assert cache.stats()["expirations"] == 1
+        assert cache.stats()["entries"] == 0
+
+    def test_lru_eviction(self):
+        """Test the least recently used entry is evicted first"""
+        cache = server.LLMResponseCache(None, 2, 60)
+        cache.set("a", "1")
+        cache.set("b", "2")
+        cache.get("a")
+        cache.set("c", "3")
+        assert (cache.get("a"), cache.get("b"), cache.get("c")) == ("1", None, "3")
+        assert cache.stats()["evictions"] == 1
+
+    def test_stats(self):
+        cache = server.LLMResponseCache(None, 10, 60)
+        cache.set("a", "1")
+        cache.get("a")
+        cache.get("a")
+        cache.get("missing")
+        stats = cache.stats()
+        assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (2, 1, 0.6667)
+        assert stats["persistent"] is False
+
+    def test_persistence(self, tmp_path, clock):
+        """Test entries survive a restart, evictions and expirations are deleted from the file"""
+        path = str(tmp_path / "llm_cache.sqlite3")
+        cache = server.LLMResponseCache(path, 2, 60)
+        cache.set("a", "1")
+        cache.set("b", "2")
+        cache.set("c", "3")  # evicts a
+        cache.flush()
+        assert cache.stats()["persistent"] is True
+
+        reloaded = server.LLMResponseCache(path, 10, 60)
+        assert (reloaded.get("a"), reloaded.get("b"), reloaded.get("c")) == (None, "2", "3")
+
+        clock.now += 61
+        assert server.LLMResponseCache(path, 10, 60).stats()["entries"] == 0
+
+
+class TestLLMComplete:
+    """Cache and in-flight dedupe in llm_complete"""
+
+    def test_concurrent_calls_share_upstream(self, fake_send):
+        """Test identical concurrent calls make one upstream call, then hit the cache"""
+        async def scenario():
+            fake_send.release = asyncio.Event()
+            calls = [asyncio.create_task(server.llm_complete("s", "ciao", "x")) for _ in range(3)]
+            await asyncio.sleep(0)
+            fake_send.release.set()
+            results = await asyncio.gather(*calls)
+            return results + [await server.llm_complete("s", "ciao", "y")]
+
+        assert asyncio.run(scenario()) == ["risposta a ciao"] * 4
+        assert fake_send.calls == 1
+        assert server._llm_inflight == {}
+
+    def test_cancelled_first_caller_does_not_cancel_others(self, fake_send):
+        """Test cancelling the caller that started the upstream call leaves the other waiters served"""
+        async def scenario():
+            fake_send.release = asyncio.Event()
+            first = asyncio.create_task(server.llm_complete("s", "ciao", "x"))
+            await asyncio.sleep(0)
+            second = asyncio.create_task(server.llm_complete("s", "ciao", "y"))
+            await asyncio.sleep(0)
+            first.cancel()
+            await asyncio.sleep(0)
+            fake_send.release.set()
+            with pytest.raises(asyncio.CancelledError):
+                await first
+            return await second
+
+        assert asyncio.run(scenario()) == "risposta a ciao"
+        assert fake_send.calls == 1
+        assert server._llm_cache.stats()["entries"] == 1
+
+    def test_errors_reach_every_waiter_and_are_not_cached(self, monkeypatch):
+        calls = []
+
+        async def failing(system_message, text, session_id):
+            calls.append(text)
+            await asyncio.sleep(0.01)
+            raise RuntimeError("upstream down")
+
+        monkeypatch.setattr(server, "_llm_send", failing)
+        monkeypatch.setattr(server, "_llm_cache", server.LLMResponseCache(None, 100, 60))
+
+        async def scenario():
+            return await asyncio.gather(*[server.llm_complete("s", "ciao", "x") for _ in range(2)], return_exceptions=True)
+
+        results = asyncio.run(scenario())
+        assert [str(r) for r in results] == ["upstream down"] * 2
+        assert len(calls) == 1
+        assert server._llm_cache.stats()["entries"] == 0
+
+    def test_use_cache_false_bypasses_dedupe(self, fake_send):
+        async def scenario():
+            fake_send.release = asyncio.Event()
+            fake_send.release.set()
+            return await asyncio.gather(*[server.llm_complete("s", "ciao", "x", use_cache=False) for _ in range(2)])
+
+        assert asyncio.run(scenario()) == ["risposta a ciao"] * 2
+        assert fake_send.calls == 2
+        assert server._llm_cache.stats()["entries"] == 0
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,52 @@
+"""
+Karion media tests
+Stored originals are re-encoded without EXIF metadata, offline
+"""
+import io
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+import server
+
+USER = {"id": "trader-1", "email": "trader@karion.app", "name": "Trader"}
+
+
+def photo_with_gps(fmt: str) -> bytes:
+    exif = Image.Exif()
+    exif[0x0112] = 6  # Orientation: rotate 90° clockwise to display
+    exif[0x010F] = "PhoneMaker"
+    exif[0x8825] = {1: "N", 2: (45.0, 28.0, 0.0)}
+    buffer = io.BytesIO()
+    Image.new("RGB", (40, 20), "red").save(buffer, fmt, exif=exif.tobytes())
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "MEDIA_DIR", tmp_path)
+    server.app.dependency_overrides[server.get_current_user] = lambda: USER
+    yield TestClient(server.app)
+    server.app.dependency_overrides.clear()
+
+
+class TestImageOriginal:
+    """POST /media/images, then GET the original"""
+
+    @pytest.mark.parametrize("fmt, ext", [("JPEG", "jpg"), ("PNG", "png"), ("WEBP", "webp")])
+    def test_exif_is_stripped(self, api, fmt, ext):
+        """Test GPS and camera tags are gone and the pixels are stored upright"""
+        body = api.post("/api/media/images", files={"file": (f"photo.{ext}", photo_with_gps(fmt))}).json()
+        response = api.get(body["urls"]["original"])
+        assert response.status_code == 200
+
+        with Image.open(io.BytesIO(response.content)) as original:
+            assert original.format == fmt
+            assert dict(original.getexif()) == {}
+            assert original.size == (20, 40)
+        assert (body["width"], body["height"]) == (20, 40)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,179 @@
+"""
+Karion metrics tests
+Middleware histograms, dependency timings, Server-Timing, the Prometheus exposition and loop lag
+"""
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import server
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(server, "_http_latency", {})
+    monkeypatch.setattr(server, "_http_responses", {})
+    monkeypatch.setattr(server, "_dependency_latency", {})
+    app = FastAPI(default_response_class=server.TimedORJSONResponse)
+
+    @app.get("/items/{item_id}")
+    async def item(item_id: str):
+        with server.timed("yfinance"):
+            pass
+        # What Motor's executor thread reports for a find on this request
+        event = SimpleNamespace(command_name="find", duration_micros=2500)
+        server.MongoTimingListener().succeeded(event)
+        server.MongoTimingListener().succeeded(event)
+        return {"id": item_id}
+
+    app.add_middleware(server.MetricsMiddleware)
+    return TestClient(app)
+
+
+class TestMetrics:
+    """Request and dependency metrics"""
+
+    def test_server_timing_header(self, client):
+        """Test dependency timings of the request are summed per name in Server-Timing"""
+        response = client.get("/items/1")
+        entries = dict(part.split(";dur=") for part in response.headers["server-timing"].split(", "))
+        assert set(entries) == {"yfinance", "mongo", "serialize", "app"}
+        assert float(entries["mongo"]) == pytest.approx(5.0)
+
+    def test_histograms_use_route_templates(self, client):
+        """Test latency is keyed by route template, not raw path, and unmatched paths share one label"""
+        client.get("/items/1")
+        client.get("/items/2")
+        client.get("/missing")
+        assert server._http_latency[("GET", "/items/{item_id}")].count == 2
+        assert server._http_responses[("GET", "<unmatched>", 404)] == 1
+        assert server._dependency_latency["mongo.find"].count == 4
+
+    def test_prometheus_exposition(self, client):
+        """Test buckets are cumulative and end with +Inf equal to the count"""
+        client.get("/items/1")
+        text = server.render_metrics()
+        assert '# TYPE karion_http_request_duration_seconds histogram' in text
+        assert 'karion_http_request_duration_seconds_bucket{method="GET",route="/items/{item_id}",le="+Inf"} 1' in text
+        assert 'karion_dependency_duration_seconds_bucket{dependency="mongo.find",le="0.0025"} 2' in text
+        assert 'karion_dependency_duration_seconds_count{dependency="mongo.find"} 2' in text
+        assert 'karion_http_responses_total{method="GET",route="/items/{item_id}",status="200"} 1' in text
+
+
+    def test_response_model_validation_is_timed(self, monkeypatch):
+        """Test TimedRoute times response_model validation and encoding, not only the orjson render"""
+        monkeypatch.setattr(server, "_dependency_latency", {})
+        app = FastAPI(default_response_class=server.TimedORJSONResponse)
+        app.router.route_class = server.TimedRoute
+
+        class Item(server.BaseModel):
+            id: str
+
+        @app.get("/items/{item_id}", response_model=Item)
+        async def item(item_id: str):
+            return {"id": item_id, "dropped": True}
+
+        app.add_middleware(server.MetricsMiddleware)
+        response = TestClient(app).get("/items/1")
+        assert response.json() == {"id": "1"}
+        assert server._dependency_latency["validate"].count == 1
+        # One observation for the response_model encoding, one for render
+        assert server._dependency_latency["serialize"].count == 2
+
+
+class TestMetricsEndpoint:
+    """/metrics is admin-only unless the scraper token is configured"""
+
+    @pytest.fixture
+    def api(self, mongo_db):
+        asyncio.run(mongo_db.users.insert_many([
+            {"id": "admin-1", "email": "ops@karion.app", "name": "Ops", "role": "admin"},
+            {"id": "trader-1", "email": "trader@karion.app", "name": "Trader"},
+        ]))
+        return TestClient(server.app)
+
+    def test_admin_or_token(self, api, monkeypatch):
+        """Test anonymous and regular users are refused; admins and the scraper token are served"""
+        def auth(token):
+            return {"Authorization": f"Bearer {token}"}
+
+        assert api.get("/metrics").status_code == 403
+        assert api.get("/metrics", headers=auth(server.create_token("trader-1", "trader@karion.app"))).status_code == 403
+        response = api.get("/metrics", headers=auth(server.create_token("admin-1", "ops@karion.app")))
+        assert response.status_code == 200
+        assert "karion_event_loop_lag_seconds_count" in response.text
+
+        assert api.get("/metrics", headers=auth("scrape-secret")).status_code == 401
+        monkeypatch.setattr(server, "METRICS_TOKEN", "scrape-secret")
+        assert api.get("/metrics", headers=auth("scrape-secret")).status_code == 200
+
+
+class TestLoopMonitor:
+    """Event loop lag sampling and the blocking-callback watchdog"""
+
+    def test_watchdog_reports_route_and_stack(self):
+        """Test a handler that blocks the loop is logged with its route template and stack"""
+        app = FastAPI()
+
+        @app.get("/slow/{item_id}")
+        async def blocking_handler(item_id: str):
+            time.sleep(0.3)
+            return {"id": item_id}
+
+        monitor = server.LoopMonitor(interval=0.02, block_threshold_ms=50)
+        middleware = server.MetricsMiddleware(app)
+
+        async def run():
+            monitor.start()
+            scope = {"type": "http", "method": "GET", "path": "/slow/1", "raw_path": b"/slow/1",
+                     "query_string": b"", "headers": [], "root_path": ""}
+            sent = []
+
+            async def receive():
+                return {"type": "http.request", "body": b""}
+
+            async def send(message):
+                sent.append(message)
+
+            await asyncio.sleep(0.1)
+            await middleware(scope, receive, send)
+            await asyncio.sleep(0.1)
+            await monitor.stop()
+            return sent
+
+        sent = asyncio.run(run())
+        assert sent[0]["status"] == 200
+        assert len(monitor.block_events) == 1
+        event = monitor.block_events[0]
+        assert event["route"] == "GET /slow/{item_id}"
+        # The watchdog's probe can land up to one threshold interval into the block
+        assert event["blocked_ms"] >= 200
+        assert any("blocking_handler" in line for line in event["stack"])
+        assert float(monitor.percentiles()["0.99"]) >= 0.25
+        assert "karion_event_loop_blocks_total 1" in monitor.render()
+
+    def test_blocks_total_outlives_event_buffer(self):
+        """Test the counter keeps counting after the recent-events buffer is full"""
+        monitor = server.LoopMonitor(interval=0.02, block_threshold_ms=30)
+        monitor.block_events = server.deque(maxlen=1)
+
+        async def run():
+            monitor.start()
+            for _ in range(3):
+                await asyncio.sleep(0.1)
+                time.sleep(0.15)
+            await asyncio.sleep(0.1)
+            await monitor.stop()
+
+        asyncio.run(run())
+        assert len(monitor.block_events) == 1
+        assert monitor.block_count == 3
+        assert "karion_event_loop_blocks_total 3" in monitor.render()
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,125 @@
+"""
+Karion Monte Carlo tests
+Checks the vectorized simulator against the scalar reference loop, LTTB downsampling, sweeps and the analytic model
+"""
+
+import numpy as np
+import pytest
+
+import server
+
+
+def scalar_path(uniforms, win_rate, avg_win, avg_loss, risk, capital):
+    """The original per-trade loop, driven by the same uniforms"""
+    curve, peak, max_dd = [capital], capital, 0
+    for u in uniforms:
+        risk_amount = capital * risk
+        capital = capital + risk_amount * avg_win if u < win_rate else capital - risk_amount * avg_loss
+        curve.append(capital)
+        peak = max(peak, capital)
+        max_dd = max(max_dd, (peak - capital) / peak * 100 if peak > 0 else 0)
+        if capital <= 0:
+            return curve, True, max_dd
+    return curve, False, max_dd
+
+
+class TestMonteCarlo:
+    """Vectorized equity paths and chart payloads"""
+
+    @pytest.mark.parametrize("risk,avg_loss", [(0.02, 1.0), (0.5, 2.5)])
+    def test_chunk_matches_scalar_loop(self, risk, avg_loss):
+        """Test paths, bankruptcy and drawdown match the scalar loop, including frozen bankrupt paths"""
+        uniforms = np.random.default_rng(7).random((200, 60))
+        paths, bankrupt, lengths, max_dd = server.simulate_equity_chunk(uniforms, 0.45, 2.0, avg_loss, risk, 10000)
+        for i, row in enumerate(uniforms):
+            curve, busted, dd = scalar_path(row, 0.45, 2.0, avg_loss, risk, 10000)
+            assert bankrupt[i] == busted
+            assert lengths[i] == len(curve)
+            np.testing.assert_allclose(paths[i, :lengths[i]], curve, rtol=1e-9)
+            assert paths[i, -1] == pytest.approx(curve[-1])
+            assert max_dd[i] == pytest.approx(dd)
+        if avg_loss > 2:
+            assert bankrupt.any()
+
+    def test_lttb_keeps_extremes_and_endpoints(self):
+        """Test LTTB returns max_points sorted indices with endpoints and the deepest drawdown kept"""
+        curve = np.concatenate([np.linspace(100, 200, 500), np.linspace(200, 20, 30), np.linspace(20, 150, 470)])
+        keep = server.lttb_downsample(curve, 50)
+        assert len(keep) == 50
+        assert keep[0] == 0 and keep[-1] == len(curve) - 1
+        assert np.all(np.diff(keep) > 0)
+        assert 529 in keep
+        assert len(server.lttb_downsample(curve[:10], 50)) == 10
+
+    def test_run_returns_bands_and_downsampled_curves(self):
+        """Test max_points bounds every curve and the percentile bands are ordered"""
+        params = server.MonteCarloParams(win_rate=0.5, avg_win=1.5, avg_loss=1.0, num_trades=2000, max_points=100)
+        result = server.run_monte_carlo(params, num_simulations=500)
+        assert len(result["equity_curves"]) == server.MC_CURVES_RETURNED
+        assert all(len(c) <= 100 for c in result["equity_curves"])
+        assert [len(c) for c in result["equity_curves"]] == [len(s) for s in result["equity_curve_steps"]]
+        bands = result["bands"]
+        assert len(bands["steps"]) == 100 and bands["steps"][-1] == 2000
+        assert bands["p5"][0] == bands["p95"][0] == 10000
+        assert all(a <= b <= c for a, b, c in zip(bands["p5"], bands["p50"], bands["p95"]))
+        # The band interpolates between the two middle paths; median_final_capital is the upper one
+        assert bands["p50"][-1] <= result["median_final_capital"] + 0.01
+        assert bands["p50"][-1] == pytest.approx(result["median_final_capital"], rel=0.1)
+
+
+class TestMonteCarloSweep:
+    """Parameter grids on common random numbers"""
+
+    def test_cells_share_random_stream(self):
+        """Test a cell gives the same stats whether evaluated alone or with its grid"""
+        cells = [(0.4, 0.01), (0.4, 0.05), (0.55, 0.01), (0.55, 0.05)]
+        together = server.sweep_cells(cells, 1.8, 1.0, 300, 10000, 400, seed=11)
+        alone = [server.sweep_cells([cell], 1.8, 1.0, 300, 10000, 400, seed=11)[0] for cell in cells]
+        assert together == alone
+        # Same trades, better win rate: the median outcome can only improve
+        assert together[2][1] > together[0][1]
+
+    def test_bankruptcy_rate(self):
+        """Test a risk that loses the whole account on one loss goes bankrupt on every path"""
+        stats = server.sweep_cells([(0.5, 0.1), (0.5, 0.6)], 1.0, 2.0, 100, 10000, 200, seed=3)
+        assert stats[0][0] == 0
+        assert stats[1][0] == 100
+        assert stats[1][2] >= 100
+
+
+class TestMonteCarloAnalytic:
+    """Closed-form metrics against the simulator"""
+
+    def test_matches_simulation(self):
+        """Test median, ruin and below-initial probabilities agree with simulated paths"""
+        params = server.MonteCarloAnalyticParams(win_rate=0.45, avg_win=1.8, avg_loss=1.0,
+                                                 num_trades=400, risk_per_trade=0.04)
+        result = server.monte_carlo_analytic(params)
+        uniforms = np.random.default_rng(5).random((20000, 400))
+        paths, _, _, _ = server.simulate_equity_chunk(uniforms, 0.45, 1.8, 1.0, 0.04, 10000)
+        assert result["assumptions"] == {"valid": True, "flags": []}
+        assert result["median_final_capital"] == pytest.approx(np.median(paths[:, -1]), rel=1e-6)
+        assert result["ruin_rate"] == pytest.approx((paths.min(axis=1) <= 5000).mean() * 100, abs=0.5)
+        assert result["prob_below_initial"] == pytest.approx((paths[:, -1] < 10000).mean() * 100, abs=0.5)
+
+    def test_kelly_maximizes_growth(self):
+        """Test growth at the Kelly fraction beats growth just above and below it"""
+        base = dict(win_rate=0.55, avg_win=1.2, avg_loss=1.0, num_trades=100)
+        kelly = server.monte_carlo_analytic(server.MonteCarloAnalyticParams(**base))["kelly_fraction"]
+        growth = [server.monte_carlo_analytic(server.MonteCarloAnalyticParams(**base, risk_per_trade=r))
+                  ["log_growth_per_trade"] for r in (kelly * 0.8, kelly, kelly * 1.2)]
+        assert growth[1] > growth[0] and growth[1] > growth[2]
+        flags = server.monte_carlo_analytic(server.MonteCarloAnalyticParams(**base, risk_per_trade=kelly * 1.5))
+        assert "above_kelly" in flags["assumptions"]["flags"]
+
+    def test_flags_invalid_inputs(self):
+        """Test out-of-model inputs return flags instead of metrics"""
+        params = server.MonteCarloAnalyticParams(win_rate=1.2, avg_win=1.0, avg_loss=0, num_trades=10)
+        result = server.monte_carlo_analytic(params)
+        assert result["assumptions"]["valid"] is False
+        assert set(result["assumptions"]["flags"]) == {"win_rate_out_of_range", "non_positive_payoff"}
+        assert "ruin_rate" not in result
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,207 @@
+"""
+Karion MT5 report tests
+Regex parsing of MT5 statement text (positions, deals, summary metrics), page ranges
+and upload spooling, offline
+"""
+import asyncio
+import hashlib
+import io
+import os
+from pathlib import Path
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from starlette.datastructures import UploadFile
+
+import server
+
+POSITIONS_PAGE = """Trade History Report
+Positions
+Time Position Symbol Type Volume Price S / L T / P Time Price Commission Swap Profit
+2024.01.15 10:23:45 1001 EURUSD buy 0.10 1.08500 1.08000 1.09000 2024.01.15 12:00:00 1.08700 -0.70 0.00 20.00
+2024.01.16 09:00 1002 xauusd sell 0.05 2 050.10 2024.01.16 10:00:00 2 055.10 0.00 -1.20 -25.00
+2024.01.17 08:00:00 1003 US30.cash buy 1 37 500.0 2024.01.17 09:30:00 37 620.5 -2.00 0.00 1 205.00
+"""
+
+DEALS_PAGE = """Deals
+Time Deal Symbol Type Direction Volume Price Order Commission Swap Profit Balance
+2024.01.15 10:23:45 5001 EURUSD buy in 0.10 1.08500 1001 -0.35 0.00 0.00 10 000.00
+2024.01.15 10:30:00 5002 GBPUSD sell in 0.20 1.27000 1002 -0.70 0.00 0.00 9 999.30
+2024.01.15 12:00:00 5003 EURUSD sell out 0.10 1.08700 1003 -0.35 0.00 20.00 10 018.95
+2024.01.16 09:00:00 5004 GBPUSD buy out 0.20 1.27100 1004 -0.70 -0.40 -20.00 9 997.85
+2024.01.16 11:00:00 5005 XAUUSD buy out 0.01 2 050.00 1005 0.00 0.00 5.00 10 002.85
+"""
+
+SUMMARY_PAGE = """Results
+Total Net Profit: 1 234.50 Gross Profit: 2 000.00 Gross Loss: -765.50
+Profit Factor: 2.61 Expected Payoff: 12.35
+Recovery Factor: 3.53 Sharpe Ratio: 0.42
+Total Trades: 100 Profit Trades (% of total): 62 (62.00%)
+Balance Drawdown Maximal: 350.00 (3.20%) Equity Drawdown Maximal: 410.25 (3.75%)
+"""
+
+
+class TestMT5Rows:
+    """Positions and deals extraction from page text"""
+
+    def test_positions(self):
+        """Test positions with and without S/L-T/P, thousands separators and costs folded into profit"""
+        rows = server._parse_mt5_rows(POSITIONS_PAGE)
+        assert rows["deals"] == []
+        assert rows["positions"] == [
+            {"symbol": "EURUSD", "date": "2024-01-15 10:23:45", "side": "buy", "volume": 0.1,
+             "entry_price": 1.085, "exit_price": 1.087, "profit_loss": 19.3},
+            {"symbol": "XAUUSD", "date": "2024-01-16 09:00", "side": "sell", "volume": 0.05,
+             "entry_price": 2050.1, "exit_price": 2055.1, "profit_loss": -26.2},
+            {"symbol": "US30.CASH", "date": "2024-01-17 08:00:00", "side": "buy", "volume": 1.0,
+             "entry_price": 37500.0, "exit_price": 37620.5, "profit_loss": 1203.0},
+        ]
+
+    def test_deals_pair_fifo_per_symbol(self):
+        """Test in/out deals are paired per symbol; an unmatched out is dropped"""
+        rows = server._parse_mt5_rows(DEALS_PAGE)
+        assert rows["positions"] == []
+        assert [d["direction"] for d in rows["deals"]] == ["in", "in", "out", "out", "out"]
+        trades = server._deals_to_trades(rows["deals"])
+        assert trades == [
+            {"symbol": "EURUSD", "date": "2024-01-15 10:23:45", "side": "buy", "volume": 0.1,
+             "entry_price": 1.085, "exit_price": 1.087, "profit_loss": 19.3},
+            {"symbol": "GBPUSD", "date": "2024-01-15 10:30:00", "side": "sell", "volume": 0.2,
+             "entry_price": 1.27, "exit_price": 1.271, "profit_loss": -21.8},
+        ]
+
+    def test_ignores_headers_and_prose(self):
+        """Test header lines and text starting with digits but not rows are skipped"""
+        text = "2024 annual summary\n12 trades closed\nTime Position Symbol\n"
+        assert server._parse_mt5_rows(text) == {"positions": [], "deals": []}
+
+
+class TestMT5Metrics:
+    """Summary table parsing with fallbacks from trades"""
+
+    def test_summary_table(self):
+        """Test labelled values, percentages and the profit-trades ratio"""
+        metrics = server.parse_mt5_metrics(SUMMARY_PAGE, [])
+        assert metrics["total_net_profit"] == 1234.5
+        assert metrics["gross_loss"] == -765.5
+        assert metrics["profit_factor"] == 2.61
+        assert metrics["total_trades"] == 100
+        assert (metrics["profit_trades"], metrics["win_rate"]) == (62, 62.0)
+        assert (metrics["balance_drawdown_maximal"], metrics["balance_drawdown_maximal_pct"]) == (350.0, 3.2)
+        assert metrics["equity_drawdown_maximal_pct"] == 3.75
+        assert "avg_win" not in metrics
+
+    def test_fallback_from_trades(self):
+        """Test missing summary values are computed from the extracted trades"""
+        trades = server._parse_mt5_rows(POSITIONS_PAGE)["positions"]
+        metrics = server.parse_mt5_metrics("no summary here", trades)
+        assert metrics["total_trades"] == 3
+        assert metrics["win_rate"] == 66.67
+        assert metrics["total_net_profit"] == 1196.1
+        assert metrics["profit_factor"] == 46.65
+        assert (metrics["avg_win"], metrics["avg_loss"]) == (611.15, 26.2)
+
+    def test_summary_wins_over_trades(self):
+        """Test values printed in the report are not overwritten by the fallback"""
+        trades = server._parse_mt5_rows(POSITIONS_PAGE)["positions"]
+        metrics = server.parse_mt5_metrics(SUMMARY_PAGE, trades)
+        assert (metrics["total_trades"], metrics["win_rate"], metrics["total_net_profit"]) == (100, 62.0, 1234.5)
+
+
+class TestPageRanges:
+    """1-based page range specs"""
+
+    def test_ranges(self):
+        """Test single pages, ranges, open-ended ranges, overlaps and clamping to the page count"""
+        assert server.requested_pages(None, 3) == [0, 1, 2]
+        assert server.requested_pages("2", 10) == [1]
+        assert server.requested_pages("1-3, 2-4,9-", 10) == [0, 1, 2, 3, 8, 9]
+        assert server.requested_pages("8-20", 10) == [7, 8, 9]
+
+    @pytest.mark.parametrize("spec, processed, truncated", [
+        (None, [0, 1, 2, 3], True),
+        ("3-", [2, 3, 4, 5], True),
+        ("3-6", [2, 3, 4, 5], False),
+        ("9", [8], False),
+    ])
+    def test_capped_at_max_pages(self, monkeypatch, spec, processed, truncated):
+        """Test extraction keeps the first PDF_MAX_PAGES requested pages and reports the rest as truncated"""
+        extracted = []
+
+        def fake_extract_pages(path, page_indices):
+            extracted.extend(page_indices)
+            return {"text": "", "positions": [], "deals": []}
+
+        monkeypatch.setattr(server, "PDF_MAX_PAGES", 4)
+        monkeypatch.setattr(server, "_get_pdf_executor", lambda: None)
+        monkeypatch.setattr(server, "_count_pdf_pages", lambda path: 10)
+        monkeypatch.setattr(server, "_extract_pdf_pages", fake_extract_pages)
+        report = asyncio.run(server.extract_mt5_report("report.pdf", spec))
+        assert sorted(extracted) == processed
+        assert (report["pages_processed"], report["truncated"]) == (len(processed), truncated)
+
+    @pytest.mark.parametrize("spec", ["0", "5-2", "a-b", "1-x", "50-60", "11", ","])
+    def test_invalid_or_empty(self, spec):
+        """Test malformed ranges and ranges past the end of the document are rejected"""
+        with pytest.raises(HTTPException) as exc:
+            server.requested_pages(spec, 10)
+        assert exc.value.status_code == 400
+
+
+class TestSpoolUpload:
+    """Chunked copy of uploads to disk"""
+
+    def test_spools_in_chunks(self, tmp_path, monkeypatch):
+        """Test content, size and hash are preserved across many small chunks"""
+        monkeypatch.setattr(server, "UPLOAD_CHUNK_SIZE", 1000)
+        monkeypatch.setattr(server, "UPLOAD_TMP_DIR", str(tmp_path))
+        data = os.urandom(10_500)
+        path, size, digest = asyncio.run(server.spool_upload(UploadFile(file=io.BytesIO(data)), 1 << 20, ".pdf"))
+        try:
+            assert Path(path).parent == tmp_path and path.endswith(".pdf")
+            assert (size, digest) == (len(data), hashlib.sha256(data).hexdigest())
+            assert Path(path).read_bytes() == data
+        finally:
+            os.unlink(path)
+
+    def test_too_large_removes_file(self, tmp_path, monkeypatch):
+        """Test the size limit answers 413 and leaves no temp file behind"""
+        monkeypatch.setattr(server, "UPLOAD_CHUNK_SIZE", 1000)
+        monkeypatch.setattr(server, "UPLOAD_TMP_DIR", str(tmp_path))
+        with pytest.raises(HTTPException) as exc:
+            asyncio.run(server.spool_upload(UploadFile(file=io.BytesIO(b"x" * 5000)), 2500))
+        assert exc.value.status_code == 413
+        assert list(tmp_path.iterdir()) == []
+
+
+class TestPdfAnalysisCache:
+    """Parsed reports are cached per uploader"""
+
+    def test_cache_is_scoped_per_user(self, monkeypatch):
+        """Test a second user uploading the same file does not get the first user's cached analysis"""
+        calls = []
+
+        async def fake_extract(path, pages_spec=None):
+            calls.append(path)
+            return {"page_count": 1, "pages_processed": 1, "truncated": False, "text": SUMMARY_PAGE,
+                    "metrics": server.parse_mt5_metrics(SUMMARY_PAGE, []), "trades": [], "trade_count": 0}
+
+        monkeypatch.setattr(server, "extract_mt5_report", fake_extract)
+        monkeypatch.setattr(server, "EMERGENT_LLM_KEY", "")
+        monkeypatch.setattr(server, "_pdf_analysis_cache", server.OrderedDict())
+        client = TestClient(server.app)
+        pdf = {"file": ("report.pdf", b"%PDF-1.4 same bytes")}
+        try:
+            for user_id, cached in (("a", False), ("a", True), ("b", False)):
+                server.app.dependency_overrides[server.get_current_user] = lambda: {"id": user_id, "email": f"{user_id}@karion.app"}
+                response = client.post("/api/analysis/pdf", files=pdf)
+                assert response.status_code == 200
+                assert response.json()["cached"] is cached
+        finally:
+            server.app.dependency_overrides.clear()
+        assert len(calls) == 2
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
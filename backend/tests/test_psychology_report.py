@@ -0,0 +1,135 @@
+"""
+Karion psychology report tests
+Week/month bucket ranges, database-side $switch bucketing, the closed-bucket cache
+and EOD date normalization, offline
+"""
+import asyncio
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+
+USER = {"id": "trader-1", "email": "trader@karion.app", "name": "Trader"}
+
+
+def eod_doc(day: str, shark: int, patterns=(), user_id: str = USER["id"]) -> dict:
+    return {
+        "user_id": user_id,
+        "date": day,
+        "input": {"eod_psych": {"stress_1_10": 5}},
+        "result": {
+            "scores": {"shark_score_0_100": shark, "discipline_0_100": 70, "clarity_0_100": 60,
+                       "emotional_stability_0_100": 50, "compulsion_risk_0_100": 10},
+            "detected_patterns": [{"pattern_id": p} for p in patterns],
+        },
+    }
+
+
+def eod_request(day: str) -> dict:
+    return {"eod_psych": {"date": day, "stress_1_10": 4, "focus_1_10": 7, "energy_1_10": 6,
+                          "physical_tension_1_10": 3, "urge_to_trade_0_10": 2}}
+
+
+@pytest.fixture
+def api(mongo_db):
+    server.app.dependency_overrides[server.get_current_user] = lambda: USER
+    yield TestClient(server.app)
+    server.app.dependency_overrides.clear()
+
+
+class TestReportBuckets:
+    """[start, until) ranges per ISO week / calendar month"""
+
+    def test_weeks(self):
+        """Test weeks start on Monday and only the current one is open"""
+        buckets = server.report_buckets("week", 2, today=date(2025, 1, 1))
+        assert [(b["bucket"], b["start"], b["end"], b["closed"]) for b in buckets] == [
+            ("2024-W52", "2024-12-23", "2024-12-29", True),
+            ("2025-W01", "2024-12-30", "2025-01-05", False),
+        ]
+
+    def test_months_across_year(self):
+        """Test month buckets roll back over the year boundary"""
+        buckets = server.report_buckets("month", 3, today=date(2025, 2, 10))
+        assert [(b["bucket"], b["start"], b["until"]) for b in buckets] == [
+            ("2024-12", "2024-12-01", "2025-01-01"),
+            ("2025-01", "2025-01-01", "2025-02-01"),
+            ("2025-02", "2025-02-01", "2025-03-01"),
+        ]
+
+
+class TestAggregation:
+    """$switch bucketing and summed moments"""
+
+    def test_rows_land_in_their_bucket(self, mongo_db):
+        """Test boundary days, other users and rows outside every bucket"""
+        buckets = server.report_buckets("week", 2, today=date(2025, 1, 1))
+        asyncio.run(mongo_db.psychology_eod.insert_many([
+            eod_doc("2024-12-23", 60, ["TILT_RISK"]),
+            eod_doc("2024-12-29", 80, ["TILT_RISK", "FOMO_LOOP"]),
+            eod_doc("2024-12-30", 50),
+            eod_doc("2025-01-05", 70, ["FOMO_LOOP"]),
+            eod_doc("2025-01-06", 10),
+            eod_doc("2024-12-22", 10),
+            eod_doc("2024-12-24", 10, user_id="someone-else"),
+        ]))
+        asyncio.run(mongo_db.psychology_checkins.insert_one(
+            {"user_id": USER["id"], "date": "2024-12-31", "confidence": 8, "discipline": 6, "sleep_hours": 7.5, "sleep_quality": 7}))
+
+        results = asyncio.run(server.aggregate_psychology_buckets(USER["id"], buckets))
+        previous, current = results["2024-W52"], results["2025-W01"]
+        assert previous["eod"]["count"] == 2
+        assert previous["eod"]["shark_score"] == {"mean": 70.0, "stdev": 10.0, "min": 60, "max": 80}
+        assert previous["patterns"] == {"TILT_RISK": 2, "FOMO_LOOP": 1}
+        assert previous["checkins"] == {"count": 0}
+        assert (current["eod"]["count"], current["eod"]["shark_score"]["mean"]) == (2, 60.0)
+        assert current["patterns"] == {"FOMO_LOOP": 1}
+        assert current["checkins"]["count"] == 1
+        assert current["checkins"]["sleep_hours"]["mean"] == 7.5
+
+
+class TestReportCache:
+    """Closed buckets are computed once and dropped on backdated writes"""
+
+    def test_closed_buckets_cached_and_invalidated(self, api, mongo_db):
+        """Test a closed week is cached, the current one is not, and a backdated EOD recomputes it"""
+        today = datetime.now(timezone.utc).date()
+        last_week = (today - timedelta(weeks=1)).isoformat()
+        asyncio.run(mongo_db.psychology_eod.insert_one(eod_doc(last_week, 40)))
+
+        first = api.get("/api/psychology/report?period=week&buckets=2").json()["buckets"]
+        assert [(b["closed"], b["cached"]) for b in first] == [(True, False), (False, False)]
+        assert first[0]["eod"]["count"] == 1
+
+        # A direct insert is not seen: the closed bucket is served from the cache
+        asyncio.run(mongo_db.psychology_eod.insert_one(eod_doc(last_week, 90)))
+        second = api.get("/api/psychology/report?period=week&buckets=2").json()["buckets"]
+        assert [(b["closed"], b["cached"]) for b in second] == [(True, True), (False, False)]
+        assert second[0]["eod"]["count"] == 1
+
+        # A backdated EOD through the API invalidates its bucket (and replaces that day's analysis)
+        assert api.post("/api/psychology/eod", json=eod_request(last_week)).status_code == 200
+        third = api.get("/api/psychology/report?period=week&buckets=2").json()["buckets"]
+        assert (third[0]["cached"], third[0]["eod"]["count"]) == (False, 2)
+
+    def test_invalid_period(self, api):
+        assert api.get("/api/psychology/report?period=year").status_code == 400
+
+
+class TestEODDate:
+    """EOD dates are stored as YYYY-MM-DD strings"""
+
+    @pytest.mark.parametrize("raw", ["2025-01-15", "2025.01.15", "2025/1/15", "2025-01-15T21:30:00Z"])
+    def test_normalized(self, raw):
+        assert server.EODPsychInput(**{**eod_request(raw)["eod_psych"]}).date == "2025-01-15"
+
+    @pytest.mark.parametrize("raw", ["15/01/2025", "yesterday", ""])
+    def test_rejected(self, api, raw):
+        """Test dates that would not sort as strings are refused with 422"""
+        assert api.post("/api/psychology/eod", json=eod_request(raw)).status_code == 422
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
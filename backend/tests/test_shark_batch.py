@@ -0,0 +1,143 @@
+"""
+Shark Mind rules and batch scoring tests
+score_eod_batch must reproduce the scalar engine exactly on randomized EOD inputs;
+the rule file hot-reloads and a broken edit keeps the last good rules
+"""
+import json
+import os
+import random
+
+import pytest
+
+import server
+
+STATES = ["bene", "OK", "teso", "calm", "", "frustrato"]
+TRIGGERS = server.get_shark_rules().triggers + ["NEWS"]
+PHASES = list(server.SHARK_PHASES) + ["UNKNOWN"]
+
+
+def random_request(rng: random.Random) -> dict:
+    telemetry = None
+    if rng.random() < 0.7:
+        telemetry = {
+            "unplanned_trades_count": rng.randint(0, 5),
+            "overtrading_detected": rng.random() < 0.2,
+        }
+    behaviors = {k: rng.random() < 0.5 for k in ("limits_respected", "shutdown_ritual_done", "breaks_taken") if rng.random() < 0.8}
+    return {
+        "eod_psych": {
+            "date": "2025-01-01",
+            "stress_1_10": rng.randint(1, 10),
+            "focus_1_10": rng.randint(1, 10),
+            "energy_1_10": rng.randint(1, 10),
+            "physical_tension_1_10": rng.randint(1, 10),
+            "urge_to_trade_0_10": rng.randint(0, 10),
+            "dominant_state_one_word": rng.choice(STATES),
+            "behaviors": behaviors,
+            "triggers_selected": rng.sample(TRIGGERS, rng.randint(0, 3)),
+        },
+        "journal_telemetry": telemetry,
+        "engine_state": {"phase": rng.choice(PHASES)},
+    }
+
+
+def scalar_reference(req: dict) -> tuple:
+    model = server.SharkMindRequest(**req)
+    scores = server.calculate_shark_scores(model.eod_psych, model.journal_telemetry, model.engine_state.phase)
+    patterns = server.detect_patterns(model.eod_psych, model.journal_telemetry)
+    protocol = server.generate_tomorrow_protocol(scores, patterns, model.eod_psych, model.journal_telemetry)
+    return scores, patterns, protocol["mode"]
+
+
+class TestSharkBatch:
+    """Vectorized vs scalar Shark Mind engine"""
+
+    def test_batch_matches_scalar(self):
+        """Test every score, pattern and protocol mode matches row by row"""
+        rng = random.Random(42)
+        requests = [random_request(rng) for _ in range(3000)]
+        batch = server.score_eod_batch(server.eod_requests_to_columns(requests))
+
+        for i, req in enumerate(requests):
+            scores, patterns, mode = scalar_reference(req)
+            for key, value in scores.items():
+                assert batch[key][i] == value, (i, key, req)
+            detected = {p["pattern_id"]: p["severity"] for p in patterns}
+            for pattern_id in batch["patterns"]:
+                assert bool(batch["patterns"][pattern_id][i]) == (pattern_id in detected), (i, pattern_id, req)
+                assert bool(batch["patterns_high"][pattern_id][i]) == (detected.get(pattern_id) == "high")
+            assert batch["mode_names"][batch["mode"][i]] == mode, (i, req)
+
+    def test_phase_override_and_summary(self):
+        """Test a phase override applies to every row and the summary counts add up"""
+        rng = random.Random(7)
+        requests = [random_request(rng) for _ in range(200)]
+        batch = server.score_eod_batch(server.eod_requests_to_columns(requests, phase="MAINTENANCE"))
+        for i, req in enumerate(requests):
+            req["engine_state"]["phase"] = "MAINTENANCE"
+            assert batch["shark_score_0_100"][i] == scalar_reference(req)[0]["shark_score_0_100"]
+
+        summary = server.summarize_eod_batch(batch)
+        assert summary["rows"] == 200
+        assert sum(summary["mode_counts"].values()) == 200
+
+    def test_window_rules_only_reported_when_replayed(self):
+        """Test window-stage rules are left out of undated batches instead of reported as never matching"""
+        rng = random.Random(3)
+        requests = [random_request(rng) for _ in range(20)]
+        window_ids = {"TILT_STREAK", "OVERTRADING_WEEK"}
+
+        batch = server.score_eod_batch(server.eod_requests_to_columns(requests))
+        assert not window_ids & set(batch["patterns"])
+        assert not window_ids & set(server.summarize_eod_batch(batch)["pattern_counts"])
+
+        days = [f"2025-01-{i + 1:02d}" for i in range(20)]
+        batch = server.score_eod_batch(server.eod_requests_to_columns(requests), days=days)
+        assert window_ids <= set(batch["patterns"])
+
+    def test_empty_batch(self):
+        """Test an empty history scores to an empty summary"""
+        batch = server.score_eod_batch(server.eod_requests_to_columns([]))
+        assert server.summarize_eod_batch(batch)["rows"] == 0
+
+
+class TestSharkRules:
+    """Compiled rule file loading and hot reload"""
+
+    def test_hot_reload_and_hit_counters(self, tmp_path):
+        """Test an edited rule file is picked up and a broken one keeps the last good rules"""
+        spec = json.loads(server.SHARK_RULES_PATH.read_text(encoding="utf-8"))
+        path = tmp_path / "rules.json"
+        path.write_text(json.dumps(spec), encoding="utf-8")
+        loader = server.SharkRulesLoader(path, check_interval=0)
+
+        req = server.SharkMindRequest(**random_request(random.Random(1)))
+        features = {**loader.get().eod_features(req.eod_psych, None), "urge": 9, "trigger_mask": loader.get().trigger_mask(["FOMO"])}
+        assert [p["pattern_id"] for p in loader.get().match_patterns(features)] == ["FOMO_LOOP"]
+        assert loader.stats()["hits"] == {"pattern:FOMO_LOOP": 1}
+        assert loader.stats()["pattern_stages"]["TILT_STREAK"] == "window"
+
+        # Raise the FOMO_LOOP urge threshold above 9
+        spec["version"] = 2
+        next(p for p in spec["patterns"] if p["id"] == "FOMO_LOOP")["when"]["all"][1][2] = 9
+        path.write_text(json.dumps(spec), encoding="utf-8")
+        os.utime(path, ns=(1, 10**18))
+        assert loader.get().version == 2
+        assert loader.get().match_patterns(features) == []
+
+        path.write_text("{not json", encoding="utf-8")
+        os.utime(path, ns=(1, 2 * 10**18))
+        assert loader.get().version == 2
+        assert loader.stats()["last_error"]
+        assert loader.stats()["hits"] == {"pattern:FOMO_LOOP": 1}
+
+    def test_unknown_trigger_is_rejected(self):
+        """Test a rule referencing an undeclared trigger fails to compile"""
+        spec = json.loads(server.SHARK_RULES_PATH.read_text(encoding="utf-8"))
+        spec["patterns"][0]["when"] = {"triggers_any": ["NOT_A_TRIGGER"]}
+        with pytest.raises(ValueError):
+            server.SharkRuleSet(spec)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
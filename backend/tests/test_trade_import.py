@@ -0,0 +1,155 @@
+"""
+Karion trade import tests
+CSV and MT5 HTML parsing, section-title rows and batch flushing, offline
+"""
+import asyncio
+import io
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.datastructures import UploadFile
+
+import server
+
+USER = {"id": "trader-1", "email": "trader@karion.app", "name": "Trader"}
+OTHER = {"id": "trader-2", "email": "other@karion.app", "name": "Other"}
+
+MT5_STATEMENT = """<html><body><table>
+<tr><th colspan="13">Positions</th></tr>
+<tr><td>Time</td><td>Position</td><td>Symbol</td><td>Type</td><td>Volume</td><td>Price</td>
+<td>S / L</td><td>T / P</td><td>Time</td><td>Price</td><td>Commission</td><td>Swap</td><td>Profit</td></tr>
+<tr><td>2024.01.15 10:23:45</td><td>1001</td><td>eurusd</td><td>buy</td><td>0.10</td><td>1.08500</td>
+<td></td><td></td><td>2024.01.15 12:00:00</td><td>1.08700</td><td>0</td><td>0</td><td>20.00</td></tr>
+<tr><td>2024.01.16 09:00:00</td><td>1002</td><td>XAUUSD</td><td>sell</td><td>0.05</td><td>2 050.10</td>
+<td></td><td></td><td>2024.01.16 10:00:00</td><td>2 055.10</td><td>0</td><td>0</td><td>-25,00</td></tr>
+<tr><th colspan="13">Orders</th></tr>
+<tr><td>Open Time</td><td>Order</td><td>Symbol</td><td>Type</td><td>Volume</td><td>Price</td></tr>
+<tr><td>2024.01.15 10:23:45</td><td>1001</td><td>EURUSD</td><td>buy</td><td>0.10</td><td>1.08500</td></tr>
+<tr><th colspan="13">Deals</th></tr>
+<tr><td>2024.01.15 10:23:45</td><td>5001</td><td>EURUSD</td><td>buy</td><td>in</td><td>0.10</td></tr>
+</table></body></html>"""
+
+
+def upload(data: bytes, filename: str) -> UploadFile:
+    return UploadFile(file=io.BytesIO(data), filename=filename)
+
+
+def read_rows(data: bytes, filename: str) -> list:
+    async def collect():
+        return [row async for row in server._iter_upload_rows(upload(data, filename))]
+    return asyncio.run(collect())
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    # Chunk boundaries land inside rows, quoted fields and multi-byte characters
+    monkeypatch.setattr(server, "TRADE_IMPORT_CHUNK_SIZE", 7)
+
+
+@pytest.fixture
+def api(mongo_db):
+    server.app.dependency_overrides[server.get_current_user] = lambda: USER
+    yield TestClient(server.app)
+    server.app.dependency_overrides.clear()
+
+
+class TestUploadRows:
+    """Streaming CSV/HTML row extraction"""
+
+    def test_csv_rows_across_chunks(self, small_chunks):
+        """Test delimiter detection and rows split across read() chunks"""
+        data = "symbol;date;entry;exit;profit\nEURUSD;2024-01-15;1,085;1,087;20\nXAUUSD;2024-01-16;2050;2055;-25".encode()
+        assert read_rows(data, "trades.csv") == [
+            ["symbol", "date", "entry", "exit", "profit"],
+            ["EURUSD", "2024-01-15", "1,085", "1,087", "20"],
+            ["XAUUSD", "2024-01-16", "2050", "2055", "-25"],
+        ]
+
+    def test_csv_quoted_field_with_newlines(self, small_chunks):
+        """Test a quoted note spanning lines stays one field of one row"""
+        data = ('symbol,date,notes\r\nEURUSD,2024-01-15,"entrata su break,\r\npoi ""stop"" a BE"\r\n'
+                'XAUUSD,2024-01-16,"ok"\r\n').encode()
+        assert read_rows(data, "trades.csv") == [
+            ["symbol", "date", "notes"],
+            ["EURUSD", "2024-01-15", 'entrata su break,\r\npoi "stop" a BE'],
+            ["XAUUSD", "2024-01-16", "ok"],
+        ]
+
+    def test_csv_unterminated_quote_is_flushed(self):
+        """Test an unbalanced quote at end of file still yields the tail"""
+        rows = read_rows(b'symbol,notes\nEURUSD,"aperta\nsenza chiusura', "trades.csv")
+        assert rows[1] == ["EURUSD", "aperta\nsenza chiusura"]
+
+    def test_mt5_html_utf16(self, small_chunks):
+        """Test UTF-16 MT5 statements are detected and parsed into rows"""
+        rows = read_rows(MT5_STATEMENT.encode("utf-16"), "ReportHistory.html")
+        assert rows[0] == ["Positions"]
+        assert rows[2][2] == "eurusd"
+        assert rows[3][5] == "2 050.10"
+        assert ["Deals"] in rows
+
+
+class TestImportTrades:
+    """POST /trades/import against an in-memory store"""
+
+    def test_section_titles_end_tables(self, api, mongo_db):
+        """Test only the Positions table is imported; Orders/Deals rows are not reported as errors"""
+        response = api.post("/api/trades/import", files={"file": ("ReportHistory.html", MT5_STATEMENT.encode("utf-16"))})
+        body = response.json()
+        assert response.status_code == 200
+        assert (body["imported"], body["error_count"], body["rows_processed"]) == (2, 0, 2)
+
+        trades = asyncio.run(mongo_db.trades.find({}, {"_id": 0}).sort("date", 1).to_list(10))
+        assert [(t["symbol"], t["date"], t["entry_price"], t["exit_price"], t["profit_loss"]) for t in trades] == [
+            ("EURUSD", "2024-01-15 10:23:45", 1.085, 1.087, 20.0),
+            ("XAUUSD", "2024-01-16 09:00:00", 2050.1, 2055.1, -25.0),
+        ]
+
+    def test_batches_dedupe_and_errors(self, api, mongo_db, monkeypatch):
+        """Test small batches flush as they fill, duplicates are skipped and bad rows are reported"""
+        monkeypatch.setattr(server, "TRADE_IMPORT_BATCH_SIZE", 2)
+        rows = ["symbol,date,entry,exit,profit"]
+        rows += [f"EURUSD,2024-01-{day:02d},1.08,1.09,{day}" for day in range(1, 6)]
+        rows += ["EURUSD,2024-01-01,1.08,1.09,1", "GBPUSD,2024-01-07,n/a,1.2,3"]
+        response = api.post("/api/trades/import", files={"file": ("trades.csv", "\n".join(rows).encode())})
+        body = response.json()
+        assert (body["imported"], body["duplicates"], body["error_count"]) == (5, 1, 1)
+        assert body["errors"][0]["row"] == 8
+
+        # Re-importing the same file only finds duplicates already stored
+        response = api.post("/api/trades/import", files={"file": ("trades.csv", "\n".join(rows).encode())})
+        assert (response.json()["imported"], response.json()["duplicates"]) == (0, 6)
+        assert asyncio.run(mongo_db.trades.count_documents({"user_id": USER["id"]})) == 5
+
+    def test_rejects_unknown_extension(self, api):
+        """Test unsupported files are refused before reading"""
+        response = api.post("/api/trades/import", files={"file": ("trades.xlsx", b"PK")})
+        assert response.status_code == 400
+
+
+class TestImportProgress:
+    """Progress entries are scoped to the user that started the import"""
+
+    def test_same_id_from_two_users(self, api, monkeypatch):
+        """Test a client-chosen import_id cannot read or replace another user's progress"""
+        monkeypatch.setattr(server, "_trade_import_progress", {})
+        csv = "symbol,date,entry,exit,profit\nEURUSD,2024-01-01,1.08,1.09,1"
+        api.post("/api/trades/import?import_id=shared", files={"file": ("trades.csv", csv.encode())})
+
+        server.app.dependency_overrides[server.get_current_user] = lambda: OTHER
+        assert api.get("/api/trades/import/shared").status_code == 404
+        api.post("/api/trades/import?import_id=shared", files={"file": ("trades.csv", b"symbol,date,entry,exit,profit")})
+        assert api.get("/api/trades/import/shared").json()["rows_processed"] == 0
+
+        server.app.dependency_overrides[server.get_current_user] = lambda: USER
+        assert api.get("/api/trades/import/shared").json()["imported"] == 1
+
+    def test_running_id_is_refused(self, api, monkeypatch):
+        """Test reusing the id of an import still in progress answers 409"""
+        monkeypatch.setattr(server, "_trade_import_progress", {(USER["id"], "busy"): {"status": "running"}})
+        response = api.post("/api/trades/import?import_id=busy", files={"file": ("trades.csv", b"symbol,date")})
+        assert response.status_code == 409
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -17,6 +17,13 @@ import {
 
 const API = `${process.env.REACT_APP_BACKEND_URL}/api`;
 
+// Clean response - remove links and normalize font
+const cleanAIText = (text) => text
+  .replace(/\[.*?\]\(.*?\)/g, '') // Remove markdown links
+  .replace(/https?:\/\/\S+/g, '') // Remove URLs
+  .replace(/\*\*/g, '') // Remove bold markdown
+  .trim();
+
 // Karion AI Logo Component
 const KarionLogo = ({ size = 'md', animate = false }) => {
   const sizes = {
@@ -106,6 +113,11 @@ export default function AIPage() {
   const [intimateAnalysis, setIntimateAnalysis] = useState(null);
   const [loadingIntimate, setLoadingIntimate] = useState(false);
   const scrollRef = useRef(null);
+  const streamAbortRef = useRef(null);
+  const [conversationId, setConversationId] = useState(null);
+
+  // Cancel any in-flight stream (and the upstream LLM call) when leaving the page
+  useEffect(() => () => streamAbortRef.current?.abort(), []);
 
   // TTS Voice States
   const [voices, setVoices] = useState([]);
@@ -245,21 +257,27 @@ Come posso aiutarti oggi?`
     setInput('');
     setLoading(true);
 
+    const payload = {
+      messages: [...messages, userMessage],
+      context: activeQuick || 'general',
+      conversation_id: conversationId
+    };
+
     try {
-      const res = await axios.post(`${API}/ai/chat`, {
-        messages: [...messages, userMessage],
-        context: activeQuick || 'general'
-      });
-
-      // Clean response - remove links and normalize font
-      let cleanResponse = res.data.response
-        .replace(/\[.*?\]\(.*?\)/g, '') // Remove markdown links
-        .replace(/https?:\/\/\S+/g, '') // Remove URLs
-        .replace(/\*\*/g, '') // Remove bold markdown
-        .trim();
-
-      const aiMessage = { role: 'assistant', content: cleanResponse };
-      setMessages(prev => [...prev, aiMessage]);
+      let streamed = false;
+      try {
+        streamed = await streamReply(payload);
+      } catch (streamError) {
+        if (streamError.name === 'AbortError') return;
+        console.warn('AI stream unavailable, falling back:', streamError);
+      }
+
+      if (!streamed) {
+        const res = await axios.post(`${API}/ai/chat`, payload);
+        if (res.data.conversation_id) setConversationId(res.data.conversation_id);
+        const aiMessage = { role: 'assistant', content: cleanAIText(res.data.response) };
+        setMessages(prev => [...prev, aiMessage]);
+      }
     } catch (error) {
       toast.error('Errore di connessione con Karion');
       console.error('AI Error:', error);
@@ -268,6 +286,84 @@ Come posso aiutarti oggi?`
     }
   };
 
+  // Streams tokens from /ai/chat/stream (SSE) into a growing assistant message.
+  // Returns false when streaming is not available so the caller can fall back.
+  // Once tokens have arrived a failure ends the partial message instead, so the
+  // reply is never requested twice.
+  const streamReply = async (payload) => {
+    streamAbortRef.current?.abort();
+    const controller = new AbortController();
+    streamAbortRef.current = controller;
+
+    const res = await fetch(`${API}/ai/chat/stream`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        Accept: 'text/event-stream',
+        Authorization: axios.defaults.headers.common['Authorization'] || ''
+      },
+      body: JSON.stringify(payload),
+      signal: controller.signal
+    });
+    if (!res.ok || !res.body) return false;
+
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let content = '';
+    let started = false;
+
+    // Keeps the tokens already shown and marks the reply as cut short
+    const interrupt = (reason) => {
+      console.warn('AI stream interrupted:', reason);
+      const aiMessage = { role: 'assistant', content: `${cleanAIText(content)}\n\n_[Risposta interrotta]_` };
+      setMessages(prev => [...prev.slice(0, -1), aiMessage]);
+      toast.error('Risposta di Karion interrotta');
+    };
+
+    try {
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split('\n\n');
+        buffer = events.pop();
+
+        for (const event of events) {
+          const dataLine = event.split('\n').find(line => line.startsWith('data:'));
+          if (!dataLine) continue;
+          if (event.startsWith('event: error')) {
+            const { error } = JSON.parse(dataLine.slice(5));
+            if (!started) throw new Error(error);
+            reader.cancel();
+            interrupt(error);
+            return true;
+          }
+          if (event.startsWith('event: done')) {
+            const { conversation_id } = JSON.parse(dataLine.slice(5));
+            if (conversation_id) setConversationId(conversation_id);
+            continue;
+          }
+
+          content += JSON.parse(dataLine.slice(5)).token || '';
+          const aiMessage = { role: 'assistant', content: cleanAIText(content) };
+          if (!started) {
+            started = true;
+            setLoading(false);
+            setMessages(prev => [...prev, aiMessage]);
+          } else {
+            setMessages(prev => [...prev.slice(0, -1), aiMessage]);
+          }
+        }
+      }
+    } catch (streamError) {
+      if (!started || streamError.name === 'AbortError') throw streamError;
+      interrupt(streamError);
+      return true;
+    }
+    return started;
+  };
+
   const handleQuickAction = (tab) => {
     setActiveQuick(tab.id);
     sendMessage(tab.prompt);
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { useTranslation } from 'react-i18next';
 import { motion, AnimatePresence } from 'framer-motion';
 import axios from 'axios';
@@ -18,6 +18,9 @@ import {
 
 const API = `${process.env.REACT_APP_BACKEND_URL}/api`;
 
+// Uploaded media URLs are relative to the backend
+const mediaSrc = (url) => (url && url.startsWith('/api/') ? `${process.env.REACT_APP_BACKEND_URL}${url}` : url);
+
 // Fake online users for demo
 const onlineUsers = [
   { id: 1, name: 'TradingPro', avatar: 'T', status: 'online', streak: 15 },
@@ -120,6 +123,9 @@ const ChannelItem = ({ channel, active, onClick }) => (
 export default function CommunityPage() {
   const { t } = useTranslation();
   const [posts, setPosts] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [uploading, setUploading] = useState(false);
+  const fileInputRef = useRef(null);
   const [loading, setLoading] = useState(false);
   const [showForm, setShowForm] = useState(false);
   const [activeChannel, setActiveChannel] = useState('general');
@@ -134,11 +140,13 @@ export default function CommunityPage() {
     fetchPosts();
   }, []);
 
-  const fetchPosts = async () => {
+  const fetchPosts = async (cursor = null) => {
     try {
-      const res = await axios.get(`${API}/community/posts`);
-      setPosts(res.data);
+      const res = await axios.get(`${API}/community/feed`, { params: cursor ? { cursor } : {} });
+      setPosts(prev => cursor ? [...prev, ...res.data.posts] : res.data.posts);
+      setNextCursor(res.data.next_cursor);
     } catch (error) {
+      if (cursor) return;
       // Demo posts
       setPosts([
         {
@@ -148,7 +156,7 @@ export default function CommunityPage() {
           profit: 2400,
           likes: 45,
           created_at: new Date(Date.now() - 3600000).toISOString(),
-          comments: [{ text: 'Grande!' }]
+          comment_count: 1
         },
         {
           id: 2,
@@ -157,7 +165,7 @@ export default function CommunityPage() {
           profit: 890,
           likes: 32,
           created_at: new Date(Date.now() - 7200000).toISOString(),
-          comments: []
+          comment_count: 0
         }
       ]);
     }
@@ -179,10 +187,29 @@ export default function CommunityPage() {
     }
   };
 
+  const handleImageSelect = async (e) => {
+    const file = e.target.files?.[0];
+    e.target.value = '';
+    if (!file) return;
+    setUploading(true);
+    try {
+      const body = new FormData();
+      body.append('file', file);
+      const res = await axios.post(`${API}/media/images`, body);
+      setFormData(prev => ({ ...prev, image_url: res.data.urls.medium }));
+    } catch (error) {
+      toast.error('Errore nel caricamento dell\'immagine');
+    } finally {
+      setUploading(false);
+    }
+  };
+
   const handleLike = async (postId) => {
     try {
-      await axios.post(`${API}/community/posts/${postId}/like`);
-      fetchPosts();
+      const res = await axios.post(`${API}/community/posts/${postId}/like`);
+      setPosts(prev => prev.map(p =>
+        p.id === postId ? { ...p, likes: res.data.likes } : p
+      ));
     } catch (error) {
       setPosts(prev => prev.map(p =>
         p.id === postId ? { ...p, likes: (p.likes || 0) + 1 } : p
@@ -339,9 +366,18 @@ export default function CommunityPage() {
                           className="bg-white/5 min-h-[100px]"
                           data-testid="caption-textarea"
                         />
+                        {formData.image_url && (
+                          <img src={mediaSrc(formData.image_url)} alt="" className="max-h-40 rounded-lg" />
+                        )}
                         <div className="flex items-center gap-2">
-                          <button type="button" className="p-2 rounded-lg hover:bg-secondary">
-                            <ImageIcon className="w-5 h-5 text-muted-foreground" />
+                          <input ref={fileInputRef} type="file" accept="image/*" className="hidden" onChange={handleImageSelect} />
+                          <button
+                            type="button"
+                            className="p-2 rounded-lg hover:bg-secondary"
+                            onClick={() => fileInputRef.current?.click()}
+                            disabled={uploading}
+                          >
+                            <ImageIcon className={cn('w-5 h-5 text-muted-foreground', uploading && 'animate-pulse')} />
                           </button>
                           <button type="button" className="p-2 rounded-lg hover:bg-secondary">
                             <Smile className="w-5 h-5 text-muted-foreground" />
@@ -362,7 +398,7 @@ export default function CommunityPage() {
                       <Button type="button" variant="ghost" onClick={() => setShowForm(false)}>
                         Annulla
                       </Button>
-                      <Button type="submit" disabled={loading} className="rounded-xl" data-testid="submit-post-btn">
+                      <Button type="submit" disabled={loading || uploading} className="rounded-xl" data-testid="submit-post-btn">
                         {loading ? 'Pubblicando...' : 'Pubblica 🚀'}
                       </Button>
                     </div>
@@ -418,6 +454,14 @@ export default function CommunityPage() {
 
                       {/* Content */}
                       <p className="text-sm mb-4 whitespace-pre-wrap">{post.caption}</p>
+                      {post.image_url && (
+                        <img
+                          src={mediaSrc(post.image_url)}
+                          alt=""
+                          loading="lazy"
+                          className="w-full rounded-xl mb-4 object-cover max-h-96"
+                        />
+                      )}
 
                       {/* Actions */}
                       <div className="flex items-center gap-6 pt-3 border-t border-border">
@@ -431,7 +475,7 @@ export default function CommunityPage() {
                         </button>
                         <button className="flex items-center gap-2 text-sm text-muted-foreground hover:text-primary transition-colors">
                           <MessageCircle className="w-5 h-5" />
-                          <span>{post.comments?.length || 0}</span>
+                          <span>{post.comment_count || 0}</span>
                         </button>
                         <button className="flex items-center gap-2 text-sm text-muted-foreground hover:text-primary transition-colors ml-auto">
                           <Share2 className="w-5 h-5" />
@@ -442,6 +486,11 @@ export default function CommunityPage() {
                 </motion.div>
               ))
             )}
+            {nextCursor && (
+              <Button variant="ghost" className="w-full" onClick={() => fetchPosts(nextCursor)}>
+                Carica altri post
+              </Button>
+            )}
           </div>
         </ScrollArea>
 
@@ -241,7 +241,8 @@ export default function MonteCarloPage() {
       const res = await axios.post(`${API}/montecarlo/simulate`, {
         ...params,
         win_rate: params.win_rate / 100,
-        risk_per_trade: params.risk_per_trade / 100
+        risk_per_trade: params.risk_per_trade / 100,
+        max_points: 300
       });
 
       setLoadingProgress(100);
@@ -279,13 +280,19 @@ export default function MonteCarloPage() {
 
   const metrics = calculateMetrics();
 
-  // Format equity curves for chart
-  const chartData = results?.equity_curves?.[0]?.map((value, i) => ({
-    trade: i,
-    ...Object.fromEntries(
-      results.equity_curves.slice(0, 50).map((curve, j) => [`sim${j}`, curve[i]])
-    )
-  })) || [];
+  // Format equity curves for chart (downsampled curves carry their own trade indices)
+  const chartData = (() => {
+    if (!results?.equity_curves) return [];
+    const rows = new Map();
+    results.equity_curves.slice(0, 50).forEach((curve, j) => {
+      curve.forEach((value, i) => {
+        const trade = results.equity_curve_steps ? results.equity_curve_steps[j][i] : i;
+        if (!rows.has(trade)) rows.set(trade, { trade });
+        rows.get(trade)[`sim${j}`] = value;
+      });
+    });
+    return [...rows.values()].sort((a, b) => a.trade - b.trade);
+  })();
 
   const curveColors = [
     '#10b981', '#3b82f6', '#8b5cf6', '#f59e0b', '#ef4444',
@@ -678,6 +685,8 @@ export default function MonteCarloPage() {
                         <CartesianGrid strokeDasharray="3 3" className="opacity-20" />
                         <XAxis
                           dataKey="trade"
+                          type="number"
+                          domain={['dataMin', 'dataMax']}
                           stroke="#666"
                           tick={{ fontSize: 10 }}
                         />
@@ -704,6 +713,7 @@ export default function MonteCarloPage() {
                             strokeWidth={1}
                             dot={false}
                             opacity={0.5}
+                            connectNulls
                           />
                         ))}
                       </LineChart>
@@ -120,6 +120,13 @@ export default function PsychologyPage() {
     grace_tokens: 3
   });
 
+  // Engine state lives on the server; load it once on mount
+  useEffect(() => {
+    axios.get(`${API}/psychology/engine-state`)
+      .then(res => setEngineState(res.data))
+      .catch(error => console.error('Engine state error:', error));
+  }, []);
+
   // EOD Form State
   const [eodForm, setEodForm] = useState({
     stress: 5,
@@ -191,11 +198,8 @@ export default function PsychologyPage() {
       toast.success('Analisi EOD completata');
 
       // Update engine state from response
-      if (response.data.data_updates) {
-        setEngineState(prev => ({
-          ...prev,
-          grace_tokens: response.data.data_updates.grace_tokens_remaining
-        }));
+      if (response.data.engine_state) {
+        setEngineState(response.data.engine_state);
       }
     } catch (error) {
       console.error('EOD analysis error:', error);